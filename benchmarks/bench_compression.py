@@ -0,0 +1,42 @@
+""" Benchmark the hdf5 storage policies on sparse detector-like images
+
+    usage: python benchmarks/bench_compression.py
+"""
+import os
+import tempfile
+import time
+import numpy as np
+import datastorage
+
+
+def make_images(n=200, shape=(512, 512), occupancy=0.01):
+    images = np.zeros((n,) + shape, dtype=np.uint16)
+    mask = np.random.random(images.shape) < occupancy
+    images[mask] = np.random.randint(1, 1000, size=mask.sum())
+    return images
+
+
+def main():
+    d = dict(images=make_images(), i0=np.random.random(200), info="test")
+    policies = (
+        ("none", None),
+        ("lzf", "lzf"),
+        ("gzip-1", dict(compression_opts=1)),
+        ("gzip-4", dict(compression_opts=4)),
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        for name, policy in policies:
+            fname = os.path.join(folder, "compression_%s.h5" % name)
+            t0 = time.perf_counter()
+            datastorage.save(fname, d, storage_policy=policy, raiseError=True)
+            t1 = time.perf_counter()
+            datastorage.read(fname)
+            t2 = time.perf_counter()
+            print(
+                "%-8s write %6.3f s, read %6.3f s, size %7.2f MB"
+                % (name, t1 - t0, t2 - t1, os.path.getsize(fname) / 1e6)
+            )
+
+
+if __name__ == "__main__":
+    main()
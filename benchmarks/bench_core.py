@@ -0,0 +1,64 @@
+""" Microbenchmarks of the DataStorage container
+
+    construction, iteration and attribute access with many keys
+
+    usage: python benchmarks/bench_core.py [nkeys]
+"""
+import sys
+import numpy as np
+from datastorage import DataStorage
+from timing import timeit
+
+
+def main(nkeys=10000):
+    flat = dict(("key%05d" % i, i) for i in range(nkeys))
+    nested = dict(
+        ("group%03d" % i, dict(("key%03d" % j, np.ones(2)) for j in range(100)))
+        for i in range(nkeys // 100)
+    )
+    d = DataStorage(flat)
+    names = list(flat)
+
+    def construct():
+        DataStorage(flat)
+
+    def construct_nested():
+        DataStorage(nested)
+
+    def iterate():
+        for _ in d.items():
+            pass
+        for _ in d.values():
+            pass
+
+    def keys():
+        for _ in range(100):
+            "key00000" in d.keys()
+
+    def attribute():
+        for name in names:
+            getattr(d, name)
+
+    def setattribute():
+        for name in names:
+            setattr(d, name, 1)
+
+    def representation():
+        repr(d)
+
+    benchmarks = (
+        ("construct (flat)", construct),
+        ("construct (nested)", construct_nested),
+        ("items + values", iterate),
+        ("100 x keys()", keys),
+        ("attribute get", attribute),
+        ("attribute set", setattribute),
+        ("repr", representation),
+    )
+    print("%d keys" % nkeys)
+    for name, func in benchmarks:
+        print("%-20s %8.3f ms" % (name, timeit(func, repeat=20) * 1e3))
+
+
+if __name__ == "__main__":
+    main(*[int(v) for v in sys.argv[1:]])
@@ -0,0 +1,35 @@
+""" Benchmark reading a large store: h5 and npy (read in memory) against
+    dsdir (memory mapped)
+
+    usage: python benchmarks/bench_dsdir.py [size_MB]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import datastorage
+
+
+def main(size_mb=200):
+    n = int(size_mb * 1e6 / 8 / 10)
+    d = dict(("arr%02d" % i, np.random.random(n)) for i in range(10))
+    d["info"] = "benchmark"
+    with tempfile.TemporaryDirectory() as folder:
+        for ext in ("h5", "npy", "dsdir"):
+            fname = os.path.join(folder, "store.%s" % ext)
+            t0 = time.perf_counter()
+            datastorage.save(fname, d, raiseError=True)
+            t1 = time.perf_counter()
+            r = datastorage.read(fname)
+            t2 = time.perf_counter()
+            r.arr05[n // 2]
+            t3 = time.perf_counter()
+            print(
+                "%-6s write %6.3f s, read %8.4f s, first access %8.4f s"
+                % (ext, t1 - t0, t2 - t1, t3 - t2)
+            )
+
+
+if __name__ == "__main__":
+    main(*[float(v) for v in sys.argv[1:]])
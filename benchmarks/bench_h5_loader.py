@@ -0,0 +1,48 @@
+""" Benchmark reading hdf5 files with many small datasets
+
+    compares the recursive unwrapArray walk (used by read before the single
+    pass loader) with datastorage.read
+
+    usage: python benchmarks/bench_h5_loader.py [number of datasets ...]
+"""
+import os
+import sys
+import tempfile
+import h5py
+import numpy as np
+import datastorage
+from timing import timeit
+
+
+def make_data(ndatasets, per_group=100):
+    ngroups = max(1, ndatasets // per_group)
+    return dict(
+        (
+            "group%04d" % i,
+            dict(("dataset%03d" % j, np.arange(3) + j) for j in range(per_group)),
+        )
+        for i in range(ngroups)
+    )
+
+
+def read_recursive(fname):
+    with h5py.File(fname, "r") as h5:
+        # passing result selects the recursive walk
+        return datastorage.unwrapArray(h5, result=dict())
+
+
+def main(sizes=(1000, 10000, 100000)):
+    with tempfile.TemporaryDirectory() as folder:
+        for n in sizes:
+            fname = os.path.join(folder, "many_%d.h5" % n)
+            datastorage.save(fname, make_data(n), raiseError=True)
+            t_old = timeit(lambda: read_recursive(fname))
+            t_new = timeit(lambda: datastorage.read(fname))
+            print(
+                "%7d datasets: recursive %7.3f s, single pass %7.3f s (x%.1f)"
+                % (n, t_old, t_new, t_old / t_new)
+            )
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or (1000, 10000, 100000))
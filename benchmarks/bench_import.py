@@ -0,0 +1,84 @@
+""" Benchmark the time of "import datastorage" in fresh interpreters
+
+    reports the median time of import numpy (lower bound, datastorage needs
+    it) and of import datastorage, and checks that importing datastorage
+    (and reading/saving npz files) does not import h5py.
+    Exits with status 1 if the import takes more than --max-ms (above the
+    numpy import) or imports h5py, so it can guard against regressions.
+
+    usage: python benchmarks/bench_import.py [--repeat 10] [--max-ms 50]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+TIMED_IMPORT = """
+import time
+t0 = time.perf_counter()
+import %s
+print(time.perf_counter() - t0)
+"""
+
+NPZ_ONLY = """
+import os, sys, tempfile
+import datastorage
+with tempfile.TemporaryDirectory() as folder:
+    fname = os.path.join(folder, "data.npz")
+    datastorage.save(fname, dict(a=[1, 2, 3]), raiseError=True)
+    datastorage.read(fname)
+print("h5py" in sys.modules)
+"""
+
+
+def run(code):
+    env = dict(os.environ)
+    # the timings should include reading the cached bytecode, not compiling
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    return out.stdout.strip()
+
+
+def median_import_time(module, repeat):
+    # first run writes the bytecode caches
+    run(TIMED_IMPORT % module)
+    return statistics.median(
+        float(run(TIMED_IMPORT % module)) for _ in range(repeat)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="fail if import datastorage takes longer than import numpy + max-ms",
+    )
+    args = parser.parse_args()
+    t_numpy = median_import_time("numpy", args.repeat)
+    t_datastorage = median_import_time("datastorage", args.repeat)
+    h5py_imported = run(NPZ_ONLY) == "True"
+    print("import numpy        %6.1f ms" % (t_numpy * 1e3))
+    print(
+        "import datastorage  %6.1f ms (%+.1f ms)"
+        % (t_datastorage * 1e3, (t_datastorage - t_numpy) * 1e3)
+    )
+    print("h5py imported by npz read/save: %s" % h5py_imported)
+    failed = h5py_imported
+    if args.max_ms is not None and (t_datastorage - t_numpy) * 1e3 > args.max_ms:
+        print("import datastorage is slower than allowed (%.1f ms)" % args.max_ms)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
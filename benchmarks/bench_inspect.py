@@ -0,0 +1,55 @@
+""" Benchmark listing the content of a file (keys, shapes, dtypes) with
+    read (loads every dataset) and with inspect (summary index saved in
+    the file, or hdf5 metadata for files saved without index)
+
+    usage: python benchmarks/bench_inspect.py [nkeys] [array_kb]
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import datastorage
+from datastorage.datastorage import dictToH5
+from timing import timeit
+
+
+def make_data(nkeys, array_kb):
+    n = array_kb * 1024 // 8
+    runs = dict(
+        (
+            "run%04d" % i,
+            dict(signal=np.random.rand(n), energy=float(i), name="run%d" % i),
+        )
+        for i in range(nkeys // 3)
+    )
+    return dict(runs=runs)
+
+
+def main(nkeys=3000, array_kb=64):
+    data = make_data(nkeys, array_kb)
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "indexed.h5")
+        old = os.path.join(folder, "old.h5")
+        t_index = timeit(
+            lambda: datastorage.save(fname, data, link_copy=False, raiseError=True)
+        )
+        t_stats = timeit(
+            lambda: datastorage.save(
+                fname, data, link_copy=False, index_stats=True, raiseError=True
+            )
+        )
+        t_noindex = timeit(lambda: dictToH5(old, data))
+        print(
+            "save %.3f s, with index_stats %.3f s, without index %.3f s (%.0f MB)"
+            % (t_index, t_stats, t_noindex, os.path.getsize(fname) / 1e6)
+        )
+        t_read = timeit(lambda: datastorage.read(fname, raiseError=True))
+        t_inspect = timeit(lambda: datastorage.inspect(fname))
+        t_metadata = timeit(lambda: datastorage.inspect(old))
+        print("read                     %7.3f s" % t_read)
+        print("inspect (index)          %7.3f s" % t_inspect)
+        print("inspect (hdf5 metadata)  %7.3f s" % t_metadata)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+""" Benchmark saving with link_copy=True
+
+    saves N arrays (half of them duplicated) and prints the time per array;
+    with the hashed index the time per array should stay roughly constant
+    when N grows. The last case saves 5000 identical small arrays (every
+    array but the first one is linked) with and without link_copy
+
+    usage: python benchmarks/bench_link_copy.py
+"""
+import os
+import tempfile
+import time
+import numpy as np
+import datastorage
+
+
+def make_data(n, shape=(64, 64)):
+    unique = [np.random.random(shape) for _ in range(n // 2)]
+    d = dict()
+    for i in range(n):
+        d["img%04d" % i] = unique[i % len(unique)]
+    return d
+
+
+def bench(n, folder):
+    d = make_data(n)
+    fname = os.path.join(folder, "link_copy_%d.h5" % n)
+    t0 = time.perf_counter()
+    datastorage.save(fname, d, link_copy=True, raiseError=True)
+    dt = time.perf_counter() - t0
+    size = os.path.getsize(fname) / 1e6
+    return dt, size
+
+
+def bench_identical(n, folder, link_copy):
+    d = dict(("a%05d" % i, np.arange(100.0)) for i in range(n))
+    fname = os.path.join(folder, "identical_%s.h5" % link_copy)
+    t0 = time.perf_counter()
+    datastorage.save(fname, d, link_copy=link_copy, raiseError=True)
+    return time.perf_counter() - t0, os.path.getsize(fname) / 1e6
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        for n in (125, 250, 500, 1000):
+            dt, size = bench(n, folder)
+            print(
+                "%5d arrays: %.3f s (%.3f ms/array), file size %.1f MB"
+                % (n, dt, dt / n * 1e3, size)
+            )
+        for link_copy in (False, True):
+            dt, size = bench_identical(5000, folder, link_copy)
+            print(
+                "5000 identical arrays, link_copy=%-5s: %.3f s, file size %.1f MB"
+                % (link_copy, dt, size)
+            )
+
+
+if __name__ == "__main__":
+    main()
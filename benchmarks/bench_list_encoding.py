@@ -0,0 +1,50 @@
+""" Benchmark saving/reading lists of arrays in hdf5 files
+
+    compares the "compact" list encoding (stacked or ragged dataset) with
+    the "group" encoding (one dataset per element); note that with the
+    "group" encoding h5py already stacks lists of same shape arrays (that
+    are then read back as a single array rather than a list)
+
+    usage: python benchmarks/bench_list_encoding.py [n1 n2 ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import datastorage
+
+
+def make_lists(n):
+    same = [np.random.random(10) for _ in range(n)]
+    ragged = [np.random.random(np.random.randint(1, 20)) for _ in range(n)]
+    return dict(same_shape=same, ragged=ragged)
+
+
+def bench(n, kind, list_encoding, folder):
+    d = {kind: make_lists(n)[kind]}
+    fname = os.path.join(folder, "list_%s_%s_%d.h5" % (kind, list_encoding, n))
+    t0 = time.perf_counter()
+    datastorage.save(fname, d, list_encoding=list_encoding, raiseError=True)
+    t1 = time.perf_counter()
+    r = datastorage.read(fname)
+    t2 = time.perf_counter()
+    assert len(r[kind]) == n
+    return t1 - t0, t2 - t1, os.path.getsize(fname) / 1e6
+
+
+def main(sizes=(1000, 100000)):
+    with tempfile.TemporaryDirectory() as folder:
+        for n in sizes:
+            for kind in ("same_shape", "ragged"):
+                for list_encoding in ("group", "compact"):
+                    tw, tr, size = bench(n, kind, list_encoding, folder)
+                    print(
+                        "%7d %-10s %-8s write %8.3f s, read %8.3f s, size %7.2f MB"
+                        % (n, kind, list_encoding, tw, tr, size)
+                    )
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]]
+    main(*([sizes] if sizes else []))
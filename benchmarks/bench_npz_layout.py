@@ -0,0 +1,65 @@
+""" Benchmark the nested (pickled) and flat npz layouts
+
+    full read, read of a single key and lazy access to a single key, and
+    write/read of a list of 100k numbers (saved as one array member)
+
+    usage: python benchmarks/bench_npz_layout.py
+"""
+import os
+import tempfile
+import numpy as np
+import datastorage
+from timing import timeit
+
+
+def make_data(nruns=20, n=200000):
+    return dict(
+        ("run%02d" % i, dict(i0=np.random.random(n), img=np.random.random((8, n // 8))))
+        for i in range(nruns)
+    )
+
+
+def main():
+    d = make_data()
+    with tempfile.TemporaryDirectory() as folder:
+        for layout in ("nested", "flat"):
+            for policy in (None, "gzip"):
+                fname = os.path.join(folder, "store_%s_%s.npz" % (layout, policy))
+                tw = timeit(
+                    lambda: datastorage.save(
+                        fname, d, npz_layout=layout, storage_policy=policy, raiseError=True
+                    )
+                )
+                tr = timeit(lambda: datastorage.read(fname))
+                tk = timeit(lambda: datastorage.read(fname, keys="run05/i0"))
+                line = "%-6s %-5s write %6.3f s, read %6.3f s, one key %6.3f s" % (
+                    layout,
+                    policy,
+                    tw,
+                    tr,
+                    tk,
+                )
+                if layout == "flat":
+
+                    def lazy():
+                        with datastorage.read(fname, lazy=True) as r:
+                            r.run05.i0.read()
+
+                    line += ", lazy one key %6.3f s" % timeit(lazy)
+                print(line)
+            fname = os.path.join(folder, "list_%s.npz" % layout)
+            numbers = dict(positions=list(range(100000)))
+            tw = timeit(
+                lambda: datastorage.save(
+                    fname, numbers, npz_layout=layout, raiseError=True
+                )
+            )
+            tr = timeit(lambda: datastorage.read(fname))
+            print(
+                "%-6s list  write %6.3f s, read %6.3f s, file %.2f MB"
+                % (layout, tw, tr, os.path.getsize(fname) / 1e6)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+""" Benchmark gzip compressed hdf5 writes of a large image stack with the
+    chunks compressed by h5py (workers=1) or by a thread pool (direct chunk
+    writes, see datastorage.compress)
+
+    the throughput should scale with the number of cores (up to the disk
+    bandwidth); on a single core machine the timings are about the same
+
+    usage: python benchmarks/bench_parallel_compression.py [--size-mb 2048]
+           [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import tempfile
+import numpy as np
+import datastorage
+from timing import timeit
+
+
+def make_stack(size_mb, shape=(1024, 1024)):
+    """ uint16 detector-like images (smooth background + poisson noise) """
+    nimages = max(1, int(size_mb * 1024 ** 2 // (2 * shape[0] * shape[1])))
+    rng = np.random.default_rng(0)
+    y, x = np.indices(shape)
+    background = 100 + 50 * np.sin(x / 50.0) * np.cos(y / 70.0)
+    stack = np.empty((nimages,) + shape, dtype=np.uint16)
+    for i in range(nimages):
+        stack[i] = rng.poisson(background)
+    return stack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size-mb", type=float, default=2048)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1]
+    )
+    parser.add_argument("--level", type=int, default=4, help="gzip level")
+    args = parser.parse_args()
+    stack = make_stack(args.size_mb)
+    print(
+        "stack %s %s (%.0f MB), %d cpus"
+        % (stack.shape, stack.dtype, stack.nbytes / 1e6, os.cpu_count() or 1)
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "stack.h5")
+        for workers in sorted(set(args.workers)):
+            policy = datastorage.StoragePolicy(
+                compression="gzip", compression_opts=args.level, workers=workers
+            )
+            dt = timeit(
+                lambda: datastorage.save(
+                    fname,
+                    dict(images=stack),
+                    link_copy=False,
+                    storage_policy=policy,
+                    raiseError=True,
+                )
+            )
+            ratio = stack.nbytes / os.path.getsize(fname)
+            print(
+                "workers %3d  %7.2f s  %8.1f MB/s  ratio %.2f"
+                % (workers, dt, stack.nbytes / dt / 1e6, ratio)
+            )
+
+
+if __name__ == "__main__":
+    main()
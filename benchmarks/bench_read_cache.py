@@ -0,0 +1,38 @@
+""" Benchmark repeated reads of the same files with and without the read
+    cache (best of 10 reads)
+
+    usage: python benchmarks/bench_read_cache.py
+"""
+import os
+import tempfile
+import numpy as np
+import datastorage
+from timing import timeit
+
+
+def make_data(nkeys=200):
+    return dict(
+        ("run%03d" % i, dict(i0=np.random.random(1000), img=np.random.random((64, 64))))
+        for i in range(nkeys)
+    )
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        for ext in ("h5", "npz", "dsdir"):
+            fname = os.path.join(folder, "data.%s" % ext)
+            datastorage.save(fname, make_data(), raiseError=True)
+            t_nocache = timeit(lambda: datastorage.read(fname, cache=False), repeat=10)
+            datastorage.enable_read_cache()
+            datastorage.read(fname)
+            t_cache = timeit(lambda: datastorage.read(fname), repeat=10)
+            info = datastorage.read_cache_info()
+            datastorage.disable_read_cache()
+            print(
+                "%-5s read %7.4f s, cached read %7.4f s (x%.0f), cache %.1f MB"
+                % (ext, t_nocache, t_cache, t_nocache / t_cache, info["nbytes"] / 1e6)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+""" Benchmark reading many (compressed) hdf5 files with read_many
+
+    usage: python benchmarks/bench_read_many.py [nfiles]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import datastorage
+
+
+def make_files(folder, nfiles):
+    files = []
+    for i in range(nfiles):
+        fname = os.path.join(folder, "run%04d.h5" % i)
+        d = dict(
+            img=np.random.poisson(2, size=(20, 256, 256)).astype(np.uint16),
+            i0=np.random.random(20),
+            run=i,
+        )
+        datastorage.save(fname, d, storage_policy="gzip", raiseError=True)
+        files.append(fname)
+    return files
+
+
+def main(nfiles=32):
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_files(folder, nfiles)
+        t0 = time.perf_counter()
+        ref = [datastorage.read(f) for f in files]
+        print("sequential            %.3f s" % (time.perf_counter() - t0))
+        for executor in ("thread", "process"):
+            for workers in (2, 4, 8):
+                t0 = time.perf_counter()
+                res = datastorage.read_many(files, workers=workers, executor=executor)
+                dt = time.perf_counter() - t0
+                assert all(r.run == q.run for r, q in zip(res, ref))
+                print("%-8s %2d workers   %.3f s" % (executor, workers, dt))
+
+
+if __name__ == "__main__":
+    main(*[int(v) for v in sys.argv[1:]])
@@ -0,0 +1,68 @@
+""" Benchmark saving/reading a list of 10k records (per-peak fit results)
+    as one group per record (list_encoding="group", the previous encoding)
+    and as columns (list_encoding="compact"), read back as list of records
+    or as columns (stack_lists=True)
+
+    usage: python benchmarks/bench_records.py [nrecords]
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import h5py
+import datastorage
+from timing import timeit
+
+
+def make_records(nrecords):
+    rng = np.random.default_rng(0)
+    return [
+        datastorage.DataStorage(
+            center=rng.random(),
+            width=rng.random(),
+            amplitude=rng.random(),
+            name="peak%05d" % i,
+            profile=rng.random(8),
+            fit=dict(chi2=rng.random(), niter=int(rng.integers(1, 50))),
+        )
+        for i in range(nrecords)
+    ]
+
+
+def count_objects(fname):
+    names = []
+    with h5py.File(fname, "r") as h5:
+        h5.visit(names.append)
+    return len(names)
+
+
+def main(nrecords=10000):
+    data = dict(peaks=make_records(nrecords))
+    with tempfile.TemporaryDirectory() as folder:
+        for list_encoding in ("group", "compact"):
+            fname = os.path.join(folder, "%s.h5" % list_encoding)
+            t_save = timeit(
+                lambda: datastorage.save(
+                    fname, data, list_encoding=list_encoding, raiseError=True
+                )
+            )
+            t_list = timeit(lambda: datastorage.read(fname, raiseError=True))
+            t_columns = timeit(
+                lambda: datastorage.read(fname, stack_lists=True, raiseError=True)
+            )
+            print(
+                "%-8s save %7.3f s, read (list) %7.3f s, read (columns) %7.3f s,"
+                " %6d hdf5 objects, file %6.2f MB"
+                % (
+                    list_encoding,
+                    t_save,
+                    t_list,
+                    t_columns,
+                    count_objects(fname),
+                    os.path.getsize(fname) / 1e6,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
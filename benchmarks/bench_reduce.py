@@ -0,0 +1,49 @@
+""" Benchmark out-of-core reductions against reading the whole array
+
+    mean and histogram of a stack of images saved in hdf5 (chunked, gzip)
+    and dsdir, time and peak memory (tracemalloc, in a separate run, that
+    does not count the pages of memory mapped dsdir arrays)
+
+    usage: python benchmarks/bench_reduce.py [number of images]
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import datastorage
+from timing import peak_memory, timeit
+
+
+def main(nimages=2000, shape=(256, 256)):
+    images = np.random.random((nimages,) + shape).astype(np.float32)
+    print("%d images, %.0f MB" % (nimages, images.nbytes / 1e6))
+    with tempfile.TemporaryDirectory() as folder:
+        for ext, policy in (("h5", "gzip"), ("h5", None), ("dsdir", None)):
+            fname = os.path.join(folder, "images.%s" % ext)
+            datastorage.save(
+                fname, dict(images=images), storage_policy=policy, raiseError=True
+            )
+            cases = (
+                ("full read mean", lambda: datastorage.read(fname).images.mean(axis=0)),
+                ("reduce mean", lambda: datastorage.reduce(fname, "images", "mean")),
+                (
+                    "full read histogram",
+                    lambda: np.histogram(datastorage.read(fname).images, bins=100),
+                ),
+                (
+                    "reduce histogram",
+                    lambda: datastorage.reduce(
+                        fname, "images", "histogram", bins=100, range=(0, 1)
+                    ),
+                ),
+            )
+            for name, func in cases:
+                t, peak = timeit(func), peak_memory(func)
+                print(
+                    "%-5s %-5s %-20s %7.3f s, peak memory %7.1f MB"
+                    % (ext, policy, name, t, peak / 1e6)
+                )
+
+
+if __name__ == "__main__":
+    main(*[int(n) for n in sys.argv[1:]])
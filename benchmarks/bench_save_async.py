@@ -0,0 +1,69 @@
+""" Benchmark the time an acquisition loop is blocked by checkpoints
+
+    every iteration "acquires" an image (50 ms) and saves all the images
+    acquired so far, with save (blocking) and save_async (copy and freeze
+    snapshots); the images are either added as new keys or written in place
+    in a preallocated array (with frozen snapshots this raises ValueError
+    when the previous save is still pending)
+
+    usage: python benchmarks/bench_save_async.py
+"""
+import os
+import tempfile
+import time
+import numpy as np
+import datastorage
+
+
+def loop(fname, save, inplace, niter=20, shape=(512, 512), acquisition_time=0.05):
+    """ return total time spent in save calls and total time of the loop """
+    data = datastorage.DataStorage()
+    if inplace:
+        data["images"] = np.zeros((niter,) + shape)
+    blocked = 0
+    t_start = time.perf_counter()
+    for i in range(niter):
+        time.sleep(acquisition_time)
+        if inplace:
+            data["images"][i] = np.random.random(shape)
+        else:
+            data["image%03d" % i] = np.random.random(shape)
+        t0 = time.perf_counter()
+        save(fname, data)
+        blocked += time.perf_counter() - t0
+    datastorage.background.wait()
+    return blocked, time.perf_counter() - t_start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "checkpoint.h5")
+        savers = (
+            ("save", lambda f, d: datastorage.save(f, d, link_copy=False)),
+            (
+                "save_async (copy)",
+                lambda f, d: datastorage.save_async(f, d, link_copy=False),
+            ),
+            (
+                "save_async (freeze)",
+                lambda f, d: datastorage.save_async(
+                    f, d, link_copy=False, snapshot="freeze"
+                ),
+            ),
+        )
+        for inplace in (False, True):
+            print("images written %s" % ("in place" if inplace else "as new keys"))
+            for name, save in savers:
+                try:
+                    blocked, total = loop(fname, save, inplace)
+                except ValueError as e:
+                    datastorage.background.flush()
+                    print("%-20s fails (ValueError: %s)" % (name, e))
+                    continue
+                print(
+                    "%-20s loop blocked %6.3f s, total %6.3f s" % (name, blocked, total)
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+""" Benchmark saving/reading trees of 10k scalar parameters (ints, floats,
+    numpy scalars, short strings, None) with one dataset per scalar
+    (scalar_encoding="dataset") and with the scalars of each group packed
+    in one dataset (scalar_encoding="packed"): save/read time, file size
+    and number of hdf5 objects
+
+    usage: python benchmarks/bench_scalars.py [nscalars] [ngroups]
+"""
+import os
+import sys
+import tempfile
+import h5py
+import numpy as np
+import datastorage
+from timing import timeit
+
+
+def make_tree(nscalars, ngroups):
+    per_group = nscalars // ngroups
+    kinds = (
+        lambda i: i,
+        lambda i: i * 0.5,
+        lambda i: "param%d" % i,
+        lambda i: None,
+        lambda i: i % 2 == 0,
+        lambda i: np.float32(i),
+    )
+    return dict(
+        (
+            "group%04d" % g,
+            dict(
+                ("p%05d" % i, kinds[i % len(kinds)](i)) for i in range(per_group)
+            ),
+        )
+        for g in range(ngroups)
+    )
+
+
+def count_objects(fname):
+    names = []
+    with h5py.File(fname, "r") as h5:
+        h5.visit(names.append)
+    return len(names)
+
+
+def main(nscalars=10000, ngroups=100):
+    data = make_tree(nscalars, ngroups)
+    print("%d scalars in %d groups" % (nscalars, ngroups))
+    with tempfile.TemporaryDirectory() as folder:
+        for scalar_encoding in ("dataset", "packed"):
+            fname = os.path.join(folder, "%s.h5" % scalar_encoding)
+            t_save = timeit(
+                lambda: datastorage.save(
+                    fname, data, scalar_encoding=scalar_encoding, raiseError=True
+                ),
+                repeat=3,
+            )
+            t_read = timeit(
+                lambda: datastorage.read(fname, raiseError=True), repeat=3
+            )
+            group = datastorage.read(fname)["group0000"]
+            assert dict(group.items()) == data["group0000"]
+            print(
+                "%-8s save %7.3f s, read %7.3f s, %6d hdf5 objects, file %7.2f MB"
+                % (
+                    scalar_encoding,
+                    t_save,
+                    t_read,
+                    count_objects(fname),
+                    os.path.getsize(fname) / 1e6,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
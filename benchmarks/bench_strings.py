@@ -0,0 +1,64 @@
+""" Benchmark saving/reading 1M string labels in hdf5 files
+
+    "old" is the previous conversion (one encode("ascii") per label, read
+    back with astype(str)), the others are datastorage.save/read with
+    fixed and variable length utf8 strings
+
+    usage: python benchmarks/bench_strings.py [nlabels]
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import h5py
+import datastorage
+from timing import timeit
+
+
+def save_old(fname, labels):
+    with h5py.File(fname, "w") as h5:
+        h5["labels"] = np.asarray([vv.encode("ascii") for vv in labels])
+
+
+def read_old(fname):
+    with h5py.File(fname, "r") as h5:
+        return h5["labels"][()].astype(str)
+
+
+def main(nlabels=1000000):
+    rng = np.random.default_rng(0)
+    ids = rng.integers(0, 10 ** 6, nlabels)
+    cases = dict(
+        ascii=np.char.add("sample_", ids.astype(str)),
+        utf8=np.char.add("échantillon_", ids.astype(str)),
+        # a few long labels, variable length strings are used
+        skewed=np.where(ids % 1000 == 0, "x" * 200, ids.astype(str)),
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "labels.h5")
+        for name, labels in cases.items():
+            try:
+                t_save = timeit(lambda: save_old(fname, labels), repeat=3)
+                t_read = timeit(lambda: read_old(fname), repeat=3)
+                print(
+                    "%-7s old           save %6.3f s, read %6.3f s"
+                    % (name, t_save, t_read)
+                )
+            except UnicodeError as e:
+                print("%-7s old           fails: %s" % (name, type(e).__name__))
+            data = dict(labels=labels)
+            t_save = timeit(
+                lambda: datastorage.save(fname, data, raiseError=True), repeat=3
+            )
+            t_read = timeit(lambda: datastorage.read(fname, raiseError=True), repeat=3)
+            assert (datastorage.read(fname).labels == labels).all()
+            with h5py.File(fname, "r") as h5:
+                kind = "vlen" if h5["labels"].dtype.kind == "O" else "fixed"
+            print(
+                "%-7s datastorage %-5s save %6.3f s, read %6.3f s, file %5.1f MB"
+                % (name, kind, t_save, t_read, os.path.getsize(fname) / 1e6)
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,62 @@
+""" Benchmark unwrap of 1M records (list and generator) against the
+    previous implementation (one np.asarray of a list per top-level key,
+    nested records end up in object arrays)
+
+    time and peak memory (tracemalloc) are measured in separate runs
+
+    usage: python benchmarks/bench_unwrap.py [nrecords]
+"""
+import sys
+import numpy as np
+import datastorage
+from timing import peak_memory, timeit
+
+
+def unwrap_old(list_of_datastorages):
+    retout = datastorage.DataStorage()
+    for key in list_of_datastorages[0].keys():
+        retout[key] = np.asarray([r[key] for r in list_of_datastorages])
+    return retout
+
+
+def record(i):
+    """ result of a per-point fit (plain dicts, creating 1M DataStorage
+        would dominate the timings) """
+    return dict(
+        x=i,
+        y=i * 0.5,
+        chi2=float(i % 7),
+        spectrum=np.full(16, i, dtype=np.float32),
+        fit=dict(center=i * 0.1, width=1.0, success=True),
+    )
+
+
+def main(nrecords=1000000):
+    records = [record(i) for i in range(nrecords)]
+    t_gen = timeit(lambda: [record(i) for i in range(nrecords)])
+    cases = (
+        ("old unwrap (list)", lambda: unwrap_old(records)),
+        ("unwrap (list)", lambda: datastorage.unwrap(records)),
+        (
+            "old unwrap (gen)",
+            lambda: unwrap_old([record(i) for i in range(nrecords)]),
+        ),
+        (
+            "unwrap (generator)",
+            lambda: datastorage.unwrap(record(i) for i in range(nrecords)),
+        ),
+    )
+    print("creating the records takes %.3f s (included in the gen timings)" % t_gen)
+    for name, func in cases:
+        dt = timeit(func)
+        peak = peak_memory(func)
+        print(
+            "%-20s %7.3f s (%5.2f M records/s), peak memory %7.1f MB"
+            % (name, dt, nrecords / dt / 1e6, peak / 1e6)
+        )
+    print("old unwrap: fit is %s" % unwrap_old(records[:10]).fit.dtype)
+    print("unwrap:     fit.center is %s" % datastorage.unwrap(records[:10]).fit.center)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,292 @@
+""" Benchmark suite for save/read of all the formats
+
+    every case is a dict built by a generator function and parametrized by
+    a sweep (array size, nesting depth, number of keys, list length,
+    strings, None values, link_copy); each case is saved and read back in
+    every format, measuring time (best of --repeat), peak memory (with
+    tracemalloc, in a separate run since it slows down the timing),
+    throughput and file size
+
+    usage:
+      python benchmarks/suite.py run -o results.json [--quick] [--formats h5,npz]
+                                     [--cases array,depth] [--repeat 3]
+      python benchmarks/suite.py compare old.json new.json [--threshold 0.1]
+
+    compare prints the ratio new/old of the times and exits with status 1
+    if any of them got slower than threshold
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import numpy as np
+import datastorage
+from timing import peak_memory, times
+
+FORMATS = ("h5", "npz", "npy", "dsdir")
+
+
+def case_array(size):
+    return dict(a=np.random.random(size))
+
+
+def case_depth(depth):
+    d = dict(leaf=np.arange(100), scalar=1.0)
+    for i in range(depth):
+        d = dict(("level%d_%d" % (i, j), d) for j in range(2))
+    return d
+
+
+def case_keys(nkeys):
+    return dict(("key%05d" % i, np.arange(10)) for i in range(nkeys))
+
+
+def case_list(length):
+    return dict(
+        ints=list(range(length)),
+        arrays=[np.arange(10) * i for i in range(min(length, 1000))],
+    )
+
+
+def case_strings(nstrings):
+    return dict(
+        labels=["label_%d" % i for i in range(nstrings)],
+        array=np.asarray(["label_%d" % i for i in range(nstrings)]),
+        info="this is a string",
+    )
+
+
+def case_none(nkeys):
+    return dict(("key%05d" % i, None) for i in range(nkeys))
+
+
+def case_link_copy(ncopies):
+    a = np.random.random((1000, 1000))
+    return dict(("v%d" % i, a) for i in range(ncopies))
+
+
+# name -> (function, parameter name, values, quick values, extra save kwargs)
+CASES = dict(
+    array=(case_array, "size", [10 ** 3, 10 ** 5, 10 ** 7], [10 ** 3, 10 ** 5], {}),
+    depth=(case_depth, "depth", [1, 4, 10], [1, 4], {}),
+    keys=(case_keys, "nkeys", [10, 1000, 10000], [10, 1000], {}),
+    list=(case_list, "length", [10, 1000, 100000], [10, 1000], {}),
+    strings=(case_strings, "nstrings", [10, 1000, 100000], [10, 1000], {}),
+    none=(case_none, "nkeys", [10, 1000], [10], {}),
+    link_copy=(case_link_copy, "ncopies", [10], [3], dict(link_copy=True)),
+    no_link_copy=(case_link_copy, "ncopies", [10], [3], dict(link_copy=False)),
+)
+
+
+def payload_bytes(value):
+    """ approximate size of the data (arrays and strings) in value """
+    if isinstance(value, dict):
+        return sum(payload_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_bytes(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if value is None:
+        return 0
+    return 8
+
+
+def file_bytes(fname):
+    if os.path.isdir(fname):
+        return sum(
+            os.path.getsize(os.path.join(root, f))
+            for root, _, files in os.walk(fname)
+            for f in files
+        )
+    return os.path.getsize(fname)
+
+
+def remove(fname):
+    if os.path.isdir(fname):
+        shutil.rmtree(fname)
+    elif os.path.exists(fname):
+        os.remove(fname)
+
+
+def run_one(d, fname, save_kw, repeat):
+    def write():
+        remove(fname)
+        datastorage.save(fname, d, raiseError=True, **save_kw)
+
+    def read():
+        datastorage.read(fname)
+
+    nbytes = payload_bytes(d)
+    write_times = times(write, repeat)
+    read_times = times(read, repeat)
+    write_s, write_median_s = min(write_times), float(np.median(write_times))
+    read_s, read_median_s = min(read_times), float(np.median(read_times))
+    result = dict(
+        payload_bytes=nbytes,
+        file_bytes=file_bytes(fname),
+        write_s=write_s,
+        write_median_s=write_median_s,
+        read_s=read_s,
+        read_median_s=read_median_s,
+        write_MBps=nbytes / write_s / 1e6,
+        read_MBps=nbytes / read_s / 1e6,
+        write_peak_bytes=peak_memory(write),
+        read_peak_bytes=peak_memory(read),
+    )
+    remove(fname)
+    return result
+
+
+def metadata():
+    try:
+        import h5py
+
+        h5py_version = h5py.__version__
+    except ImportError:
+        h5py_version = None
+    return dict(
+        date=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=sys.version.split()[0],
+        numpy=np.__version__,
+        h5py=h5py_version,
+        datastorage=datastorage.__version__,
+        platform=platform.platform(),
+        machine=platform.machine(),
+    )
+
+
+def run(cases=None, formats=FORMATS, quick=False, repeat=3, verbose=True):
+    """ run the benchmarks and return the results as dict """
+    if cases is None:
+        cases = list(CASES)
+    results = []
+    folder = tempfile.mkdtemp(prefix="datastorage_bench_")
+    try:
+        for name in cases:
+            func, param, values, quick_values, save_kw = CASES[name]
+            for value in quick_values if quick else values:
+                np.random.seed(0)
+                d = func(value)
+                for fmt in formats:
+                    fname = os.path.join(folder, "%s.%s" % (name, fmt))
+                    entry = dict(case=name, params={param: value}, format=fmt)
+                    try:
+                        entry.update(run_one(d, fname, save_kw, repeat))
+                    except Exception as e:
+                        remove(fname)
+                        entry["error"] = "%s: %s" % (type(e).__name__, e)
+                    results.append(entry)
+                    if verbose:
+                        print(format_result(entry))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return dict(meta=metadata(), results=results)
+
+
+def result_id(entry):
+    params = ",".join("%s=%s" % kv for kv in sorted(entry["params"].items()))
+    return "%s[%s] %s" % (entry["case"], params, entry["format"])
+
+
+def format_result(entry):
+    if "error" in entry:
+        return "%-36s %s" % (result_id(entry), entry["error"])
+    return (
+        "%-36s write %8.4f s (%8.1f MB/s, peak %7.1f MB)"
+        " read %8.4f s (%8.1f MB/s, peak %7.1f MB) file %8.2f MB"
+        % (
+            result_id(entry),
+            entry["write_s"],
+            entry["write_MBps"],
+            entry["write_peak_bytes"] / 1e6,
+            entry["read_s"],
+            entry["read_MBps"],
+            entry["read_peak_bytes"] / 1e6,
+            entry["file_bytes"] / 1e6,
+        )
+    )
+
+
+def compare(old, new, threshold=0.1, min_time=1e-3, verbose=True):
+    """ compare two results (as returned by run), return list of the
+        regressions (ids of the entries whose write or read time grew by
+        more than threshold); times below min_time (s) are considered noise
+    """
+    old = dict((result_id(e), e) for e in old["results"] if "error" not in e)
+    regressions = []
+    for entry in new["results"]:
+        rid = result_id(entry)
+        if "error" in entry or rid not in old:
+            continue
+        line = "%-36s" % rid
+        for what, label in (
+            ("write_s", "write"),
+            ("read_s", "read"),
+            ("write_peak_bytes", "write mem"),
+            ("read_peak_bytes", "read mem"),
+        ):
+            before, after = old[rid][what], entry[what]
+            ratio = after / before if before > 0 else float("nan")
+            flag = ""
+            is_time = what.endswith("_s")
+            if ratio > 1 + threshold and (not is_time or after > min_time):
+                flag = "!"
+                if is_time:
+                    regressions.append("%s %s" % (rid, what))
+            elif ratio < 1 - threshold and (not is_time or before > min_time):
+                flag = "+"
+            line += " %s %5.2f%-1s" % (label, ratio, flag)
+        if verbose:
+            print(line)
+    if verbose:
+        print(
+            "\nratio new/old of time and peak memory; "
+            "! worse, + better by more than %d%%" % (threshold * 100)
+        )
+        for r in regressions:
+            print("REGRESSION %s" % r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="run the benchmarks")
+    p.add_argument("-o", "--output", help="json file to save the results to")
+    p.add_argument("--quick", action="store_true", help="smaller sweep")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--formats", default=",".join(FORMATS))
+    p.add_argument("--cases", default=",".join(CASES))
+    p = sub.add_parser("compare", help="compare two result files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.1)
+    p.add_argument("--min-time", type=float, default=1e-3)
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run(
+            cases=args.cases.split(","),
+            formats=args.formats.split(","),
+            quick=args.quick,
+            repeat=args.repeat,
+        )
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1)
+        return 0
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, threshold=args.threshold, min_time=args.min_time)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+""" timing helpers shared by the benchmarks
+
+    the benchmarks are run as scripts (python benchmarks/bench_xxx.py), so
+    this folder is in sys.path and they can use: from timing import timeit
+"""
+import time
+import tracemalloc
+
+
+def times(func, repeat=1):
+    """ return the list of the run times (s) of repeat calls of func() """
+    ret = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        ret.append(time.perf_counter() - t0)
+    return ret
+
+
+def timeit(func, repeat=1):
+    """ return the best run time (s) of repeat calls of func() """
+    return min(times(func, repeat))
+
+
+def peak_memory(func):
+    """ return the peak memory (bytes) allocated by python during func() """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
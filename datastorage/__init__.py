@@ -1,4 +1,34 @@
-from .datastorage import DataStorage, read, save, unwrap, unwrapArray
-from .test import doTest
+from .datastorage import (
+    DataStorage,
+    StoragePolicy,
+    read,
+    read_many,
+    save,
+    unwrap,
+    unwrapArray,
+)
+from .backends import Backend, register_backend
+from .lazy import LazyDataStorage, LazyDataset
+from .background import AsyncWriter, save_async
+from .chunked import Reducer, reduce
+from .cache import (
+    ReadCache,
+    disable_read_cache,
+    enable_read_cache,
+    invalidate_read_cache,
+    read_cache_info,
+)
+from .stats import IOStats, collect_stats
+from .summary import inspect
+from .writer import DataStorageWriter
 
 __version__ = "0.7"
+
+
+def __getattr__(name):
+    # the test module is imported only when used
+    if name == "doTest":
+        from .test import doTest
+
+        return doTest
+    raise AttributeError("module %s has no attribute %s" % (__name__, name))
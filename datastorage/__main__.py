@@ -0,0 +1,52 @@
+""" command line interface
+
+    python -m datastorage info run.h5 [other files] [--keys images run/x]
+    python -m datastorage info run.h5 --json
+
+    info lists the keys of the files (shapes, dtypes and sizes) from their
+    summary index, without reading the datasets (see datastorage.inspect)
+"""
+import argparse
+import json
+import sys
+
+from .summary import format_index, inspect
+
+
+def info(args):
+    failed = False
+    results = dict()
+    for fname in args.files:
+        try:
+            results[fname] = inspect(fname, keys=args.keys)
+        except Exception as e:
+            print("%s: %s" % (fname, e), file=sys.stderr)
+            failed = True
+    if args.json:
+        print(json.dumps(results, indent=1))
+    else:
+        for fname, entries in results.items():
+            print(fname)
+            print(format_index(entries))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m datastorage")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    parser_info = commands.add_parser(
+        "info", help="list the keys of stored files without reading them"
+    )
+    parser_info.add_argument("files", nargs="+")
+    parser_info.add_argument(
+        "--keys", nargs="+", default=None, help="only these keys (and their content)"
+    )
+    parser_info.add_argument("--json", action="store_true", help="json output")
+    parser_info.set_defaults(run=info)
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+""" registry of the file formats (backends) used by read and save
+
+    the backend is chosen by the extension of the file name; other formats
+    can be added:
+
+    def read_mat(fname, keys=None, **options):
+        return scipy.io.loadmat(fname)
+
+    def save_mat(fname, d, **options):
+        scipy.io.savemat(fname, d)
+
+    datastorage.register_backend(Backend("matlab", read_mat, save_mat), ".mat")
+
+    read and save pass all their keywords (keys, add_attrs, locking,
+    storage_policy, ...) to the backend, each backend uses the ones it
+    supports. Optional dependencies (like h5py) should be imported by the
+    backend functions (or with lazy_import) so that importing datastorage
+    stays fast.
+"""
+import importlib
+import pathlib
+
+
+class _LazyModule(object):
+    """ proxy of a module imported on first attribute access """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "not imported" if self._module is None else "imported"
+        return "lazy module %s (%s)" % (self._name, state)
+
+
+def lazy_import(name):
+    """ module name, imported when one of its attributes is first used """
+    return _LazyModule(name)
+
+
+class Backend(object):
+    """ reader/writer of a file format
+
+        name: name of the format (used in messages)
+        read: function(fname, keys=None, **options) returning a dict
+        save: function(fname, d, **options), d is a dict (as returned by
+              toDict)
+        lazy: function(fname, keys=None, **options) returning a
+              LazyDataStorage (None if the format can not be read lazily)
+        exists: function(fname) True if fname is a file of this format
+                (default: fname is a file)
+        incremental: True if save supports the paths option (keys to
+                     rewrite in an existing file, see save(incremental=True))
+        inspect: function(fname) returning the summary index of the file
+                 (None if it has none, see datastorage.inspect); backends
+                 with inspect get the index to store as index option of save
+    """
+
+    def __init__(
+        self,
+        name,
+        read,
+        save,
+        lazy=None,
+        exists=None,
+        incremental=False,
+        inspect=None,
+    ):
+        self.name = name
+        self.read = read
+        self.save = save
+        self.lazy = lazy
+        self.exists = exists if exists is not None else _is_file
+        self.incremental = incremental
+        self.inspect = inspect
+
+    def __repr__(self):
+        return "Backend %s" % self.name
+
+
+def _is_file(fname):
+    return pathlib.Path(fname).is_file()
+
+
+# extension -> Backend
+_backends = dict()
+# backend used to read files with unknown extensions
+_default_backend = None
+
+
+def register_backend(backend, *extensions, default=False):
+    """ use backend for the files with these extensions (".mat", ...);
+        default: also use it to read files with unknown extensions """
+    global _default_backend
+    for extension in extensions:
+        if not extension.startswith("."):
+            extension = "." + extension
+        _backends[extension] = backend
+    if default:
+        _default_backend = backend
+
+
+def get_backend(fname, default=True):
+    """ backend for fname (by extension); files with unknown extensions
+        get the default backend (or None if not default) """
+    backend = _backends.get(pathlib.Path(fname).suffix)
+    if backend is None and default:
+        return _default_backend
+    return backend
+
+
+def extensions():
+    """ registered extensions """
+    return sorted(_backends)
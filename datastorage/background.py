@@ -0,0 +1,252 @@
+""" saving in a background thread
+
+    save_async takes a snapshot of the data and returns immediately a
+    concurrent.futures.Future; the file is written by a writer thread.
+
+    for i in range(nshots):
+        data.images[i] = acquire()
+        future = datastorage.save_async("checkpoint.h5", data)
+    future.result()  # raises if the save failed
+
+    Snapshots: the nested dicts and lists are copied (adding or replacing
+    keys afterwards does not change what is saved); arrays are either
+    copied (default, they can be modified in place right away, like
+    data.images above) or, with snapshot="freeze", made read-only until
+    written (no copy, but modifying them in place raises ValueError while
+    the save is pending: only for arrays that are not modified afterwards)
+"""
+import concurrent.futures
+import contextvars
+import logging
+import pathlib
+import queue
+import threading
+import numpy as np
+
+from .datastorage import (
+    DataStorage,
+    toDict,
+    _incremental_paths,
+    _save_dict,
+)
+
+log = logging.getLogger(__name__)
+
+
+class _Frozen(object):
+    """ arrays made read-only by pending saves (with their number of pending
+        saves, an array is made writeable again when all of them are done) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = dict()
+
+    def freeze(self, array):
+        with self._lock:
+            key = id(array)
+            if key in self._arrays:
+                self._arrays[key][1] += 1
+            elif array.flags.writeable:
+                array.flags.writeable = False
+                self._arrays[key] = [array, 1]
+
+    def release(self, arrays):
+        with self._lock:
+            for array in arrays:
+                entry = self._arrays.get(id(array))
+                if entry is None:
+                    continue
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._arrays[id(array)]
+                    array.flags.writeable = True
+
+
+def _snapshot(value, snapshot, frozen, frozen_list):
+    """ copy of the dicts/lists of value; arrays are frozen or copied """
+    if isinstance(value, dict):
+        return dict(
+            (k, _snapshot(v, snapshot, frozen, frozen_list)) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return [_snapshot(v, snapshot, frozen, frozen_list) for v in value]
+    if isinstance(value, np.ndarray) and value.dtype.kind != "O":
+        if snapshot == "copy":
+            return value.copy()
+        # only arrays owning their data can be safely made writeable again
+        if value.base is None:
+            frozen.freeze(value)
+            frozen_list.append(value)
+            return value
+        return value.copy()
+    return value
+
+
+def _succeeded(future):
+    return future.done() and (future.cancelled() or future.exception() is None)
+
+
+class AsyncWriter(object):
+    """ Write files in a background thread
+
+        max_pending: maximum number of saves waiting to be written; submit
+                     blocks when the queue is full (backpressure)
+
+        Saves are written one at a time in submission order (so that saves
+        of the same file are consistent).
+    """
+
+    def __init__(self, max_pending=4):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._frozen = _Frozen()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._futures = []
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="datastorage-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            future, obj, fname, d, paths, options, frozen_list, context = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        # run in the context of submit (for collect_stats)
+                        ret = context.run(_save_dict, fname, d, paths=paths, **options)
+                        future.set_result(ret)
+                    except Exception as e:
+                        log.exception("Could not save %s" % fname)
+                        # next incremental save has to rewrite everything
+                        if isinstance(obj, DataStorage):
+                            obj._synced_file = None
+                        future.set_exception(e)
+            finally:
+                self._frozen.release(frozen_list)
+                self._queue.task_done()
+
+    def submit(self, fname, d, snapshot="copy", incremental=False, **options):
+        """ take a snapshot of d and queue its saving, return a Future
+            (whose result is the one of datastorage.save)
+
+            snapshot: "copy" (arrays are copied) or "freeze" (arrays are
+                      read-only until saved)
+            other parameters: see datastorage.save
+        """
+        if snapshot not in ("freeze", "copy"):
+            raise ValueError("snapshot must be 'freeze' or 'copy', it was %s" % snapshot)
+        fname = pathlib.Path(fname)
+        paths = _incremental_paths(d, fname, incremental)
+        frozen_list = []
+        data = _snapshot(toDict(d, recursive=True), snapshot, self._frozen, frozen_list)
+        if isinstance(d, DataStorage):
+            # the file will be in sync with the snapshot
+            d._mark_clean(fname)
+        future = concurrent.futures.Future()
+        self._start()
+        try:
+            # blocks if max_pending saves are waiting
+            job = (future, d, fname, data, paths, options, frozen_list)
+            self._queue.put(job + (contextvars.copy_context(),))
+        except BaseException:
+            self._frozen.release(frozen_list)
+            raise
+        with self._lock:
+            # failed saves are kept until reported by wait
+            self._futures = [f for f in self._futures if not _succeeded(f)]
+            self._futures.append(future)
+        return future
+
+    @property
+    def pending(self):
+        """ number of saves not written yet """
+        with self._lock:
+            return sum(not f.done() for f in self._futures)
+
+    def flush(self, timeout=None):
+        """ wait until all the submitted saves are written (or failed),
+            return False if timeout (s) expired first """
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        return len(not_done) == 0
+
+    def wait(self, timeout=None):
+        """ like flush but raises the error of the first failed save (each
+            error is raised once) and TimeoutError if timeout expired """
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        if not_done:
+            raise concurrent.futures.TimeoutError(
+                "%d saves still pending" % len(not_done)
+            )
+        with self._lock:
+            self._futures = [f for f in self._futures if f not in futures]
+        for future in futures:
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+
+    def close(self):
+        """ write pending saves and stop the writer thread """
+        self.flush()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+
+def default_writer():
+    """ AsyncWriter used by save_async (created on first use) """
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None:
+            _default_writer = AsyncWriter()
+        return _default_writer
+
+
+def save_async(fname, d, snapshot="copy", writer=None, **kwargs):
+    """ save d to fname in a background thread, return a Future
+
+        snapshot: "copy" (default) arrays are copied, "freeze" arrays are
+                  made read-only until written (no copy, but modifying them
+                  in place raises ValueError while the save is pending)
+        writer: AsyncWriter to use (default: shared writer, see
+                default_writer, use default_writer().flush() or wait() to
+                wait for the pending saves)
+        other parameters: see datastorage.save
+    """
+    if writer is None:
+        writer = default_writer()
+    return writer.submit(fname, d, snapshot=snapshot, **kwargs)
+
+
+def flush(timeout=None):
+    """ wait for the saves submitted with save_async (default writer) """
+    return default_writer().flush(timeout=timeout)
+
+
+def wait(timeout=None):
+    """ wait for the saves submitted with save_async (default writer) and
+        raise the error of the first failed one """
+    return default_writer().wait(timeout=timeout)
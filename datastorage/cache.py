@@ -0,0 +1,179 @@
+""" process-wide cache of read results
+
+    opt-in, enabled with enable_read_cache; read() then returns the cached
+    result as long as the file is unchanged (same resolved path, mtime and
+    size) and the read options are the same
+
+    datastorage.enable_read_cache(max_bytes=2 * 1024 ** 3)
+    data = datastorage.read("run.h5")  # read from disk
+    data = datastorage.read("run.h5")  # from cache
+    datastorage.read_cache_info()      # hits, misses, ...
+
+    Cached arrays are read-only: every read returns a new DataStorage (keys
+    can be set or deleted freely) whose arrays are read-only views, copy
+    them (data.images.copy()) to modify them in place.
+    Lazy reads and reads with readH5pyDataset=False are not cached.
+"""
+import logging
+import pathlib
+import threading
+import numpy as np
+
+from .datastorage import DataStorage, DSDIR_MANIFEST, toDict
+from .lazy import ByteLRUCache
+
+log = logging.getLogger(__name__)
+
+
+def _freeze(value):
+    """ nested dicts/lists of value with read-only arrays, and their size """
+    if isinstance(value, dict):
+        d = dict()
+        nbytes = 0
+        for key, v in value.items():
+            d[key], n = _freeze(v)
+            nbytes += n
+        return d, nbytes
+    if isinstance(value, (list, tuple)):
+        items = [_freeze(v) for v in value]
+        return [v for v, _ in items], sum(n for _, n in items)
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        return value, value.nbytes
+    if isinstance(value, str):
+        return value, len(value)
+    return value, 8
+
+
+def _thaw(value):
+    """ new dicts/lists with read-only views of the arrays of value """
+    if isinstance(value, dict):
+        return dict((key, _thaw(v)) for key, v in value.items())
+    if isinstance(value, list):
+        return [_thaw(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.view()
+    return value
+
+
+def _file_id(fname):
+    """ resolved path, mtime and size of fname (of the manifest for dsdir
+        folders) """
+    path = pathlib.Path(fname).resolve()
+    stat_path = path / DSDIR_MANIFEST if path.suffix == ".dsdir" else path
+    stat = stat_path.stat()
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+class ReadCache(object):
+    """ LRU cache (with a memory budget) of the results of read
+
+        max_bytes: budget for the cached data (arrays and strings); results
+                   bigger than the budget are not cached
+    """
+
+    def __init__(self, max_bytes=1024 ** 3):
+        self._cache = ByteLRUCache(max_bytes)
+        self._lock = threading.Lock()
+        # resolved path -> cache keys (for invalidation)
+        self._paths = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, fname, options, read_func):
+        """ return the cached result for fname and options (hashable) or
+            call read_func() and cache its result """
+        try:
+            path, mtime, size = _file_id(fname)
+        except OSError:
+            # let read_func deal with missing files
+            return read_func()
+        key = (path, mtime, size, options)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            ret = read_func()
+            if ret is None:
+                return ret
+            data, nbytes = _freeze(toDict(ret))
+            entry = (data, ret.filename)
+            with self._lock:
+                keys = self._paths.setdefault(path, set())
+                # older versions of the file are not needed anymore
+                for old in [k for k in keys if k[1:3] != (mtime, size)]:
+                    self._cache.pop(old)
+                    keys.discard(old)
+                self._cache.put(key, entry, nbytes)
+                keys.add(key)
+        data, filename = entry
+        ret = DataStorage(_thaw(data))
+        ret.filename = filename
+        return ret
+
+    def invalidate(self, fname=None):
+        """ forget the cached results of fname (all files if None) """
+        with self._lock:
+            if fname is None:
+                self._cache.clear()
+                self._paths.clear()
+                return
+            path = str(pathlib.Path(fname).resolve())
+            for key in self._paths.pop(path, set()):
+                self._cache.pop(key)
+
+    def info(self):
+        """ dict with hits, misses, number of cached results, bytes used and
+            budget """
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                items=len(self._cache),
+                nbytes=self._cache.nbytes,
+                max_bytes=self._cache.max_bytes,
+            )
+
+
+_read_cache = None
+
+
+def enable_read_cache(max_bytes=1024 ** 3):
+    """ enable (or resize, keeping the cached results) the process-wide
+        cache used by read; return it """
+    global _read_cache
+    if _read_cache is None:
+        _read_cache = ReadCache(max_bytes)
+    else:
+        with _read_cache._lock:
+            _read_cache._cache.resize(max_bytes)
+    return _read_cache
+
+
+def disable_read_cache():
+    """ disable (and empty) the process-wide read cache """
+    global _read_cache
+    if _read_cache is not None:
+        _read_cache.invalidate()
+    _read_cache = None
+
+
+def get_read_cache():
+    """ the process-wide read cache (None if not enabled) """
+    return _read_cache
+
+
+def invalidate_read_cache(fname=None):
+    """ forget the cached results of fname (all files if None) """
+    if _read_cache is not None:
+        _read_cache.invalidate(fname)
+
+
+def read_cache_info():
+    """ statistics of the process-wide read cache (None if not enabled) """
+    if _read_cache is None:
+        return None
+    return _read_cache.info()
@@ -0,0 +1,236 @@
+""" out-of-core map/reduce over stored arrays
+
+    the array is read in blocks along its first axis (aligned with the
+    chunks of hdf5 datasets), blocks are processed by a thread pool and
+    only a few of them are in memory at any time
+
+    mean = datastorage.reduce("run.h5", "images", "mean", axis=0)
+    counts, edges = datastorage.reduce("run.h5", "images", "histogram", bins=100)
+    nhot = datastorage.reduce(
+        "run.h5", "images", lambda b: (b > 1000).sum(axis=(1, 2))
+    )  # one value per image
+
+    sources: hdf5 files, dsdir folders (memory mapped arrays), or directly
+    an array like object (numpy array or memmap, h5py.Dataset, LazyDataset)
+"""
+import collections
+import concurrent.futures
+import logging
+import os
+import pathlib
+import numpy as np
+
+from .datastorage import openH5, read
+
+log = logging.getLogger(__name__)
+
+# default target size of a block (bytes)
+DEFAULT_BLOCK_BYTES = 16 * 1024 ** 2
+
+
+class Reducer(object):
+    """ map/reduce operation over the blocks of an array
+
+        map: function called on each block (numpy array, a slice along the
+             first axis)
+        combine: function combining two partial results (like np.add), if
+                 None the results of the blocks are concatenated along the
+                 first axis
+        finalize: function called on the combined result (default: identity)
+    """
+
+    def __init__(self, map, combine=None, finalize=None):
+        self.map = map
+        self.combine = combine
+        self.finalize = finalize
+
+
+def _concatenate(results):
+    if all(np.ndim(r) == 0 for r in results):
+        return np.asarray(results)
+    return np.concatenate(results)
+
+
+def builtin_reducer(name, axis=0, bins=10, range=None):
+    """ Reducer for name (mean, sum, min, max or histogram)
+
+        axis: 0 or None reduce over the blocks (with None over all the
+              axes), other axes reduce each block and concatenate
+        bins, range: histogram only (see np.histogram), the range is
+                     needed to histogram blocks independently
+    """
+    if name == "histogram":
+        if range is None:
+            raise ValueError("histogram of blocks needs the range")
+        edges = np.histogram_bin_edges([], bins=bins, range=range)
+        return Reducer(
+            map=lambda block: np.histogram(block, bins=edges)[0],
+            combine=np.add,
+            finalize=lambda counts: (counts, edges),
+        )
+    if name not in ("mean", "sum", "min", "max"):
+        raise ValueError(
+            "func must be mean, sum, min, max, histogram, a Reducer or a function"
+        )
+    across_blocks = axis is None or axis == 0
+    combine = None
+    if name == "mean":
+        if across_blocks:
+            return Reducer(
+                map=lambda block: (
+                    block.sum(axis=axis, dtype=np.float64),
+                    block.size if axis is None else block.shape[0],
+                ),
+                combine=lambda a, b: (a[0] + b[0], a[1] + b[1]),
+                finalize=lambda partial: partial[0] / partial[1],
+            )
+        return Reducer(map=lambda block: block.mean(axis=axis))
+    func = dict(sum=np.sum, min=np.min, max=np.max)[name]
+    if across_blocks:
+        combine = dict(sum=np.add, min=np.minimum, max=np.maximum)[name]
+    return Reducer(map=lambda block: func(block, axis=axis), combine=combine)
+
+
+_min_max = Reducer(
+    map=lambda block: (float(block.min()), float(block.max())),
+    combine=lambda a, b: (min(a[0], b[0]), max(a[1], b[1])),
+)
+
+
+def _block_rows(
+    shape, itemsize, chunks=None, block=None, block_bytes=DEFAULT_BLOCK_BYTES
+):
+    """ number of rows (along the first axis) of a block, a multiple of the
+        chunk size along that axis """
+    step = chunks[0] if chunks is not None else 1
+    if block is None:
+        row_bytes = max(1, int(np.prod(shape[1:])) * itemsize)
+        block = max(1, block_bytes // row_bytes)
+    return max(step, (block + step - 1) // step * step)
+
+
+def _get_key(d, key):
+    for part in key.strip("/").split("/"):
+        d = d[part]
+    return d
+
+
+class _Source(object):
+    """ array like object read in blocks, owns the file handle (if any) """
+
+    def __init__(self, source, key=None, locking=False):
+        self._file = None
+        if isinstance(source, (str, os.PathLike)):
+            fname = pathlib.Path(source)
+            if key is None:
+                raise ValueError("key is needed to reduce a dataset of %s" % fname)
+            if fname.suffix == ".dsdir":
+                array = _get_key(read(fname, keys=key, mmap_mode="r"), key)
+            elif fname.suffix in (".npz", ".npy"):
+                raise ValueError("%s files can not be read by blocks" % fname.suffix)
+            else:
+                self._file = openH5(fname, "r", locking=locking)
+                array = self._file[key.strip("/")]
+        elif key is not None:
+            array = _get_key(source, key)
+        else:
+            array = source
+        if not hasattr(array, "shape") or len(array.shape) == 0:
+            raise ValueError("Can not reduce %s, it is not an array" % key)
+        if array.shape[0] == 0:
+            raise ValueError("Can not reduce %s, it is empty" % key)
+        self.array = array
+        self.shape = tuple(array.shape)
+        self.dtype = np.dtype(array.dtype)
+        # h5py.Dataset and LazyDataset (without reading it) have chunks
+        self.chunks = getattr(array, "chunks", None)
+
+    def read(self, start, stop):
+        return np.asarray(self.array[start:stop])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def reduce(
+    source,
+    key=None,
+    func="mean",
+    axis=0,
+    block=None,
+    workers=None,
+    combine=None,
+    bins=10,
+    range=None,
+    block_bytes=DEFAULT_BLOCK_BYTES,
+    locking=False,
+):
+    """ apply func to an array block by block, without reading it all
+
+        source: file name (hdf5 or dsdir) or array like object (numpy array
+                or memmap, h5py.Dataset, LazyDataset, dict of arrays)
+        key: path of the array in the file ("run/images")
+        func: "mean", "sum", "min", "max", "histogram", a Reducer or a
+              function called on each block (whose results are combined with
+              combine or, if combine is None, concatenated)
+        axis: built-in functions only, 0 or None reduce across the blocks,
+              other axes reduce within each block
+        block: number of rows (first axis) of a block, rounded up to a
+               multiple of the hdf5 chunks; default: about block_bytes
+        workers: number of threads (default: number of cpus); at most
+                 2*workers blocks are in memory
+        bins, range: histogram only, if range is None the min and max are
+                     computed first (one more pass)
+        locking: hdf5 only, see datastorage.openH5
+    """
+    src = _Source(source, key, locking=locking)
+    try:
+        if isinstance(func, str):
+            if func == "histogram" and range is None:
+                range = _run(src, _min_max, block, workers, block_bytes)
+            reducer = builtin_reducer(func, axis=axis, bins=bins, range=range)
+        elif isinstance(func, Reducer):
+            reducer = func
+        else:
+            reducer = Reducer(map=func, combine=combine)
+        return _run(src, reducer, block, workers, block_bytes)
+    finally:
+        src.close()
+
+
+def _run(src, reducer, block, workers, block_bytes):
+    rows = _block_rows(src.shape, src.dtype.itemsize, src.chunks, block, block_bytes)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def task(start):
+        return reducer.map(src.read(start, min(start + rows, src.shape[0])))
+
+    result = None
+    results = []
+    pending = collections.deque()
+
+    def collect(partial):
+        nonlocal result
+        if reducer.combine is None:
+            results.append(partial)
+        elif result is None:
+            result = partial
+        else:
+            result = reducer.combine(result, partial)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in np.arange(0, src.shape[0], rows):
+            # bounded number of blocks in memory, results combined in order
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft().result())
+            pending.append(executor.submit(task, int(start)))
+        while pending:
+            collect(pending.popleft().result())
+    if reducer.combine is None:
+        result = _concatenate(results) if results else np.asarray([])
+    if reducer.finalize is not None:
+        result = reducer.finalize(result)
+    return result
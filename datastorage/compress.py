@@ -0,0 +1,86 @@
+""" parallel compression of the chunks of hdf5 datasets
+
+    h5py compresses the chunks of a dataset one after the other in the
+    writing thread; here the chunks are compressed by a thread pool (zlib
+    releases the GIL) and written with direct chunk writes. The dataset is
+    created with the standard filters (shuffle, deflate) and the chunks are
+    encoded exactly as these filters would do, so the files are read by
+    any HDF5 reader.
+
+    used by save when the StoragePolicy has workers != 1:
+
+    policy = datastorage.StoragePolicy(compression="gzip", workers=None)
+    datastorage.save("stack.h5", dict(images=images), storage_policy=policy)
+"""
+import collections
+import concurrent.futures
+import itertools
+import os
+import zlib
+import numpy as np
+
+
+def can_compress_parallel(value, opts):
+    """ True if value (saved with the create_dataset keywords opts) can be
+        written with compress_parallel """
+    return (
+        opts.get("compression") == "gzip"
+        and value.dtype.kind in "biufc"
+        and set(opts) <= {"chunks", "compression", "compression_opts", "shuffle"}
+        and int(np.prod(value.shape)) > int(np.prod(opts["chunks"]))
+    )
+
+
+def _shuffle(chunk):
+    """ bytes of chunk as encoded by the hdf5 shuffle filter (first bytes of
+        all elements, then second bytes, ...) """
+    itemsize = chunk.dtype.itemsize
+    if itemsize == 1:
+        return chunk.tobytes()
+    return chunk.view(np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _encode_chunk(value, offset, chunks, shuffle, level):
+    """ compressed bytes of the chunk of value starting at offset """
+    index = tuple(slice(o, o + c) for o, c in zip(offset, chunks))
+    chunk = value[index]
+    if chunk.shape != tuple(chunks):
+        # edge chunks are stored with the full chunk shape
+        full = np.zeros(chunks, dtype=value.dtype)
+        full[tuple(slice(0, n) for n in chunk.shape)] = chunk
+        chunk = full
+    chunk = np.ascontiguousarray(chunk)
+    data = _shuffle(chunk) if shuffle else chunk.tobytes()
+    return zlib.compress(data, level)
+
+
+def compress_parallel(group, key, value, opts, workers=None):
+    """ create group[key] with the filters of opts (create_dataset keywords,
+        gzip compression) and write value with chunks compressed by workers
+        threads (default: number of cpus) """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = opts["chunks"]
+    level = opts.get("compression_opts")
+    level = 4 if level is None else level
+    shuffle = opts.get("shuffle", False)
+    value = np.asarray(value)
+    dataset = group.create_dataset(key, shape=value.shape, dtype=value.dtype, **opts)
+    offsets = itertools.product(
+        *[range(0, n, c) for n, c in zip(value.shape, chunks)]
+    )
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for offset in offsets:
+            # bounded number of compressed chunks in memory, written in order
+            if len(pending) >= 2 * workers:
+                done_offset, future = pending.popleft()
+                dataset.id.write_direct_chunk(done_offset, future.result())
+            future = executor.submit(
+                _encode_chunk, value, offset, chunks, shuffle, level
+            )
+            pending.append((offset, future))
+        while pending:
+            done_offset, future = pending.popleft()
+            dataset.id.write_direct_chunk(done_offset, future.result())
+    return dataset
@@ -8,22 +8,51 @@ import numpy as np
 import os
 import sys
 import math
-import h5py
 import collections
 import logging
 import pathlib
+import hashlib
+import fnmatch
+import concurrent.futures
+import itertools
+import json
+import operator
+import re
+import shutil
+import time
+import zipfile
+
+from . import backends
+from .backends import Backend, get_backend, lazy_import, register_backend
+from .compress import can_compress_parallel, compress_parallel
+from .stats import current_stats
+
+# h5py is slow to import, it is imported when a hdf5 file is first used
+h5py = lazy_import("h5py")
 
 log = logging.getLogger(__name__)
 
-# locking works only for h5py>=2.10
-_v = h5py.version.version_tuple
-has_h5py_version_lock = (_v.major > 2) or (_v.major >= 2 and _v.minor >= 10)
+
+
+def _h5py_version():
+    v = h5py.version.version_tuple
+    return v.major, v.minor
+
+
+def __getattr__(name):
+    # flags of the h5py version, computed only when used (h5py is imported
+    # lazily)
+    if name == "has_h5py_version_lock":
+        # locking works only for h5py>=2.10
+        return _h5py_version() >= (2, 10)
+    raise AttributeError("module %s has no attribute %s" % (__name__, name))
+
+# default memory budget of the cache used by lazy reading (bytes)
+DEFAULT_LAZY_CACHE_BYTES = 512 * 1024 ** 2
 
 # make sure dictionaries are ordered (somehow it does not work !)
 # dict = collections.OrderedDict
 
-_array_cache = dict()
-
 
 def unwrapArray_old(a, recursive=True, readH5pyDataset=True):
     """ This function takes an object (like a dictionary) and recursively
@@ -108,6 +137,23 @@ def unwrapArray_old(a, recursive=True, readH5pyDataset=True):
     return a
 
 
+def _unwrap_value(a):
+    """ recursively unwrap objects read from npy/npz files
+        (0d arrays, bytes, ...) """
+    # clean up non-hdf5 specific (also dict and None saved as 0d object)
+    if isinstance(a, np.ndarray) and a.ndim == 0:
+        a = a.item()
+    if isinstance(a, bytes):
+        a = a.decode("utf8")
+    if isinstance(a, np.ndarray) and a.dtype.char == "S":
+        a = a.astype(str)
+    if isinstance(a, dict):
+        a = dict((key, _unwrap_value(value)) for key, value in a.items())
+    elif isinstance(a, (list, tuple)):
+        a = [_unwrap_value(element) for element in a]
+    return a
+
+
 def _add_to_dict(d, path, value, attrs=None):
     """
     Add value to dict using path (/ separates levels)
@@ -133,19 +179,343 @@ def _add_to_dict(d, path, value, attrs=None):
     return d
 
 
+def _decode_h5_value(data):
+    """
+    Undo the conversions done when saving (bytes strings, None sentinel, ...)
+    """
+    if isinstance(data, (np.bytes_, bytes)):
+        data = data.decode("utf8")
+    if isinstance(data, str) and data == "NONE_PYTHON_OBJECT":
+        data = None
+    # fixed length strings are read as bytes arrays
+    elif isinstance(data, np.ndarray) and data.dtype.char == "S":
+        data = _decode_strings(data)
+    # variable length strings are read as object arrays of bytes
+    elif (
+        isinstance(data, np.ndarray)
+        and data.dtype.kind == "O"
+        and data.size > 0
+        and isinstance(data.flat[0], bytes)
+    ):
+        data = _decode_strings(data.astype(bytes))
+    return data
+
+
+def _encode_strings(value):
+    """ utf8 encode a unicode array at once, return a bytes ("S") array """
+    shape = value.shape
+    value = np.ascontiguousarray(value).reshape(-1)
+    width = value.dtype.itemsize // 4
+    codes = value.view(np.uint32).reshape(len(value), width)
+    if width > 0 and (value.size == 0 or codes.max() < 0x80):
+        # ascii, the code points are the bytes (without the unused columns)
+        used = np.flatnonzero(codes.any(axis=0))
+        width = used[-1] + 1 if used.size else 1
+        codes = codes[:, :width]
+        return codes.astype(np.uint8).view("S%d" % width).reshape(shape)
+    return np.char.encode(value, "utf8").reshape(shape)
+
+
+def _decode_strings(data):
+    """ utf8 decode a bytes array at once (left as bytes if it is not utf8) """
+    shape = data.shape
+    data = np.ascontiguousarray(data).reshape(-1)
+    width = data.dtype.itemsize
+    raw = data.view(np.uint8).reshape(len(data), width)
+    if width > 0 and (data.size == 0 or raw.max() < 0x80):
+        # ascii, the bytes are the code points
+        return raw.astype(np.uint32).view("U%d" % width).reshape(shape)
+    try:
+        return np.char.decode(data, "utf8").reshape(shape)
+    except UnicodeDecodeError:
+        return data.reshape(shape)
+
+
+_H5_LIST_FLAGS = (
+    "IS_LIST",
+    "IS_LIST_OF_ARRAYS",
+    "IS_STACKED_LIST",
+    "IS_RAGGED_LIST",
+    "IS_RECORD_LIST",
+)
+_H5_LIST_FLAGS_BYTES = tuple(flag.encode() for flag in _H5_LIST_FLAGS)
+
+
+def _is_h5_list(h5_obj):
+    """ True if the hdf5 object stores a python list """
+    attrs = h5_obj.attrs
+    return any(flag in attrs for flag in _H5_LIST_FLAGS)
+
+
+def _read_h5_ragged_list(h5_group):
+    """ read list of arrays saved by _save_list_of_arrays as ragged """
+    data = h5_group["data"][()]
+    offsets = h5_group["offsets"][()]
+    shapes = h5_group["shapes"][()]
+    return [
+        data[start:stop].reshape(shape)
+        for start, stop, shape in zip(offsets[:-1], offsets[1:], shapes)
+    ]
+
+
+# with scalar_encoding="packed" the scalars, short strings and None of a
+# group are saved together in this dataset, as the json list [values, dtypes]
+# (dtypes: numpy dtype of the numbers)
+H5_PACKED_SCALARS = "__datastorage_scalars__"
+H5_PACKED_SCALARS_BYTES = H5_PACKED_SCALARS.encode()
+# longer strings are saved as their own dataset
+H5_PACKED_MAX_STRING = 256
+
+
+def _read_h5_packed_record(dsid):
+    """ (values, dtypes) of a packed record (low level id) """
+    data = h5py.Dataset(dsid)[()]
+    if isinstance(data, bytes):
+        data = data.decode("utf8")
+    values, dtypes = json.loads(data)
+    return values, dtypes
+
+
+def _read_h5_packed(dsid):
+    """ dict of the values saved in a packed record (low level id); numbers
+        are numpy scalars of their saved dtype (as when read from datasets) """
+    values, dtypes = _read_h5_packed_record(dsid)
+    for key, dtype in dtypes.items():
+        values[key] = np.dtype(dtype).type(values[key])
+    return values
+
+
+def _read_h5_dataset_id(dsid):
+    """ read a dataset from its low level id (same as h5py.Dataset[()] but
+        without the overhead of the high level objects) """
+    shape = dsid.shape
+    if shape is not None and 0 not in shape:
+        try:
+            data = np.empty(shape, dtype=dsid.dtype)
+            dsid.read(h5py.h5s.ALL, h5py.h5s.ALL, data)
+            return data[()] if data.ndim == 0 else data
+        except (TypeError, ValueError):
+            pass
+    # empty datasets, types the low level read can not handle, ...
+    return h5py.Dataset(dsid)[()]
+
+
+# node kind -> encoding name (as used by the stats of dictToH5Group)
+_H5_KIND_ENCODINGS = dict(
+    dataset="native",
+    IS_LIST_OF_ARRAYS="IS_LIST",
+    IS_STACKED_LIST="stacked_list",
+    IS_RAGGED_LIST="ragged_list",
+    IS_RECORD_LIST="record_list",
+)
+
+
+class _H5Loader(object):
+    """ single pass reader of hdf5 files
+
+        every node is opened once (with the low level API), its kind
+        ("dataset", "group" or one of the list flags) is used to dispatch
+        to the reader of that kind and the nested result is built while
+        walking the file
+    """
+
+    def __init__(self, readH5pyDataset=True, add_attrs=False, stack_lists=False):
+        self.readH5pyDataset = readH5pyDataset
+        self.add_attrs = add_attrs
+        self.stack_lists = stack_lists
+        self.stats = current_stats()
+        self._readers = {
+            "dataset": self._read_dataset,
+            "group": self._read_group,
+            "IS_LIST": self._read_list,
+            "IS_LIST_OF_ARRAYS": self._read_list,
+            "IS_STACKED_LIST": self._read_stacked_list,
+            "IS_RAGGED_LIST": self._read_ragged_list,
+            "IS_RECORD_LIST": self._read_record_list,
+        }
+
+    @staticmethod
+    def _kind(oid):
+        if h5py.h5a.get_num_attrs(oid) > 0:
+            for flag, flag_bytes in zip(_H5_LIST_FLAGS, _H5_LIST_FLAGS_BYTES):
+                if h5py.h5a.exists(oid, flag_bytes):
+                    return flag
+        if isinstance(oid, h5py.h5d.DatasetID):
+            return "dataset"
+        return "group"
+
+    def load(self, oid):
+        """ return the python object stored in the node with low level id oid """
+        kind = self._kind(oid)
+        if self.stats is None:
+            return self._readers[kind](oid)
+        t0 = time.perf_counter()
+        value = self._readers[kind](oid)
+        path = h5py.h5i.get_name(oid).decode("utf8")
+        encoding = _H5_KIND_ENCODINGS.get(kind, kind)
+        self.stats.record("read", path, time.perf_counter() - t0, value, encoding)
+        return value
+
+    def _read_dataset(self, dsid):
+        if not self.readH5pyDataset:
+            return h5py.Dataset(dsid)
+        return _decode_h5_value(_read_h5_dataset_id(dsid))
+
+    def _read_stacked_list(self, dsid):
+        data = self._read_dataset(dsid)
+        return data if self.stack_lists else list(data)
+
+    def _read_ragged_list(self, gid):
+        return _read_h5_ragged_list(h5py.Group(gid))
+
+    def _read_record_list(self, gid):
+        columns = self._read_group(gid)
+        return columns if self.stack_lists else _columns_to_records(columns)
+
+    def _read_list(self, gid):
+        names = sorted(gid)
+        return [self.load(h5py.h5o.open(gid, name)) for name in names]
+
+    def _read_packed(self, dsid):
+        if self.stats is None:
+            return _read_h5_packed(dsid)
+        t0 = time.perf_counter()
+        values = _read_h5_packed(dsid)
+        path = h5py.h5i.get_name(dsid).decode("utf8")
+        self.stats.record("read", path, time.perf_counter() - t0, None, "packed")
+        return values
+
+    def _read_group(self, gid):
+        d = dict()
+        for name in gid:
+            oid = h5py.h5o.open(gid, name)
+            if name == H5_PACKED_SCALARS_BYTES:
+                d.update(self._read_packed(oid))
+                continue
+            key = name.decode("utf8")
+            d[key] = self.load(oid)
+            if self.add_attrs and h5py.h5a.get_num_attrs(oid) > 0:
+                d[key + "_attrs"] = dict(self._h5_object(oid).attrs)
+        return d
+
+    @staticmethod
+    def _h5_object(oid):
+        if isinstance(oid, h5py.h5d.DatasetID):
+            return h5py.Dataset(oid)
+        return h5py.Group(oid)
+
+
+def _columns_to_records(columns):
+    """ list of records (dicts) from columns (nested dict of arrays) """
+    keys = list(columns)
+    values = []
+    for key in keys:
+        column = columns[key]
+        if isinstance(column, dict):
+            values.append(_columns_to_records(column))
+        elif column.dtype.kind == "U":
+            values.append(column.tolist())
+        else:
+            values.append(list(column))
+    return [dict(zip(keys, record)) for record in zip(*values)]
+
+
+def _is_h5_node(a):
+    """ True for h5py groups and datasets (h5py is not imported for that, if
+        it was not imported a can not be a h5py object) """
+    return "h5py" in sys.modules and isinstance(a, (h5py.Group, h5py.Dataset))
+
+
+def _h5_node_value(h5_obj, readH5pyDataset=True, stack_lists=False):
+    """ return the python object stored in a hdf5 dataset or group """
+    loader = _H5Loader(readH5pyDataset=readH5pyDataset, stack_lists=stack_lists)
+    return loader.load(h5_obj.id)
+
+
+def _as_key_patterns(keys):
+    """ convert keys ("run/diagnostics/i0", "*/i0", ...) to list of tuples of
+        path elements (each element is a fnmatch pattern) """
+    if isinstance(keys, str):
+        keys = [keys]
+    return [tuple(key.strip("/").split("/")) for key in keys]
+
+
+def _match_key_patterns(path, patterns):
+    """ return 2 if path (tuple of path elements) is selected by one of the
+        patterns, 1 if it could contain a selected key, 0 otherwise """
+    status = 0
+    for pattern in patterns:
+        n = min(len(path), len(pattern))
+        if all(fnmatch.fnmatchcase(p, q) for p, q in zip(path[:n], pattern[:n])):
+            if len(path) >= len(pattern):
+                return 2
+            status = 1
+    return status
+
+
+def _select_h5(h5_group, patterns, node_value, add_attrs=False, path=()):
+    """ nested dict of the nodes of h5_group selected by patterns; only the
+        selected nodes and the groups leading to them are visited
+        node_value: function returning the value of a selected node
+    """
+    d = dict()
+    for key, node in h5_group.items():
+        if key == H5_PACKED_SCALARS:
+            for name, value in _read_h5_packed(node.id).items():
+                if _match_key_patterns(path + (name,), patterns) == 2:
+                    d[name] = value
+            continue
+        node_path = path + (key,)
+        status = _match_key_patterns(node_path, patterns)
+        if status == 2:
+            d[key] = node_value(node)
+            if add_attrs and len(node.attrs) != 0:
+                d[key + "_attrs"] = dict(node.attrs)
+        elif status == 1 and isinstance(node, h5py.Group) and not _is_h5_list(node):
+            sub = _select_h5(node, patterns, node_value, add_attrs, node_path)
+            if len(sub) > 0:
+                d[key] = sub
+    return d
+
+
+def _select_dict(d, patterns, path=()):
+    """ nested dict with the keys of d selected by patterns """
+    out = dict()
+    for key, value in d.items():
+        key_path = path + (key,)
+        status = _match_key_patterns(key_path, patterns)
+        if status == 2:
+            out[key] = value
+        elif status == 1 and isinstance(value, dict):
+            sub = _select_dict(value, patterns, key_path)
+            if len(sub) > 0:
+                out[key] = sub
+    return out
+
+
 def _add_h5dataset_to_dict(
-    d, h5_dataset, path="auto", add_attrs=True, readH5pyDataset=True, decode_bytes=True
+    d,
+    h5_dataset,
+    path="auto",
+    add_attrs=True,
+    readH5pyDataset=True,
+    decode_bytes=True,
+    stack_lists=False,
 ):
     """
     Add value to dict using path (/ separates levels)
+    stack_lists: if False lists of arrays saved as stacked array are
+                 converted back to list
     """
     if isinstance(path, str) and path == "auto":
         path = h5_dataset.name
     attrs = dict(h5_dataset.attrs) if add_attrs else None
     #print(str(h5_dataset),add_attrs,attrs)
     data = h5_dataset[()] if readH5pyDataset else h5_dataset
-    if decode_bytes and isinstance(data, (np.bytes_, bytes)):
-        data = data.decode("utf8")
+    if decode_bytes:
+        data = _decode_h5_value(data)
+    if "IS_STACKED_LIST" in h5_dataset.attrs and not stack_lists:
+        data = list(data)
     d = _add_to_dict(d, path, data, attrs=attrs)
     return d
 
@@ -158,30 +528,51 @@ def _add_h5group_to_dict(d, h5_group, path="auto", add_attrs=True):
     return d
 
 
-def unwrapArray(a, result=None, recursive=True, readH5pyDataset=True, add_attrs=False):
+def unwrapArray(
+    a,
+    result=None,
+    recursive=True,
+    readH5pyDataset=True,
+    add_attrs=False,
+    stack_lists=False,
+):
     """ This function takes an object (like a dictionary) and recursively
         unwraps it solving issues like:
           * the fact that many objects are packaged as 0d array
         This funciton has also some specific hack for handling h5py limits:
           * handle the None python object
           * numpy unicode ...
+        stack_lists: return lists of arrays of same shape as one stacked array
+                     and lists of records as one dict of columns
     """
+    # objects read from npy/npz files
+    if result is None and not _is_h5_node(a):
+        return _unwrap_value(a)
+    # hdf5 objects are read by the single pass loader
+    if result is None and recursive:
+        loader = _H5Loader(
+            readH5pyDataset=readH5pyDataset, add_attrs=add_attrs, stack_lists=stack_lists
+        )
+        value = loader.load(a.id)
+        if a.name == "/":
+            return value
+        attrs = dict(a.attrs) if add_attrs else None
+        return _add_to_dict(dict(), a.name, value, attrs=attrs)
     if result is None:
         result = dict()
     try:
 
         ### take care of hdf5 groups
         if isinstance(a, h5py.Group):
+            # take care of special flags first (list elements are not
+            # added to result by their path)
+            if _is_h5_list(a):
+                temp = _h5_node_value(
+                    a, readH5pyDataset=readH5pyDataset, stack_lists=stack_lists
+                )
+                attrs = dict(a.attrs) if add_attrs else None
+                return _add_to_dict(result, a.name, temp, attrs=attrs)
             result = _add_h5group_to_dict(result, a, add_attrs=add_attrs)
-            # take care of special flags first
-            if ("IS_LIST" in a.attrs) or ("IS_LIST_OF_ARRAYS" in a.attrs):
-                items = list(a.keys())
-                items.sort()
-                temp = [
-                    unwrapArray(a[item], result=result, readH5pyDataset=readH5pyDataset)
-                    for item in items
-                ]
-                result = _add_to_dict(result, a.name, temp)
 
         ### take care of hdf5 datasets
         elif isinstance(a, h5py.Dataset):
@@ -192,7 +583,11 @@ def unwrapArray(a, result=None, recursive=True, readH5pyDataset=True, add_attrs=
             # a[...] returns ndarray if a is a string
             # a.value returns a str(py3) or unicode(py2)
             result = _add_h5dataset_to_dict(
-                result, a, readH5pyDataset=readH5pyDataset, add_attrs=add_attrs
+                result,
+                a,
+                readH5pyDataset=readH5pyDataset,
+                add_attrs=add_attrs,
+                stack_lists=stack_lists,
             )
 
         if isinstance(a, bytes):
@@ -217,19 +612,31 @@ def unwrapArray(a, result=None, recursive=True, readH5pyDataset=True, add_attrs=
         except AttributeError:
             pass
 
-        # convert to str (for example h5py can't save numpy unicode)
+        # strings are saved as utf8 bytes
         if isinstance(a, np.ndarray) and a.dtype.char == "S":
-            a = a.astype(str)
+            a = _decode_strings(a)
 
         if recursive:
             if "items" in dir(a):  # dict, h5py groups, npz file
                 a = dict(a)  # convert to dict, otherwise can't asssign values
                 for key, value in a.items():
-                    result = unwrapArray(value, result, readH5pyDataset=readH5pyDataset, add_attrs=add_attrs)
+                    result = unwrapArray(
+                        value,
+                        result,
+                        readH5pyDataset=readH5pyDataset,
+                        add_attrs=add_attrs,
+                        stack_lists=stack_lists,
+                    )
                     a[key] = value
             elif isinstance(a, (list, tuple)):
                 a = [
-                    unwrapArray(element, result, readH5pyDataset=readH5pyDataset, add_attrs=add_attrs)
+                    unwrapArray(
+                        element,
+                        result,
+                        readH5pyDataset=readH5pyDataset,
+                        add_attrs=add_attrs,
+                        stack_lists=stack_lists,
+                    )
                     for element in a
                 ]
             else:
@@ -240,128 +647,1107 @@ def unwrapArray(a, result=None, recursive=True, readH5pyDataset=True, add_attrs=
     return result
 
 
-def _find_link(value, group, key):
-    global _array_cache
-    name = "%s/%s" % (group.name, key)
-    name = name.replace("//", "/")
-    if not isinstance(value, np.ndarray):
+class _LinkCache(object):
+    """ index of the arrays already written during a save (used by link_copy)
+
+        arrays are indexed by (shape, dtype, 128 bit blake2b digest of the
+        content); arrays with the same key are considered identical (the
+        written datasets are not read back to compare them) and no reference
+        to the saved arrays is kept in memory
+    """
+
+    chunk_size = 16 * 1024 * 1024  # bytes hashed at a time
+
+    def __init__(self):
+        self._index = dict()
+
+    def _digest(self, value):
+        h = hashlib.blake2b(digest_size=16)
+        buf = np.ascontiguousarray(value).reshape(-1).view(np.uint8)
+        for i in range(0, buf.size, self.chunk_size):
+            h.update(buf[i : i + self.chunk_size])
+        return h.digest()
+
+    def key(self, value):
+        """ index key of the array value """
+        return (value.shape, value.dtype.str, self._digest(value))
+
+    def find(self, key, h5file):
+        """ return the dataset identical to the array of key (or None) """
+        for address in self._index.get(key, []):
+            try:
+                return h5file[address]
+            except KeyError:
+                # deleted since (incremental saves)
+                pass
         return None
-    found_address = None
-    for address, array in _array_cache.items():
-        if np.array_equal(array, value):
-            log.info(
-                "Found array in cache, asked for %s, found as %s" % (name, address)
-            )
-            found_address = address
+
+    def add(self, key, address):
+        self._index.setdefault(key, []).append(address)
+
+
+def _find_link(value, group, key, link_cache):
+    # h5py can not store unicode/object arrays natively, do not index them
+    if not isinstance(value, np.ndarray) or value.dtype.kind in "OU":
+        return value
+    name = "%s/%s" % (group.name.rstrip("/"), key)
+    # the array is hashed once (for the lookup and for the index)
+    array_key = link_cache.key(value)
+    dataset = link_cache.find(array_key, group.file)
+    if dataset is not None:
+        log.info(
+            "Found array in cache, asked for %s, found as %s" % (name, dataset.name)
+        )
+        return dataset
+    log.info("Adding array %s to cache" % name)
+    link_cache.add(array_key, name)
+    return value
+
+
+def _guess_chunks(shape, itemsize, target_bytes=1024 ** 2):
+    """ chunk shape of about target_bytes; the leading axes are reduced
+        first so that (for example) the images of a stack are kept whole """
+    chunks = list(shape)
+    for axis in range(len(chunks)):
+        nbytes = np.prod(chunks) * itemsize
+        if nbytes <= target_bytes:
             break
-    if found_address is not None:
-        value = group.file[found_address]
+        chunks[axis] = max(1, int(target_bytes // (nbytes / chunks[axis])))
+    # a single element of the leading axes is still too big
+    while np.prod(chunks) * itemsize > target_bytes and max(chunks) > 1:
+        axis = int(np.argmax(chunks))
+        chunks[axis] = int(math.ceil(chunks[axis] / 2))
+    return tuple(max(1, c) for c in chunks)
+
+
+class StoragePolicy(object):
+    """ compression and chunking used when saving arrays in hdf5 files
+
+        Parameters
+        ----------
+        compression : str or None
+           "gzip", "lzf" or None (no compression)
+        compression_opts : int
+           gzip level (0-9), ignored for lzf
+        shuffle : bool
+           use the shuffle filter (improves compression of numeric data)
+        chunks : "auto" or tuple
+           "auto" chooses the chunk shape from the array shape and dtype
+        chunk_bytes : int
+           target size of the chunks used by chunks="auto"
+        min_bytes : int
+           arrays smaller than this (and scalars) are saved contiguous and
+           without filters
+        workers : int or None
+           number of threads compressing the chunks of gzip compressed
+           arrays (written with direct chunk writes, see
+           datastorage.compress); None uses all the cpus, 1 (default) lets
+           h5py compress them in the writing thread
+        overrides : dict
+           {pattern: options} where options is a dict of the parameters
+           above (or None for no compression); pattern is matched (fnmatch)
+           against the dataset path (for example "run/*/i0") or, if it does
+           not contain "/", against the key name; the first matching
+           pattern is used
+
+        Examples
+        --------
+          policy = StoragePolicy(compression="lzf", overrides={"images": dict(compression="gzip", compression_opts=6), "*/i0": None})
+          data.save("run.h5", storage_policy=policy)
+    """
+
+    def __init__(
+        self,
+        compression="gzip",
+        compression_opts=4,
+        shuffle=True,
+        chunks="auto",
+        chunk_bytes=1024 ** 2,
+        min_bytes=1024,
+        workers=1,
+        overrides=None,
+    ):
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.chunks = chunks
+        self.chunk_bytes = chunk_bytes
+        self.min_bytes = min_bytes
+        self.workers = workers
+        self.overrides = dict(overrides) if overrides is not None else dict()
+
+    def settings(self, path):
+        """ return the options (after overrides) used for the dataset path """
+        settings = dict(
+            compression=self.compression,
+            compression_opts=self.compression_opts,
+            shuffle=self.shuffle,
+            chunks=self.chunks,
+            chunk_bytes=self.chunk_bytes,
+            min_bytes=self.min_bytes,
+            workers=self.workers,
+        )
+        name = path.rsplit("/", 1)[-1]
+        for pattern, override in self.overrides.items():
+            target = path if "/" in pattern else name
+            if fnmatch.fnmatchcase(target, pattern):
+                if override is None:
+                    override = dict(compression=None, shuffle=False)
+                settings.update(override)
+                break
+        return settings
+
+    def options(self, path, value):
+        """ return the keywords for h5py create_dataset (None if value
+            should be saved contiguous) """
+        if (
+            not isinstance(value, np.ndarray)
+            or value.ndim == 0
+            or value.size == 0
+            or value.dtype.kind in "OUV"
+        ):
+            return None
+        settings = self.settings(path.strip("/"))
+        if value.nbytes < settings["min_bytes"]:
+            return None
+        compression = settings["compression"]
+        if compression is None and not settings["shuffle"]:
+            return None
+        chunks = settings["chunks"]
+        if chunks == "auto":
+            chunks = _guess_chunks(
+                value.shape, value.dtype.itemsize, settings["chunk_bytes"]
+            )
+        else:
+            chunks = tuple(min(c, n) for c, n in zip(chunks, value.shape))
+        opts = dict(chunks=chunks, shuffle=settings["shuffle"])
+        if compression is not None:
+            opts["compression"] = compression
+            if compression == "gzip":
+                opts["compression_opts"] = settings["compression_opts"]
+        return opts
+
+
+def _as_storage_policy(storage_policy):
+    """ storage_policy can be None, a StoragePolicy, a dict of StoragePolicy
+        parameters or the name of the compression ("gzip" or "lzf") """
+    if storage_policy is None or isinstance(storage_policy, StoragePolicy):
+        return storage_policy
+    if isinstance(storage_policy, str):
+        return StoragePolicy(compression=storage_policy)
+    if isinstance(storage_policy, dict):
+        return StoragePolicy(**storage_policy)
+    raise ValueError("Invalid storage_policy %s" % storage_policy)
+
+
+def _write_h5_dataset(group, key, value, storage_policy=None):
+    """ group[key] = value using the filters of storage_policy (if any) """
+    opts = None
+    if storage_policy is not None:
+        path = "%s/%s" % (group.name, key)
+        opts = storage_policy.options(path, value)
+    if opts is None:
+        group[key] = value
+        return
+    workers = storage_policy.settings(path.strip("/"))["workers"]
+    if workers != 1 and can_compress_parallel(value, opts):
+        compress_parallel(group, key, value, opts, workers=workers)
     else:
-        log.info("Adding array %s to cache" % name)
-        _array_cache[name] = value
-    #    print(list(_array_cache.keys()))
-    return value
+        group.create_dataset(key, data=value, **opts)
+
+
+# unicode arrays are saved as variable length strings if the fixed length
+# ones (padded to the longest string) would be this many times bigger
+H5_VLEN_STRING_RATIO = 4
+
+
+def _save_h5_strings(value, group, key, storage_policy=None):
+    """ save a numpy unicode array as utf8 strings (fixed length, or
+        variable length if most strings are much shorter than the longest
+        one), return the encoding used """
+    encoded = _encode_strings(value)
+    nchars = np.char.str_len(encoded).sum() if encoded.size else 0
+    if encoded.nbytes > H5_VLEN_STRING_RATIO * max(nchars, 1):
+        # h5py writes str objects as variable length utf8 strings (that
+        # the hdf5 filters can not compress)
+        group.create_dataset(
+            key, data=value.astype(object), dtype=h5py.string_dtype()
+        )
+        return "vlen_unicode"
+    encoded = encoded.view(h5py.string_dtype("utf-8", encoded.itemsize))
+    _write_h5_dataset(group, key, encoded, storage_policy)
+    return "unicode"
+
+
+def _is_list_of_arrays(value):
+    """ True for non empty lists of arrays with same dtype and ndim """
+    if not isinstance(value, (list, tuple)) or len(value) == 0:
+        return False
+    first = value[0]
+    if not isinstance(first, np.ndarray) or first.dtype.kind in "OU":
+        return False
+    return all(
+        isinstance(v, np.ndarray) and v.dtype == first.dtype and v.ndim == first.ndim
+        for v in value
+    )
+
+
+def _same_keys(record, other):
+    """ True if the (nested) dicts record and other have the same keys """
+    if not isinstance(other, dict) or record.keys() != other.keys():
+        return False
+    return all(
+        _same_keys(value, other[key])
+        for key, value in record.items()
+        if isinstance(value, dict)
+    )
+
+
+def _is_list_of_records(value):
+    """ True for non empty lists of dicts (or DataStorage) with same keys """
+    if not isinstance(value, (list, tuple)) or len(value) == 0:
+        return False
+    first = value[0]
+    if not isinstance(first, dict) or len(first) == 0:
+        return False
+    if not all(isinstance(key, str) for key in first):
+        return False
+    return all(_same_keys(first, v) for v in value[1:])
+
+
+def _record_columns(value):
+    """ columns (nested dict of arrays) of a list of records, None if they
+        can not be saved as columns (values with different shapes, objects) """
+    try:
+        columns = unwrap(value, ragged="raise")
+    except (ValueError, TypeError, KeyError):
+        return None
 
+    def is_column(column):
+        if isinstance(column, dict):
+            return all(is_column(v) for v in column.values())
+        return isinstance(column, np.ndarray) and column.dtype.kind not in "OV"
 
-def dictToH5Group(d, group, link_copy=True):
+    return columns if is_column(columns) else None
+
+
+def _save_list_of_arrays(value, group, key, storage_policy=None):
+    """ save list of arrays in compact form:
+        * arrays with same shape are saved as a single stacked dataset
+        * arrays with different shapes are saved as a group with the
+          concatenated (flattened) arrays, offsets and shapes
+    """
+    shape = value[0].shape
+    if all(v.shape == shape for v in value):
+        _write_h5_dataset(group, key, np.stack(value), storage_policy)
+        group[key].attrs["IS_STACKED_LIST"] = True
+        return "stacked_list"
+    else:
+        h5_group = group.create_group(key)
+        h5_group.attrs["IS_RAGGED_LIST"] = True
+        sizes = [v.size for v in value]
+        data = np.concatenate([v.ravel() for v in value])
+        _write_h5_dataset(h5_group, "data", data, storage_policy)
+        h5_group["offsets"] = np.concatenate(([0], np.cumsum(sizes)))
+        h5_group["shapes"] = np.asarray([v.shape for v in value], dtype=np.int64)
+        return "ragged_list"
+
+
+def _is_packable(value):
+    """ True for the values saved in the packed record of their group with
+        scalar_encoding="packed" (python and numpy bool, integer and float
+        scalars, short strings and None) """
+    if isinstance(value, str):
+        return len(value) <= H5_PACKED_MAX_STRING
+    if value is None:
+        return True
+    if isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating)):
+        # not the integers too large for int64/uint64 or long doubles
+        dtype = np.asarray(value).dtype
+        return dtype.kind in "biuf" and dtype.itemsize <= 8
+    return False
+
+
+def _pack_values(values):
+    """ json values and dtypes (of the numbers) of packable values """
+    packed = dict()
+    dtypes = dict()
+    for key, value in values.items():
+        if value is None or isinstance(value, str):
+            packed[key] = None if value is None else str(value)
+        else:
+            value = np.asarray(value)
+            packed[key] = value.item()
+            dtypes[key] = value.dtype.name
+    return packed, dtypes
+
+
+def _write_h5_packed_record(group, values, dtypes):
+    group[H5_PACKED_SCALARS] = json.dumps([values, dtypes])
+
+
+def _save_h5_packed(values, group):
+    """ add values (dict of packable values) to the packed record of group """
+    packed, dtypes = _pack_values(values)
+    if H5_PACKED_SCALARS in group:
+        old_packed, old_dtypes = _read_h5_packed_record(group[H5_PACKED_SCALARS].id)
+        for key in packed:
+            old_dtypes.pop(key, None)
+        old_packed.update(packed)
+        old_dtypes.update(dtypes)
+        packed, dtypes = old_packed, old_dtypes
+        del group[H5_PACKED_SCALARS]
+    _write_h5_packed_record(group, packed, dtypes)
+
+
+def _remove_h5_packed(group, key):
+    """ remove key from the packed record of group (if it is in it) """
+    if H5_PACKED_SCALARS not in group:
+        return
+    packed, dtypes = _read_h5_packed_record(group[H5_PACKED_SCALARS].id)
+    if key in packed:
+        del packed[key]
+        dtypes.pop(key, None)
+        del group[H5_PACKED_SCALARS]
+        if len(packed) > 0:
+            _write_h5_packed_record(group, packed, dtypes)
+
+
+def dictToH5Group(
+    d,
+    group,
+    link_copy=True,
+    link_cache=None,
+    list_encoding="group",
+    storage_policy=None,
+    scalar_encoding="dataset",
+):
     """ helper function that transform (recursive) a dictionary into an
         hdf group by creating subgroups 
         link_copy = True, tries to save space in the hdf file by creating an internal link.
-                    the current implementation uses memory though ...
+        link_cache: index of already saved arrays (shared by the recursive calls),
+                    a new one is created if None
+        list_encoding: "group" (default, readable by older versions) saves
+                       one dataset per element, "compact" saves lists of
+                       arrays as a single stacked dataset (same shape) or
+                       concatenated + offsets (ragged) and lists of records
+                       (dicts with the same keys) as one dataset per key
+                       (columns)
+        storage_policy: StoragePolicy (compression, chunking) used for arrays
+        scalar_encoding: "dataset" saves every scalar, string and None as its
+                         own dataset; "packed" saves the (python and numpy)
+                         scalars, short strings and None of a group together
+                         as one json dataset (H5_PACKED_SCALARS), unpacked on
+                         read; numbers keep their dtype and are read as numpy
+                         scalars in both cases
     """
-    for key in d.keys():
-        value = d[key]
-        log.debug("saving", key, "in", group)
-        # hope for the best (i.e. h5py can handle that)
-        try:
-            if link_copy and isinstance(value, np.ndarray):
-                value = _find_link(value, group, key)
-            else:
-                if isinstance(value, h5py.Dataset):
-                    value = value[:]
-                    # hdf5 dataset have to be read first ...
-            group[key] = value
-        except (TypeError, ValueError) as e:
-            log.debug(
-                "For %s, h5py could not handle the saving on its own, trying to convert it, error was %s"
-                % (key, e)
+    if link_copy and link_cache is None:
+        link_cache = _LinkCache()
+    if scalar_encoding not in ("dataset", "packed"):
+        raise ValueError(
+            "scalar_encoding must be 'dataset' or 'packed', it was %s"
+            % scalar_encoding
+        )
+    storage_policy = _as_storage_policy(storage_policy)
+    kw = dict(
+        link_copy=link_copy,
+        link_cache=link_cache,
+        list_encoding=list_encoding,
+        storage_policy=storage_policy,
+        scalar_encoding=scalar_encoding,
+    )
+    items = d.items()
+    if scalar_encoding == "packed":
+        packed = dict(
+            (key, value)
+            for key, value in items
+            if isinstance(key, str) and _is_packable(value)
+        )
+        if len(packed) > 0:
+            _save_h5_packed_items(packed, group)
+            items = [(key, value) for key, value in items if key not in packed]
+    _save_h5_items(items, group, kw)
+
+
+def _save_h5_packed_items(packed, group):
+    stats = current_stats()
+    if stats is None:
+        return _save_h5_packed(packed, group)
+    t0 = time.perf_counter()
+    _save_h5_packed(packed, group)
+    path = "%s/%s" % (group.name.rstrip("/"), H5_PACKED_SCALARS)
+    stats.record("save", path, time.perf_counter() - t0, None, "packed")
+
+
+def _save_h5_items(items, group, kw):
+    """ save the (key, value) items in group (kw: parameters of
+        dictToH5Group) """
+    stats = current_stats()
+    for key, value in items:
+        log.debug("saving %s in %s", key, group)
+        if _is_lazy_dataset(value):
+            value = value.read()
+        if stats is None:
+            _save_h5_key(value, group, key, kw)
+            continue
+        fallback = []
+        t0 = time.perf_counter()
+        encoding = _save_h5_key(value, group, key, kw, fallback)
+        stats.record(
+            "save",
+            "%s/%s" % (group.name.rstrip("/"), key),
+            time.perf_counter() - t0,
+            value,
+            encoding,
+            fallback[0] if fallback else None,
+        )
+
+
+def _save_h5_key(value, group, key, kw, fallback=None):
+    """ save value as group[key] (kw: parameters of dictToH5Group), return
+        the encoding used; fallback: list the error that made h5py refuse
+        value is appended to (if any) """
+    if kw["list_encoding"] == "compact" and _is_list_of_arrays(value):
+        return _save_list_of_arrays(value, group, key, kw["storage_policy"])
+    if kw["list_encoding"] == "compact" and _is_list_of_records(value):
+        columns = _record_columns(value)
+        if columns is not None:
+            h5_group = group.create_group(key)
+            h5_group.attrs["IS_RECORD_LIST"] = True
+            dictToH5Group(columns, h5_group, **kw)
+            return "record_list"
+    # numpy unicode arrays can not be saved by h5py as they are
+    if isinstance(value, np.str_):
+        value = str(value)
+    elif isinstance(value, np.ndarray) and value.dtype.kind == "U":
+        return _save_h5_strings(value, group, key, kw["storage_policy"])
+    # hope for the best (i.e. h5py can handle that)
+    try:
+        encoding = "native"
+        if kw["link_copy"] and isinstance(value, np.ndarray):
+            value = _find_link(value, group, key, kw["link_cache"])
+            if isinstance(value, h5py.Dataset):
+                encoding = "link"
+        else:
+            if isinstance(value, h5py.Dataset):
+                value = value[:]
+                # hdf5 dataset have to be read first ...
+        _write_h5_dataset(group, key, value, kw["storage_policy"])
+        return encoding
+    except (TypeError, ValueError) as e:
+        log.debug(
+            "For %s, h5py could not handle the saving on its own, trying to convert it, error was %s"
+            % (key, e)
+        )
+        if fallback is not None:
+            fallback.append("%s: %s" % (type(e).__name__, e))
+        if isinstance(value, dict) or hasattr(value, "__dict__"):
+            if key not in group:
+                group.create_group(key)
+            try:
+                dictToH5Group(value, group[key], **kw)
+            # objects have __dict__ but can be coverted to dict like only
+            # by DataStorage (and not by dict)
+            except:
+                dictToH5Group(DataStorage(value), group[key], **kw)
+            return "group"
+        elif isinstance(value, collections.abc.Iterable):
+            if key not in group:
+                group.create_group(key)
+            group[key].attrs["IS_LIST"] = True
+            fmt = "index%%0%dd" % math.ceil(np.log10(len(value)))
+            # list elements are never packed (read back by their names)
+            items = [(fmt % index, array) for index, array in enumerate(value)]
+            _save_h5_items(items, group[key], kw)
+            return "IS_LIST"
+        elif value is None:
+            group[key] = "NONE_PYTHON_OBJECT"
+            return "None"
+        else:
+            log.warn("Could not convert %s into an object that can be saved" % key)
+            return "unsupported"
+
+
+def openH5(fname, mode="r", locking=None, swmr=False):
+    """ Open a hdf5 file (without changing process wide settings like the
+        HDF5_USE_FILE_LOCKING environment variable)
+        locking: True, False, "best-effort" (h5py>=3.7) or None for the
+                 HDF5 default (that can be set with HDF5_USE_FILE_LOCKING)
+        swmr: if True the file is opened as single-writer/multiple-reader
+              reader (mode "r") or with the latest file format needed by
+              swmr writers (other modes) """
+    kw = dict()
+    if locking is not None:
+        if _h5py_version() >= (3, 5):
+            kw["locking"] = locking
+        else:
+            log.warning(
+                "h5py %s can not set the locking of a file, ignoring locking=%s"
+                % (h5py.__version__, locking)
             )
-            if isinstance(value, dict) or hasattr(value, "__dict__"):
-                if key not in group:
-                    group.create_group(key)
-                try:
-                    value = dictToH5Group(value, group[key], link_copy=link_copy)
-                # objects have __dict__ but can be coverted to dict like only
-                # by DataStorage (and not by dict)
-                except:
-                    value = dictToH5Group(
-                        DataStorage(value), group[key], link_copy=link_copy
-                    )
-            # take care of unicode (h5py can't handle numpy unicode arrays)
-            elif isinstance(value, np.ndarray) and value.dtype.char == "U":
-                value = np.asarray([vv.encode("ascii") for vv in value])
-                group[key] = value
-            elif isinstance(value, collections.abc.Iterable):
-                if key not in group:
-                    group.create_group(key)
-                group[key].attrs["IS_LIST"] = True
-                fmt = "index%%0%dd" % math.ceil(np.log10(len(value)))
-                for index, array in enumerate(value):
-                    dictToH5Group({fmt % index: array}, group[key], link_copy=link_copy)
-            elif value is None:
-                group[key] = "NONE_PYTHON_OBJECT"
-            else:
-                log.warn("Could not convert %s into an object that can be saved" % key)
+    if swmr:
+        kw["libver"] = "latest"
+        if mode == "r":
+            kw["swmr"] = True
+    return h5py.File(fname, mode, **kw)
+
+
+def dictToH5(
+    h5,
+    d,
+    link_copy=False,
+    list_encoding="group",
+    storage_policy=None,
+    locking=None,
+    index=None,
+    scalar_encoding="dataset",
+):
+    """ Save a dictionary into an hdf5 file
+        h5py is not capable of handling dictionaries natively
+        list_encoding, storage_policy, scalar_encoding: see dictToH5Group
+        locking: file locking (see openH5)
+        index: summary index stored in the root attributes (see inspect)"""
+    h5 = openH5(h5, mode="w", locking=locking)
+    try:
+        # the link cache lives only for the duration of this save
+        dictToH5Group(
+            d,
+            h5["/"],
+            link_copy=link_copy,
+            link_cache=_LinkCache(),
+            list_encoding=list_encoding,
+            storage_policy=storage_policy,
+            scalar_encoding=scalar_encoding,
+        )
+        if index is not None:
+            _write_h5_index(h5, index)
+    finally:
+        h5.close()
+
+
+def _write_h5_index(h5, index):
+    from .summary import write_h5_index
+
+    write_h5_index(h5, index)
+
+
+def updateH5(
+    h5,
+    d,
+    paths,
+    link_copy=False,
+    list_encoding="group",
+    storage_policy=None,
+    locking=None,
+    index=None,
+    scalar_encoding="dataset",
+):
+    """ Rewrite only some keys of an existing hdf5 file
+        d: dictionary with the full content
+        paths: keys to rewrite ("a/b/c" for nested keys), keys not in d are
+               deleted from the file
+        locking: file locking (see openH5)
+        index: summary index of d, replaces the stored one (see inspect)
+        the rest of the file is not touched; note that hdf5 does not reclaim
+        the space of deleted datasets (h5repack can be used for that)"""
+    fname = h5
+    h5 = openH5(h5, mode="a", locking=locking)
+    link_cache = _LinkCache()
+    try:
+        for path in sorted(paths):
+            parts = path.split("/")
+            group = h5["/"]
+            value = d
+            for part in parts[:-1]:
+                group = group.require_group(part)
+                value = value.get(part, dict()) if isinstance(value, dict) else dict()
+            key = parts[-1]
+            _remove_h5_packed(group, key)
+            if key in group:
+                del group[key]
+            if isinstance(value, dict) and key in value:
+                log.debug("rewriting %s" % path)
+                dictToH5Group(
+                    {key: value[key]},
+                    group,
+                    link_copy=link_copy,
+                    link_cache=link_cache,
+                    list_encoding=list_encoding,
+                    storage_policy=storage_policy,
+                    scalar_encoding=scalar_encoding,
+                )
+        if index is not None:
+            _write_h5_index(h5, index)
+    finally:
+        h5.close()
+        _invalidate_read_cache(fname)
+
+
+def h5ToDict(
+    h5,
+    readH5pyDataset=True,
+    add_attrs=False,
+    stack_lists=False,
+    keys=None,
+    locking=False,
+    swmr=False,
+):
+    """ Read a hdf5 file into a dictionary
+        stack_lists: return lists of arrays with same shape as stacked array
+                     and lists of records as dict of columns
+        keys: read only these keys (see read)
+        locking, swmr: see openH5 (by default files are read without locking
+                       so that files open for writing can be read) """
+    h = openH5(h5, "r", locking=locking, swmr=swmr)
+    try:
+        if keys is not None:
 
+            def node_value(node):
+                return _h5_node_value(node, readH5pyDataset, stack_lists)
 
-def dictToH5(h5, d, link_copy=False):
-    """ Save a dictionary into an hdf5 file
-        h5py is not capable of handling dictionaries natively"""
-    global _array_cache
-    _array_cache = dict()
-    if has_h5py_version_lock:
-        os.environ["HDF5_USE_FILE_LOCKING"] = "TRUE"
-    h5 = h5py.File(h5, mode="w")
-    dictToH5Group(d, h5["/"], link_copy=link_copy)
-    h5.close()
-    _array_cache = dict()
-    # clean up memory ...
-
-
-def h5ToDict(h5, readH5pyDataset=True, add_attrs=False):
-    """ Read a hdf5 file into a dictionary """
-    if has_h5py_version_lock:
-        os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
-    h = h5py.File(h5, "r")
-    ret = unwrapArray(h, recursive=True, readH5pyDataset=readH5pyDataset, add_attrs=add_attrs)
+            ret = _select_h5(
+                h, _as_key_patterns(keys), node_value, add_attrs=add_attrs
+            )
+        else:
+            loader = _H5Loader(
+                readH5pyDataset=readH5pyDataset,
+                add_attrs=add_attrs,
+                stack_lists=stack_lists,
+            )
+            ret = loader.load(h.id)
+    except Exception:
+        h.close()
+        raise
     if readH5pyDataset:
         h.close()
     return ret
 
 
-def npzToDict(npzFile):
-    with np.load(npzFile, allow_pickle=True) as npz:
-        d = dict(npz)
+def npzToDict(npzFile, keys=None):
+    """ Read a npz file (flat or nested layout, see dictToNpz) into a
+        dictionary
+        keys: read only these keys (see read); only the needed members of
+              the npz file are loaded """
+    with np.load(npzFile, allow_pickle=False) as npz:
+        manifest = _npz_manifest(npz)
+        # the nested layout pickles the dictionaries
+        npz.allow_pickle = manifest is None or manifest["allow_pickle"]
+        if manifest is not None:
+            entry = manifest["data"]
+            if keys is not None:
+                entry = _select_manifest(entry, _as_key_patterns(keys))
+            return _from_manifest(entry, lambda e: npz[e["file"]])
+        if keys is None:
+            d = dict(npz)
+        else:
+            patterns = _as_key_patterns(keys)
+            d = dict(
+                (key, npz[key])
+                for key in npz.files
+                if _match_key_patterns((key,), patterns)
+            )
     d = unwrapArray(d, recursive=True)
+    if keys is not None:
+        d = _select_dict(d, patterns)
     return d
 
 
-def npyToDict(npyFile):
+def npyToDict(npyFile, keys=None):
+    """ Read a npy file into a dictionary
+        keys: return only these keys (see read), the file is read entirely """
     d = unwrapArray(np.load(str(npyFile), allow_pickle=True).item(), recursive=True)
+    if keys is not None:
+        d = _select_dict(d, _as_key_patterns(keys))
     return d
 
 
-def dictToNpz(npzFile, d):
-    np.savez(npzFile, **d)
+def dictToNpy(npyFile, d):
+    np.save(npyFile, _read_lazy(d))
+
 
+def _is_lazy_dataset(a):
+    """ True for the LazyDataset proxies returned by lazy reads (the lazy
+        module is not imported for that) """
+    lazy = sys.modules.get(__package__ + ".lazy")
+    return lazy is not None and isinstance(a, lazy.LazyDataset)
 
-def dictToNpy(npyFile, d):
-    np.save(npyFile, d)
+
+def _read_lazy(value):
+    """ value with the LazyDataset proxies (also in dicts and lists) read as
+        arrays """
+    if _is_lazy_dataset(value):
+        return value.read()
+    if isinstance(value, dict):
+        return dict((key, _read_lazy(v)) for key, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(_read_lazy(v) for v in value)
+    return value
+
+
+DSDIR_MANIFEST = "manifest.json"
+NPZ_MANIFEST = "__datastorage_manifest__"
+
+
+def _unique_name(name, used):
+    """ return name (or name_1, name_2, ...) not already in used """
+    candidate = name
+    n = 1
+    while candidate in used:
+        candidate = "%s_%d" % (name, n)
+        n += 1
+    used.add(candidate)
+    return candidate
+
+
+def _list_array(value):
+    """ array of a list of numbers (or of strings), saved as a single array
+        like the nested npz layout and hdf5 do; None for other lists (saved
+        element by element) """
+    if len(value) == 0:
+        return None
+    if not (
+        all(isinstance(v, str) for v in value)
+        or all(isinstance(v, (int, float, complex, np.number, np.bool_)) for v in value)
+    ):
+        return None
+    array = np.asarray(value)
+    # python ints too big for int64 give object arrays
+    return array if array.dtype.kind in "biufcU" else None
+
+
+def _to_manifest(value, store, relpath=()):
+    """ return the manifest entry describing value; arrays are saved by
+        store(relpath, array) that returns their reference (file or member
+        name) """
+    if _is_lazy_dataset(value):
+        value = value.read()
+    if isinstance(value, dict) or (
+        hasattr(value, "__dict__") and not isinstance(value, np.ndarray)
+    ):
+        if not isinstance(value, dict):
+            value = DataStorage(value)
+        items = dict(
+            (key, _to_manifest(v, store, relpath + (str(key),)))
+            for key, v in value.items()
+        )
+        return dict(type="dict", items=items)
+    if isinstance(value, (list, tuple)):
+        array = _list_array(value)
+        if array is not None:
+            ref = store(relpath, array, False)
+            return dict(type="array", file=ref, allow_pickle=False)
+        items = [
+            _to_manifest(v, store, relpath + ("%06d" % i,))
+            for i, v in enumerate(value)
+        ]
+        return dict(type="list", items=items)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return dict(type="value", value=value)
+    if isinstance(value, np.generic) and value.dtype.kind in "biuf":
+        return dict(type="value", value=value.item())
+    # arrays (and anything numpy can convert, like complex or bytes)
+    array = np.asarray(value)
+    allow_pickle = array.dtype.hasobject
+    if allow_pickle:
+        log.warning("%s is an object array, it will be pickled" % "/".join(relpath))
+    kind = "array" if isinstance(value, np.ndarray) else "scalar"
+    ref = store(relpath, array, allow_pickle)
+    return dict(type=kind, file=ref, allow_pickle=allow_pickle)
+
+
+def _from_manifest(entry, load):
+    """ rebuild the object described by the manifest entry, arrays are
+        read by load(entry) """
+    kind = entry["type"]
+    if kind == "value":
+        return entry["value"]
+    if kind == "dict":
+        return dict(
+            (key, _from_manifest(e, load)) for key, e in entry["items"].items()
+        )
+    if kind == "list":
+        return [_from_manifest(e, load) for e in entry["items"]]
+    array = load(entry)
+    return array if kind == "array" else array[()]
+
+
+def _select_manifest(entry, patterns, path=()):
+    """ manifest entry with only the keys selected by patterns """
+    items = dict()
+    for key, e in entry["items"].items():
+        key_path = path + (key,)
+        status = _match_key_patterns(key_path, patterns)
+        if status == 2:
+            items[key] = e
+        elif status == 1 and e["type"] == "dict":
+            sub = _select_manifest(e, patterns, key_path)
+            if len(sub["items"]) > 0:
+                items[key] = sub
+    return dict(type="dict", items=items)
+
+
+def _uses_pickle(entry):
+    if entry["type"] in ("dict", "list"):
+        items = entry["items"]
+        items = items.values() if isinstance(items, dict) else items
+        return any(_uses_pickle(e) for e in items)
+    return entry.get("allow_pickle", False)
+
+
+def dictToNpz(npzFile, d, layout="nested", compressed=False, index=None):
+    """ Save a dictionary in a npz file
+
+        layout: "nested" (default, readable by older versions) saves every
+                top level key with np.savez (nested dictionaries are
+                pickled); "flat" saves every array as its own member named by
+                its path (for example key2/data1), scalars, strings, None and
+                the structure are saved in a json manifest (no pickle needed)
+        compressed: use zip compression (as np.savez_compressed)
+        index: summary index stored in the manifest (flat layout only, see
+               inspect)
+    """
+    if layout == "nested":
+        savez = np.savez_compressed if compressed else np.savez
+        return savez(npzFile, **_read_lazy(d))
+    arrays = dict()
+    used = set([NPZ_MANIFEST])
+
+    def store(relpath, array, allow_pickle):
+        name = _unique_name("/".join(relpath), used)
+        arrays[name] = array
+        return name
+
+    manifest = dict(format="datastorage-npz", version=1, data=_to_manifest(d, store))
+    manifest["allow_pickle"] = _uses_pickle(manifest["data"])
+    if index is not None:
+        manifest["index"] = index
+    compression = zipfile.ZIP_DEFLATED if compressed else zipfile.ZIP_STORED
+    # same as np.savez (but without restrictions on the member names)
+    with zipfile.ZipFile(str(npzFile), mode="w", compression=compression) as zf:
+        # utf8 bytes (numpy unicode arrays take 4 bytes per character)
+        arrays[NPZ_MANIFEST] = np.frombuffer(json.dumps(manifest).encode(), np.uint8)
+        for name, array in arrays.items():
+            with zf.open(name + ".npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, array, allow_pickle=array.dtype.hasobject)
+
+
+def _npz_manifest(npz):
+    """ return the manifest of a npz file saved with the flat layout """
+    if NPZ_MANIFEST not in npz.files:
+        return None
+    return json.loads(npz[NPZ_MANIFEST].tobytes().decode("utf8"))
+
+
+def dictToDsdir(folder, d, index=None):
+    """ Save a dictionary in a folder: one npy file per array and the
+        structure (with scalars, strings and None) in a json manifest;
+        an existing datastorage folder is replaced
+        index: summary index stored in the manifest (see inspect) """
+    folder = pathlib.Path(folder)
+    if folder.exists():
+        if not (folder / DSDIR_MANIFEST).is_file():
+            raise ValueError(
+                "%s exists and it is not a datastorage folder, not overwriting"
+                % folder
+            )
+        shutil.rmtree(str(folder))
+    folder.mkdir(parents=True)
+    used = set()
+
+    def store(relpath, array, allow_pickle):
+        parts = [re.sub(r"[^\w.-]", "_", p) or "_" for p in relpath]
+        name = _unique_name("/".join(parts), used)
+        fname = folder.joinpath(*(name + ".npy").split("/"))
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        np.save(str(fname), array, allow_pickle=allow_pickle)
+        return name + ".npy"
+
+    manifest = dict(format="datastorage-dsdir", version=1, data=_to_manifest(d, store))
+    if index is not None:
+        manifest["index"] = index
+    with open(str(folder / DSDIR_MANIFEST), "w") as f:
+        json.dump(manifest, f)
+
+
+def dsdirToDict(folder, keys=None, mmap_mode="r"):
+    """ Read a folder saved by dictToDsdir into a dictionary
+        arrays are memory mapped (np.load(mmap_mode=mmap_mode)), use
+        mmap_mode=None to read them in memory, "c" for copy-on-write
+        keys: read only these keys (see read) """
+    folder = pathlib.Path(folder)
+    with open(str(folder / DSDIR_MANIFEST), "r") as f:
+        manifest = json.load(f)
+    entry = manifest["data"]
+    if keys is not None:
+        entry = _select_manifest(entry, _as_key_patterns(keys))
+
+    def load(entry):
+        fname = str(folder.joinpath(*entry["file"].split("/")))
+        if entry["allow_pickle"]:
+            return np.load(fname, allow_pickle=True)
+        return np.load(fname, mmap_mode=mmap_mode if entry["type"] == "array" else None)
+
+    return _from_manifest(entry, load)
+
+
+# built-in backends (see datastorage.backends), the functions get all the
+# keywords of read/save and use the ones they support
+
+
+def _read_h5(
+    fname,
+    keys=None,
+    readH5pyDataset=True,
+    add_attrs=False,
+    stack_lists=False,
+    locking=False,
+    swmr=False,
+    **options
+):
+    return h5ToDict(
+        fname,
+        readH5pyDataset=readH5pyDataset,
+        add_attrs=add_attrs,
+        stack_lists=stack_lists,
+        keys=keys,
+        locking=locking,
+        swmr=swmr,
+    )
+
+
+def _save_h5(
+    fname,
+    d,
+    paths=None,
+    link_copy=True,
+    list_encoding="group",
+    storage_policy=None,
+    locking=None,
+    index=None,
+    scalar_encoding="dataset",
+    **options
+):
+    h5_kw = dict(
+        link_copy=link_copy,
+        list_encoding=list_encoding,
+        storage_policy=storage_policy,
+        locking=locking,
+        index=index,
+        scalar_encoding=scalar_encoding,
+    )
+    if paths is not None:
+        return updateH5(fname, d, paths, **h5_kw)
+    return dictToH5(fname, d, **h5_kw)
+
+
+def _lazy_h5(
+    fname,
+    keys=None,
+    cache_bytes=DEFAULT_LAZY_CACHE_BYTES,
+    add_attrs=False,
+    locking=False,
+    swmr=False,
+    **options
+):
+    from .lazy import h5ToLazy
+
+    return h5ToLazy(
+        fname,
+        cache_bytes=cache_bytes,
+        add_attrs=add_attrs,
+        keys=keys,
+        locking=locking,
+        swmr=swmr,
+    )
+
+
+def _read_npz(fname, keys=None, **options):
+    return npzToDict(fname, keys=keys)
+
+
+def _save_npz(
+    fname, d, storage_policy=None, npz_layout="nested", index=None, **options
+):
+    policy = _as_storage_policy(storage_policy)
+    compressed = policy is not None and policy.compression is not None
+    return dictToNpz(
+        fname, d, layout=npz_layout, compressed=compressed, index=index
+    )
+
+
+def _lazy_npz(fname, keys=None, cache_bytes=DEFAULT_LAZY_CACHE_BYTES, **options):
+    from .lazy import npzToLazy
+
+    return npzToLazy(fname, cache_bytes=cache_bytes, keys=keys)
+
+
+def _read_npy(fname, keys=None, **options):
+    return npyToDict(fname, keys=keys)
+
+
+def _save_npy(fname, d, **options):
+    return dictToNpy(fname, d)
+
+
+def _read_dsdir(fname, keys=None, mmap_mode="r", **options):
+    return dsdirToDict(fname, keys=keys, mmap_mode=mmap_mode)
+
+
+def _save_dsdir(fname, d, index=None, **options):
+    return dictToDsdir(fname, d, index=index)
+
+
+def _is_dsdir(fname):
+    return (pathlib.Path(fname) / DSDIR_MANIFEST).is_file()
+
+
+def _inspect_h5(fname):
+    from .summary import inspect_h5
+
+    return inspect_h5(fname)
+
+
+def _inspect_npz(fname):
+    from .summary import inspect_npz
+
+    return inspect_npz(fname)
+
+
+def _inspect_dsdir(fname):
+    from .summary import inspect_dsdir
+
+    return inspect_dsdir(fname)
+
+
+register_backend(
+    Backend(
+        "hdf5",
+        _read_h5,
+        _save_h5,
+        lazy=_lazy_h5,
+        incremental=True,
+        inspect=_inspect_h5,
+    ),
+    ".h5",
+    default=True,
+)
+register_backend(
+    Backend("npz", _read_npz, _save_npz, lazy=_lazy_npz, inspect=_inspect_npz),
+    ".npz",
+)
+register_backend(Backend("npy", _read_npy, _save_npy), ".npy")
+register_backend(
+    Backend(
+        "dsdir", _read_dsdir, _save_dsdir, exists=_is_dsdir, inspect=_inspect_dsdir
+    ),
+    ".dsdir",
+)
 
 
 def _toDict(datastorage_obj, recursive=True):
     """ this is the recursive part of the toDict (otherwise it fails when converting to DataStorage """
-    if "items" not in dir(datastorage_obj):
+    # hasattr is much faster than dir() for the (many) leaves
+    if not isinstance(datastorage_obj, dict) and not hasattr(datastorage_obj, "items"):
         return datastorage_obj
     d = dict()
     for k, v in datastorage_obj.items():
@@ -379,71 +1765,369 @@ def toDict(datastorage_obj, recursive=True):
     """ convert a DataStorage object to a dictionary (useful for saving); it should work for other objects too 
     """
     # if not a DataStorage, convert to it first
-    if "items" not in dir(datastorage_obj):
+    if not isinstance(datastorage_obj, dict) and "items" not in dir(datastorage_obj):
         datastorage_obj = DataStorage(datastorage_obj)
     return _toDict(datastorage_obj)
 
 
-def read(fname, raiseError=True, readH5pyDataset=True, add_attrs=False):
+def read(
+    fname,
+    raiseError=True,
+    readH5pyDataset=True,
+    add_attrs=False,
+    lazy=False,
+    cache_bytes=DEFAULT_LAZY_CACHE_BYTES,
+    stack_lists=False,
+    keys=None,
+    mmap_mode="r",
+    locking=False,
+    swmr=False,
+    cache=None,
+):
+    """ read a storage file (npz, npy, dsdir or hdf5) and return a DataStorage
+
+        keys: read only these keys; a key is a path ("run/diagnostics/i0")
+              whose elements can be glob patterns ("*/i0", "run/i*"); a key
+              selecting a group reads the whole group. Only the selected
+              datasets (and the groups leading to them) are read
+        stack_lists: hdf5 only, lists of arrays with same shape are returned
+                     as a single stacked array (instead of list) and lists
+                     of records (saved as columns) as a DataStorage of
+                     columns (as unwrap would return) instead of a list of
+                     dicts
+        lazy: hdf5 and npz (flat layout) only, datasets are read only when
+              accessed (see datastorage.lazy), the returned LazyDataStorage
+              keeps the file open and should be used as context manager (or
+              closed)
+        cache_bytes: memory budget of the lazy reader cache
+        mmap_mode: dsdir only, mode used to memory map the arrays ("r",
+                   "c" for copy-on-write or None to load them in memory)
+        locking: hdf5 only, file locking (True, False, "best-effort" or None
+                 for the HDF5 default); False (default) allows reading files
+                 open for writing by other processes
+        swmr: hdf5 only, open the file as single-writer/multiple-reader
+              reader, to read files being appended to by a swmr writer (see
+              DataStorageWriter); with lazy=True, LazyDataStorage.refresh
+              updates the datasets to the last flushed data
+        cache: None uses the process-wide read cache if enabled (see
+               datastorage.enable_read_cache), False bypasses it, or a
+               ReadCache instance; cached results have read-only arrays
+    """
+    t0 = time.perf_counter()
+    if cache is None:
+        from .cache import get_read_cache
+
+        cache = get_read_cache()
+    if cache and not lazy and readH5pyDataset:
+        options = (
+            add_attrs,
+            stack_lists,
+            keys if keys is None or isinstance(keys, str) else tuple(keys),
+            mmap_mode,
+        )
+        ret = cache.read(
+            fname,
+            options,
+            lambda: read(
+                fname,
+                raiseError=raiseError,
+                add_attrs=add_attrs,
+                stack_lists=stack_lists,
+                keys=keys,
+                mmap_mode=mmap_mode,
+                locking=locking,
+                swmr=swmr,
+                cache=False,
+            ),
+        )
+        if ret is not None:
+            ret._mark_clean(fname if keys is None else None)
+        _record_read(fname, t0, "cache")
+        return ret
     fname = pathlib.Path(fname)
     err_msg = "File " + str(fname) + " does not exist"
-    if not fname.is_file():
+    if not _is_storage_file(fname):
         if raiseError:
             raise ValueError(err_msg)
         else:
             log.error(err_msg)
             return None
-    extension = fname.suffix
+    backend = get_backend(fname)
     log.info("Reading storage file %s" % fname)
-    if extension == ".npz":
-        return DataStorage(npzToDict(fname))
-    elif extension == ".npy":
-        return DataStorage(npyToDict(fname))
-    elif extension == ".h5":
-        return DataStorage(h5ToDict(fname, readH5pyDataset=readH5pyDataset))
+    if lazy:
+        if backend.lazy is None:
+            raise ValueError("lazy reading is not supported for %s files" % backend.name)
+        ret = backend.lazy(
+            fname,
+            keys=keys,
+            cache_bytes=cache_bytes,
+            add_attrs=add_attrs,
+            locking=locking,
+            swmr=swmr,
+        )
     else:
-        try:
-            return DataStorage(h5ToDict(fname, readH5pyDataset=readH5pyDataset, add_attrs=add_attrs))
-        except Exception as e:
-            err_msg = (
-                "Could not read " + str(fname) + " as hdf5 file, error was: %s" % e
-            )
-            log.error(err_msg)
-            if raiseError:
-                raise ValueError(err_msg)
-            else:
-                return None
+        options = dict(
+            readH5pyDataset=readH5pyDataset,
+            add_attrs=add_attrs,
+            stack_lists=stack_lists,
+            mmap_mode=mmap_mode,
+            locking=locking,
+            swmr=swmr,
+        )
+        if get_backend(fname, default=False) is not None:
+            ret = DataStorage(backend.read(fname, keys=keys, **options))
+        else:
+            # unknown extension, try the default backend (hdf5)
+            try:
+                ret = DataStorage(backend.read(fname, keys=keys, **options))
+            except Exception as e:
+                err_msg = "Could not read %s as %s file, error was: %s" % (
+                    fname,
+                    backend.name,
+                    e,
+                )
+                log.error(err_msg)
+                if raiseError:
+                    raise ValueError(err_msg)
+                else:
+                    return None
+    # a partial read can not be used as reference for incremental saves and
+    # a lazy read keeps the file open (it could not be opened for writing)
+    ret._mark_clean(fname if keys is None and not lazy else None)
+    _record_read(fname, t0, "lazy" if lazy else "file")
+    return ret
 
 
-def save(fname, d, link_copy=True, raiseError=False):
-    """ link_copy is used by hdf5 saving only, it allows to creat link of identical arrays (saving space) """
+def _record_read(fname, t0, encoding):
+    stats = current_stats()
+    if stats is not None:
+        stats.record("read", str(fname), time.perf_counter() - t0, None, encoding)
+
+
+def _read_one(fname, raiseError, kwargs):
+    """ read for read_many (module level to be usable by processes) """
+    try:
+        return read(fname, raiseError=raiseError, **kwargs)
+    except Exception:
+        if raiseError:
+            raise
+        log.exception("Could not read %s" % fname)
+        return None
+
+
+def read_many(
+    files,
+    keys=None,
+    workers=None,
+    executor="process",
+    combine=False,
+    raiseError=True,
+    **kwargs
+):
+    """ read many files concurrently, the results are in the order of files
+
+        keys: read only these keys (see read)
+        workers: number of threads/processes (default: number of cpus)
+        executor: "process" or "thread"; h5py holds a global lock while
+                  reading (and decompressing) so for hdf5 files processes
+                  scale better
+        combine: if True, combine the results in one DataStorage (as done by
+                 unwrap); files that could not be read are skipped
+        raiseError: if False, files that can not be read are logged and
+                    returned as None (as read does)
+        other keywords are passed to read
+    """
+    if kwargs.get("lazy", False):
+        raise ValueError("read_many does not support lazy reading")
+    files = list(files)
+    kwargs["keys"] = keys
+    if executor == "process":
+        pool = concurrent.futures.ProcessPoolExecutor
+    elif executor == "thread":
+        pool = concurrent.futures.ThreadPoolExecutor
+    else:
+        raise ValueError("executor must be 'process' or 'thread', it was %s" % executor)
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(files)))
+    if workers == 1:
+        results = [_read_one(f, raiseError, kwargs) for f in files]
+    else:
+        with pool(max_workers=workers) as ex:
+            n = len(files)
+            results = list(ex.map(_read_one, files, [raiseError] * n, [kwargs] * n))
+    if combine:
+        good = [r for r in results if r is not None]
+        if len(good) != len(results):
+            log.warning("%d files could not be read" % (len(results) - len(good)))
+        return unwrap(good)
+    return results
+
+
+def save(
+    fname,
+    d,
+    link_copy=True,
+    raiseError=False,
+    list_encoding="group",
+    storage_policy=None,
+    incremental=False,
+    npz_layout="nested",
+    locking=None,
+    index_stats=False,
+    scalar_encoding="dataset",
+):
+    """ the format is chosen by the extension: h5, npz, npy or dsdir (folder
+        with one npy file per array, see dictToDsdir)
+        npz_layout is used by npz saving only, "nested" (default) or "flat"
+        (one member per array, see dictToNpz); a storage_policy with compression
+        saves a compressed npz file
+        link_copy is used by hdf5 saving only, it allows to creat link of identical arrays (saving space)
+        list_encoding is used by hdf5 saving only, see dictToH5Group
+        scalar_encoding is used by hdf5 saving only: "packed" saves the
+        scalars, short strings and None of each group as a single dataset
+        (much smaller and faster files with many scalars), see dictToH5Group
+        storage_policy is used by hdf5 saving, StoragePolicy instance (or
+        "gzip"/"lzf" or dict of StoragePolicy parameters) defining compression
+        and chunking
+        incremental is used by hdf5 saving only: if d is a DataStorage read
+        from (or last saved to) fname, only the keys modified since then are
+        rewritten (see DataStorage.dirty_keys)
+        locking is used by hdf5 saving only, file locking (True, False,
+        "best-effort" or None for the HDF5 default)
+        a summary index of the keys (shapes, dtypes, sizes) is saved with
+        h5, dsdir and flat npz files (see inspect); index_stats also stores
+        the min/max/mean of the numeric arrays """
     # make sure the object is dict (recursively) this allows reading it
     # without the DataStorage module
     fname = pathlib.Path(fname)
+    obj = d
+    _release_lazy_file(obj, fname)
     d = toDict(d, recursive=True)
-    d["filename"] = str(fname)
-    extension = fname.suffix
-    log.info("Saving storage file %s" % fname)
+    paths = _incremental_paths(obj, fname, incremental)
     try:
-        if extension == ".npz":
-            return dictToNpz(fname, d)
-        elif extension == ".h5":
-            return dictToH5(fname, d, link_copy=link_copy)
-        elif extension == ".npy":
-            return dictToNpy(fname, d)
-        else:
-            raise ValueError("Extension must be h5, npy or npz, it was %s" % extension)
+        ret = _save_dict(
+            fname,
+            d,
+            paths=paths,
+            link_copy=link_copy,
+            list_encoding=list_encoding,
+            storage_policy=storage_policy,
+            npz_layout=npz_layout,
+            locking=locking,
+            index_stats=index_stats,
+            scalar_encoding=scalar_encoding,
+        )
+        if isinstance(obj, DataStorage):
+            obj._mark_clean(fname)
+        return ret
     except Exception as e:
         log.exception("Could not save %s" % fname)
         if raiseError:
             raise e
 
 
+def _release_lazy_file(obj, fname):
+    """ a LazyDataStorage keeps its file open (read only); to save into that
+        file the datasets are read in memory and the file is closed """
+    lazy = sys.modules.get(__package__ + ".lazy")
+    if lazy is None or not isinstance(obj, lazy.LazyDataStorage):
+        return
+    handle = obj.__dict__.get("_lazy_handle")
+    if handle is None or handle.closed or not fname.exists():
+        return
+    if os.path.samefile(handle.filename, str(fname)):
+        log.info("Reading %s in memory before saving into it" % fname)
+        obj.load()
+
+
+def _incremental_paths(obj, fname, incremental):
+    """ keys to rewrite for an incremental save of obj to fname (None to
+        save all keys) """
+    backend = get_backend(fname, default=False)
+    if not incremental or backend is None or not backend.incremental:
+        return None
+    if _is_synced(obj, fname):
+        return obj.dirty_keys()
+    log.info("%s was not read from %s, saving all keys" % (obj, fname))
+    return None
+
+
+def _save_dict(fname, d, paths=None, **options):
+    """ write d (a dict as returned by toDict) to fname (pathlib.Path)
+        paths: hdf5 only, keys to rewrite in an existing file (None for all)
+        options: keywords of save, each format uses the ones it supports """
+    stats = current_stats()
+    if stats is None:
+        return _write_dict(fname, d, paths, options)
+    t0 = time.perf_counter()
+    ret = _write_dict(fname, d, paths, options)
+    stats.record("save", str(fname), time.perf_counter() - t0, None, "file")
+    return ret
+
+
+def _write_dict(fname, d, paths, options):
+    backend = get_backend(fname, default=False)
+    if backend is None:
+        raise ValueError(
+            "Extension must be one of %s, it was %s"
+            % (", ".join(ext[1:] for ext in backends.extensions()), fname.suffix)
+        )
+    index = None
+    if backend.inspect is not None:
+        from .summary import summary_index
+
+        index = summary_index(d, stats=options.get("index_stats", False))
+    d["filename"] = str(fname)
+    log.info("Saving storage file %s" % fname)
+    try:
+        return backend.save(fname, d, paths=paths, index=index, **options)
+    finally:
+        _invalidate_read_cache(fname)
+
+
+def _invalidate_read_cache(fname):
+    """ forget the results of the process-wide read cache for fname (called
+        when the file is written) """
+    cache = sys.modules.get(__package__ + ".cache")
+    if cache is not None and isinstance(fname, (str, os.PathLike)):
+        cache.invalidate_read_cache(fname)
+
+
+def _is_storage_file(fname):
+    """ True for files and for folders saved in dsdir format """
+    backend = get_backend(fname)
+    return backend is not None and backend.exists(fname)
+
+
+def _is_synced(obj, fname):
+    """ True if obj has been read from (or last saved to) fname """
+    return (
+        isinstance(obj, DataStorage)
+        and fname.is_file()
+        and obj._synced_file == str(fname.resolve())
+    )
+
+
+def _is_hidden_key(key):
+    """ hidden keys (filename, _private, ...) are not saved nor listed """
+    return isinstance(key, str) and (key == "filename" or key[:1] in ("_", ""))
+
+
+# instance attributes used for the modified keys bookkeeping (not keys)
+_BOOKKEEPING_ATTRIBUTES = ("_dirty", "_synced_file", "_lazy_handle")
+
+# used by DataStorage.__getattribute__ (module level for speed)
+_dict_get = dict.get
+_object_getattribute = object.__getattribute__
+_NOT_A_KEY = object()
+
+
 class DataStorage(dict):
     """ Storage for dict like object. It also tries to convert general
         objects to instances by using __dict__
 
-        It can save data to file (format npy,npz or h5)
+        It can save data to file (format npy,npz,dsdir or h5)
 
         Parameters
         ----------
@@ -474,6 +2158,9 @@ class DataStorage(dict):
     """
 
     def __init__(self, *args, **kwargs):
+        # keys modified since last read/save (not saved as keys)
+        self._dirty = set()
+        self._synced_file = None
         self.filename = kwargs.pop("filename", "data_storage.npz")
         self._recursive = kwargs.pop("recursive", True)
 
@@ -486,11 +2173,16 @@ class DataStorage(dict):
             input_data = dict()
 
         d = dict()  # data dictionary
+        synced_file = None
         if isinstance(input_data, dict):
             d = input_data
+            if isinstance(input_data, DataStorage):
+                self.filename = input_data.filename
         elif isinstance(input_data, str):
-            if os.path.isfile(input_data):
+            if _is_storage_file(input_data):
                 d = read(input_data)
+                self.filename = d.filename
+                synced_file = input_data
             else:
                 self.filename = input_data
                 d = dict()
@@ -504,40 +2196,110 @@ class DataStorage(dict):
                 log.error("Could not interpret input as object to package")
                 raise ValueError("Invalid DataStorage definition")
 
-        if self._recursive:
-            for k in d.keys():
-                if not isinstance(d[k], DataStorage) and isinstance(d[k], dict):
-                    d[k] = DataStorage(d[k])
-
-        # allow accessing with .data, .delays, etc.
+        # nested dict are converted by __setitem__ (if recursive)
         for k, v in d.items():
-            setattr(self, k, v)
+            self.__setitem__(k, v)
 
-        # allow accessing as proper dict
-        self.update(**dict(d))
+        if synced_file is not None:
+            self._mark_clean(synced_file)
 
     def __setitem__(self, key, value):
         """ method to add a key via obj["key"] = value """
-        # print("__setitem__")
-        setattr(self, key, value)
-
-    def __setattr__(self, key, value):
-        """ method to add a key via obj.key = value """
-        # check if attr exists is essential (or it fails when defining an
-        # instance)
-        # print("self.__setattr__")
+        # hidden keys are kept as instance attributes (not as dict items)
+        if _is_hidden_key(key):
+            object.__setattr__(self, key, value)
+            return
+        attributes = _object_getattribute(self, "__dict__")
         if (
-            hasattr(self, "_recursive")
-            and self._recursive
-            and isinstance(value, (dict, collections.OrderedDict))
+            attributes.get("_recursive", False)
+            and isinstance(value, dict)
+            and not isinstance(value, DataStorage)
         ):
             value = DataStorage(value)
-        super(DataStorage, self).__setitem__(key, value)
-        super(DataStorage, self).__setattr__(key, value)
+        dict.__setitem__(self, key, value)
+        dirty = attributes.get("_dirty")
+        if dirty is not None:
+            dirty.add(key)
+
+    # same as __setitem__ (not calling it saves a function call)
+    __setattr__ = __setitem__
+
+    def __getattribute__(self, key):
+        """ obj.key: the keys are looked up first (they hide the methods
+            with the same name, as in previous versions), then the normal
+            attributes (methods, filename, ...) """
+        value = _dict_get(self, key, _NOT_A_KEY)
+        if value is _NOT_A_KEY:
+            return _object_getattribute(self, key)
+        return value
+
+    def __missing__(self, key):
+        """ obj["filename"] (and other hidden keys) """
+        if _is_hidden_key(key) and key in self.__dict__:
+            return self.__dict__[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (
+            _is_hidden_key(key) and key in self.__dict__
+        )
+
+    def __len__(self):
+        # hidden keys (filename, ...) are counted as in previous versions
+        hidden = sum(1 for key in self.__dict__ if key not in _BOOKKEEPING_ATTRIBUTES)
+        return dict.__len__(self) + hidden
+
+    def __dir__(self):
+        # keys can be completed as attributes
+        keys = [key for key in dict.keys(self) if isinstance(key, str)]
+        return list(super(DataStorage, self).__dir__()) + keys
+
+    def __getstate__(self):
+        # copies and pickles track their own modifications
+        state = dict(self.__dict__)
+        state["_dirty"] = set(self._dirty)
+        return state
 
     def __delitem__(self, key):
-        delattr(self, key)
-        super(DataStorage, self).__delitem__(key)
+        if _is_hidden_key(key):
+            object.__delattr__(self, key)
+            return
+        dict.__delitem__(self, key)
+        self._mark_dirty(key)
+
+    def __delattr__(self, key):
+        try:
+            self.__delitem__(key)
+        except KeyError:
+            raise AttributeError(key)
+
+    def _mark_dirty(self, key):
+        # _dirty might not exist yet (unpickling sets items before __dict__)
+        dirty = self.__dict__.get("_dirty")
+        if dirty is not None:
+            dirty.add(key)
+
+    def _mark_clean(self, fname=None):
+        """ forget modifications (recursively), fname is the file the
+            object is now in sync with """
+        self._dirty.clear()
+        if fname is not None:
+            fname = str(pathlib.Path(fname).resolve())
+        self._synced_file = fname
+        for value in self.values():
+            if isinstance(value, DataStorage):
+                value._mark_clean(fname)
+
+    def dirty_keys(self):
+        """ return the keys (as "a/b/c" paths for nested DataStorage) that
+            have been set or deleted since the object was read or last saved;
+            in place modifications of arrays (data.a[0] = 1) are not tracked
+        """
+        paths = set(self._dirty)
+        for key, value in self.items():
+            if key not in self._dirty and isinstance(value, DataStorage):
+                paths.update(key + "/" + path for path in value.dirty_keys())
+        return paths
 
     def __str__(self):
         keys = list(self.keys())
@@ -587,46 +2349,211 @@ class DataStorage(dict):
             s.append(fmt % (k, value_str))
         return "\n".join(s)
 
-    #    def __getitem__(self,x):
-    #      if x[0] != "_": return x
-
-    def values(self):
-        return [self[k] for k in self.keys()]
-
-    def items(self):
-        keys = self.keys()
-        for k in keys:
-            yield k, self[k]
-
     def update(self, dictionary=None, **kwargs):
         if dictionary is None:
             dictionary = kwargs
         for (key, value) in dictionary.items():
             self.__setitem__(key, value)
 
-    def toDict(self):
-        return toDict(self)
+    def get(self, key, default=None):
+        return self[key] if key in self else default
 
     def keys(self):
-        keys = list(super(DataStorage, self).keys())
-        keys = [k for k in keys if k != "filename"]
-        keys = [k for k in keys if len(k) > 0 and k[0] != "_"]
-        return keys
+        return list(dict.keys(self))
+
+    def values(self):
+        return list(dict.values(self))
+
+    def items(self):
+        return list(dict.items(self))
+
+    # the methods below mark the keys they modify
+
+    def pop(self, key, *default):
+        if not dict.__contains__(self, key):
+            return dict.pop(self, key, *default)
+        self._mark_dirty(key)
+        return dict.pop(self, key)
 
-    def save(self, fname=None, link_copy=False, raiseError=False):
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._mark_dirty(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        # filename and the other hidden keys are kept
+        self._dirty.update(dict.keys(self))
+        dict.clear(self)
+
+    def toDict(self):
+        return toDict(self)
+
+    def save(self, fname=None, link_copy=False, raiseError=False, **options):
         """ link_copy: only works in hfd5 format
             save space by creating link when identical arrays are found,
-            it may slows down the saving (3 or 4 folds) but saves space
+            every array has to be hashed so it slows down the saving
+            (roughly the time needed to read the array once) but saves space
             when saving different dataset together (since it does not duplicate
             arrays)
+            list_encoding: only works in hdf5 format, "group" (default)
+            saves one dataset per element, "compact" saves lists of arrays
+            as single dataset and lists of records (dicts with the same
+            keys) as one dataset per key (faster, not readable by
+            datastorage <= 0.7)
+            scalar_encoding: only works in hdf5 format, "dataset" (default)
+            or "packed" (scalars, short strings and None of a group saved
+            together as one dataset, not readable by datastorage <= 0.7)
+            storage_policy: only works in hdf5 format, compression and
+            chunking of the arrays (see StoragePolicy)
+            incremental: only works in hdf5 format, if the object was read
+            from (or last saved to) fname, only the keys modified since then
+            (see dirty_keys) are rewritten, the rest of the file is untouched
+            npz_layout: only works in npz format, "nested" (default) or
+            "flat" (one member per array, no pickle, lazy reading; not
+            readable by datastorage <= 0.7)
+            locking: only works in hdf5 format, file locking (True, False,
+            "best-effort" or None for the HDF5 default)
+            index_stats: store the min/max/mean of the numeric arrays in the
+            summary index (see datastorage.inspect)
+            the other keywords are the ones of datastorage.save
+        """
+        if fname is None:
+            fname = self.filename
+        assert fname is not None
+        save(fname, self, link_copy=link_copy, raiseError=raiseError, **options)
+
+    def save_async(self, fname=None, snapshot="copy", writer=None, **kwargs):
+        """ save in a background thread and return a concurrent.futures.Future
+            snapshot: "copy" (arrays are copied) or "freeze" (arrays are
+            read-only until written)
+            see datastorage.background.save_async and save for the other
+            parameters
         """
+        from .background import save_async
+
         if fname is None:
             fname = self.filename
         assert fname is not None
-        save(fname, self, link_copy=link_copy, raiseError=raiseError)
+        return save_async(fname, self, snapshot=snapshot, writer=writer, **kwargs)
+
 
+# target size of the chunks of records converted at once by unwrap (bytes)
+UNWRAP_CHUNK_BYTES = 16 * 1024 ** 2
 
-def unwrap(list_of_datastorages):
+
+class _UnwrapLeaf(object):
+    """ values of one key of the records passed to unwrap
+
+        the values of a chunk of records are converted at once (one
+        np.asarray) and copied in the preallocated array; values that do not
+        fit (other shape, object dtype) turn the leaf in a plain list
+    """
+
+    __slots__ = ("path", "out", "n", "values")
+
+    def __init__(self, path):
+        self.path = path
+        self.out = None
+        self.n = 0
+        # list of all values if the leaf can not be a preallocated array
+        self.values = None
+
+    def add(self, records, capacity):
+        key = self.path[-1]
+        buffer = [r[key] for r in records]
+        if self.values is not None:
+            self.values.extend(buffer)
+            return
+        try:
+            chunk = np.asarray(buffer)
+        except ValueError:
+            # ragged values
+            chunk = None
+        out = self.out
+        if chunk is None or chunk.dtype.kind == "O":
+            self._to_list(buffer)
+            return
+        if out is None:
+            out = np.empty((capacity,) + chunk.shape[1:], dtype=chunk.dtype)
+        elif chunk.shape[1:] != out.shape[1:]:
+            self._to_list(buffer)
+            return
+        elif chunk.dtype != out.dtype:
+            try:
+                dtype = np.promote_types(out.dtype, chunk.dtype)
+            except TypeError:
+                # like strings and numbers
+                self._to_list(buffer)
+                return
+            if dtype != out.dtype:
+                out = out.astype(dtype)
+        n = self.n + len(chunk)
+        if n > out.shape[0]:
+            # length not known in advance, grow geometrically
+            out.resize((max(n, 2 * out.shape[0]),) + out.shape[1:], refcheck=False)
+        out[self.n : n] = chunk
+        self.out = out
+        self.n = n
+
+    def _to_list(self, buffer):
+        values = [] if self.out is None else list(self.out[: self.n])
+        values.extend(buffer)
+        self.values = values
+        self.out = None
+
+    def result(self, ragged):
+        if self.values is None:
+            out = self.out
+            if out.shape[0] != self.n:
+                out.resize((self.n,) + out.shape[1:], refcheck=False)
+            return out
+        values = self.values
+        if len(set(np.shape(v) for v in values)) <= 1:
+            return np.asarray(values)
+        if ragged == "list":
+            return values
+        if ragged == "raise":
+            raise ValueError(
+                "Can not unwrap %s, values have different shapes"
+                % "/".join(self.path)
+            )
+        ret = np.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            ret[i] = v
+        return ret
+
+
+def _unwrap_paths(record, path=()):
+    """ paths of the nested dicts and of the leaves of record """
+    groups = []
+    leaves = []
+    for key, value in record.items():
+        if isinstance(value, dict):
+            groups.append(path + (key,))
+            sub_groups, sub_leaves = _unwrap_paths(value, path + (key,))
+            groups.extend(sub_groups)
+            leaves.extend(sub_leaves)
+        else:
+            leaves.append(path + (key,))
+    return groups, leaves
+
+
+def _record_nbytes(record):
+    nbytes = 0
+    for value in record.values():
+        if isinstance(value, dict):
+            nbytes += _record_nbytes(value)
+        else:
+            nbytes += getattr(value, "nbytes", 8)
+    return nbytes
+
+
+def unwrap(list_of_datastorages, ragged="object"):
     """ 
     convert list of data storages in one datastorage with array elements
     useful in conjuction with list comprehension
@@ -636,9 +2563,41 @@ def unwrap(list_of_datastorages):
 
     res = [f(i) for i in range(10)]
     res = unwrap(res)
+
+    list_of_datastorages can be any iterable (generator) of DataStorage or
+    dict, the keys are the ones of the first record; nested DataStorage are
+    unwrapped recursively (res.fit.center instead of an object array).
+    ragged: what to do with keys whose values have different shapes,
+            "object" (1d object array), "list" or "raise" (ValueError)
     """
-    retout = DataStorage()
-    for key in list_of_datastorages[0].keys():
-        retout[key] = np.asarray([r[key] for r in list_of_datastorages])
-    return retout
-    useful
+    if ragged not in ("object", "list", "raise"):
+        raise ValueError("ragged must be 'object', 'list' or 'raise'")
+    records = iter(list_of_datastorages)
+    try:
+        first = next(records)
+    except StopIteration:
+        return DataStorage()
+    capacity = max(1, operator.length_hint(list_of_datastorages, 0))
+    chunk = max(1, min(4096, UNWRAP_CHUNK_BYTES // max(1, _record_nbytes(first))))
+    groups, paths = _unwrap_paths(first)
+    leaves = [_UnwrapLeaf(path) for path in paths]
+    records = itertools.chain([first], records)
+    while True:
+        # only a chunk of records is referenced at any time
+        batch = list(itertools.islice(records, chunk))
+        if not batch:
+            break
+        # nested records of the batch (parents come before their children)
+        nested = {(): batch}
+        for path in groups:
+            key = path[-1]
+            nested[path] = [r[key] for r in nested[path[:-1]]]
+        for leaf in leaves:
+            leaf.add(nested[leaf.path[:-1]], capacity)
+    retout = dict()
+    for leaf in leaves:
+        d = retout
+        for key in leaf.path[:-1]:
+            d = d.setdefault(key, dict())
+        d[leaf.path[-1]] = leaf.result(ragged)
+    return DataStorage(retout)
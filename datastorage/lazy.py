@@ -0,0 +1,440 @@
+""" lazy reading of hdf5 and (flat layout) npz files
+
+    the file is walked once to build the tree of keys; the datasets are
+    read only when accessed (and for hdf5 only the requested hyperslab when
+    sliced, npz members are decompressed on first access).
+    Full reads are kept in a LRU cache with a memory budget
+
+    with datastorage.read("run.h5", lazy=True) as data:
+        roi = data.images[10:20]  # reads only 10 images
+        i0 = data.diagnostics.i0[:]  # full read (cached)
+"""
+import collections
+import logging
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+from .datastorage import (
+    DataStorage,
+    DEFAULT_LAZY_CACHE_BYTES,
+    H5_PACKED_SCALARS,
+    h5py,
+    openH5,
+    _decode_h5_value,
+    _read_h5_packed,
+    _read_h5_ragged_list,
+    _select_h5,
+    _select_manifest,
+    _as_key_patterns,
+    _from_manifest,
+    _npz_manifest,
+)
+
+log = logging.getLogger(__name__)
+
+
+class ByteLRUCache(object):
+    """ least recently used cache with a memory (rather than items) budget
+
+        max_bytes: maximum total size of the cached values; values bigger
+                   than the budget are not cached
+    """
+
+    def __init__(self, max_bytes=DEFAULT_LAZY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key][0]
+
+    def put(self, key, value, nbytes):
+        self.pop(key)
+        if nbytes > self.max_bytes:
+            return
+        while self._data and self.nbytes + nbytes > self.max_bytes:
+            _, (_, old_nbytes) = self._data.popitem(last=False)
+            self.nbytes -= old_nbytes
+        self._data[key] = (value, nbytes)
+        self.nbytes += nbytes
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value, nbytes = self._data.pop(key)
+        self.nbytes -= nbytes
+        return value
+
+    def resize(self, max_bytes):
+        """ change the budget (evicting the least recently used values) """
+        self.max_bytes = max_bytes
+        while self._data and self.nbytes > self.max_bytes:
+            _, (_, old_nbytes) = self._data.popitem(last=False)
+            self.nbytes -= old_nbytes
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+
+class _LazyH5File(object):
+    """ owns the h5py file handle and the cache shared by the proxies """
+
+    def __init__(
+        self, fname, cache_bytes=DEFAULT_LAZY_CACHE_BYTES, locking=False, swmr=False
+    ):
+        self.filename = str(fname)
+        self.file = openH5(fname, "r", locking=locking, swmr=swmr)
+        self.cache = ByteLRUCache(cache_bytes)
+
+    @property
+    def closed(self):
+        return self.file is None
+
+    def dataset(self, name):
+        if self.file is None:
+            raise ValueError("File %s has been closed" % self.filename)
+        return self.file[name]
+
+    def read(self, name):
+        return _decode_h5_value(self.dataset(name)[()])
+
+    def read_selection(self, name, selection):
+        """ read only selection (None if h5py can not do it) """
+        try:
+            data = self.dataset(name)[selection]
+        except (TypeError, ValueError):
+            # selections h5py can not do (like unsorted fancy indexing)
+            return None
+        return _decode_h5_value(data)
+
+    def chunks(self, name):
+        return self.dataset(name).chunks
+
+    def refresh(self, name):
+        """ update (swmr files) the dataset to the last flushed data, return
+            its shape """
+        dataset = self.dataset(name)
+        dataset.refresh()
+        self.cache.pop(name)
+        return dataset.shape
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.cache.clear()
+
+
+class _LazyNpzFile(object):
+    """ owns the npz file and the cache shared by the proxies """
+
+    def __init__(self, fname, cache_bytes=DEFAULT_LAZY_CACHE_BYTES):
+        self.filename = str(fname)
+        self.file = np.load(fname, allow_pickle=False)
+        self.cache = ByteLRUCache(cache_bytes)
+
+    @property
+    def closed(self):
+        return self.file is None
+
+    def header(self, name):
+        """ shape and dtype of a member (reading only the npy header) """
+        with self.file.zip.open(name + ".npy") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        return shape, dtype
+
+    def read(self, name):
+        if self.file is None:
+            raise ValueError("File %s has been closed" % self.filename)
+        return self.file[name]
+
+    def read_selection(self, name, selection):
+        # npy members can not be partially decompressed
+        return None
+
+    def chunks(self, name):
+        # npy members are not chunked
+        return None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.cache.clear()
+
+
+# ndarray attributes LazyDataset forwards to the full array
+_NDARRAY_ATTRIBUTES = frozenset(
+    """T all any argmax argmin argsort astype clip conj copy cumprod cumsum
+    diagonal dot flatten imag item max mean min nonzero prod ravel real repeat
+    reshape round squeeze std sum swapaxes take tobytes tolist trace transpose
+    var""".split()
+)
+
+
+class LazyDataset(NDArrayOperatorsMixin):
+    """ proxy of a hdf5 dataset (or npz member), the data are read on first
+        access
+
+        proxy[...] reads only the requested selection (unless the full
+        dataset is already cached or the file is a npz file), proxy.read()
+        (or np.asarray(proxy))
+        reads the whole dataset and caches it. Cached arrays are read-only,
+        copy them if they have to be modified.
+        Arithmetic, numpy functions and the common ndarray methods (mean,
+        sum, T, astype, ...) work on the full array
+    """
+
+    def __init__(self, handle, name, shape, dtype):
+        self._handle = handle
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def chunks(self):
+        """ chunk shape of the hdf5 dataset (None if not chunked) """
+        return self._handle.chunks(self.name)
+
+    @property
+    def is_cached(self):
+        return self.name in self._handle.cache
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self):
+        """ read the full dataset (or return the cached copy) """
+        data = self._handle.cache.get(self.name)
+        if data is None:
+            data = self._handle.read(self.name)
+            if isinstance(data, np.ndarray):
+                data.flags.writeable = False
+            self._handle.cache.put(self.name, data, self.nbytes)
+        return data
+
+    def __getitem__(self, selection):
+        data = self._handle.cache.get(self.name)
+        if data is not None:
+            return data[selection]
+        data = self._handle.read_selection(self.name, selection)
+        if data is None:
+            return self.read()[selection]
+        return data
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.read()
+        if dtype is not None:
+            data = data.astype(dtype)
+        elif copy:
+            data = data.copy()
+        return data
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [i.read() if isinstance(i, LazyDataset) else i for i in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # delegate the common ndarray methods (mean, sum, T, ...) to the full
+        # array; other names do not read the dataset (hasattr(proxy, "items"))
+        if name not in _NDARRAY_ATTRIBUTES:
+            raise AttributeError(
+                "'%s' object has no attribute '%s'" % (type(self).__name__, name)
+            )
+        return getattr(self.read(), name)
+
+    def _refresh(self):
+        self.shape = self._handle.refresh(self.name)
+
+    def __repr__(self):
+        return "lazy dataset %s, size %s, type %s" % (
+            self.name,
+            "x".join(map(str, self.shape)),
+            self.dtype,
+        )
+
+
+def _lazy_node(node, handle, add_attrs=False):
+    """ return value (for scalars) or proxy (for arrays) of a hdf5 node """
+    if isinstance(node, h5py.Dataset):
+        # scalars are cheap and needed to interpret strings/None
+        if node.shape == () or node.shape is None:
+            return _decode_h5_value(node[()])
+        # lists saved stacked are returned as proxy of the stacked array
+        return LazyDataset(handle, node.name, node.shape, node.dtype)
+    if "IS_RAGGED_LIST" in node.attrs:
+        return _read_h5_ragged_list(node)
+    if ("IS_LIST" in node.attrs) or ("IS_LIST_OF_ARRAYS" in node.attrs):
+        items = list(node.keys())
+        items.sort()
+        return [_lazy_node(node[item], handle, add_attrs) for item in items]
+    # groups and lists of records (as proxies of their columns)
+    d = dict()
+    for key, child in node.items():
+        if key == H5_PACKED_SCALARS:
+            d.update(_read_h5_packed(child.id))
+            continue
+        d[key] = _lazy_node(child, handle, add_attrs)
+        if add_attrs and len(child.attrs) != 0:
+            d[key + "_attrs"] = dict(child.attrs)
+    return d
+
+
+class LazyDataStorage(DataStorage):
+    """ DataStorage whose arrays are LazyDataset proxies of an open file
+
+        use as context manager (or call close) to release the file;
+        as for any DataStorage, a key named like a method (close, load,
+        cache_info) hides it when accessed as attribute
+    """
+
+    def close(self):
+        handle = self.__dict__.get("_lazy_handle")
+        if handle is not None:
+            handle.close()
+
+    def load(self):
+        """ read all datasets in memory (the proxies are replaced by arrays)
+            and close the file """
+        _load_proxies(self)
+        self.close()
+    def refresh(self):
+        """ files read with swmr=True: update the shapes of the datasets to
+            the data flushed by the writer (values read eagerly, like
+            scalars, are not updated) """
+        handle = self.__dict__.get("_lazy_handle")
+        if not isinstance(handle, _LazyH5File):
+            raise ValueError("refresh is only possible for hdf5 files")
+
+        def refresh(value):
+            if isinstance(value, LazyDataset):
+                value._refresh()
+            elif isinstance(value, dict):
+                for v in value.values():
+                    refresh(v)
+            elif isinstance(value, list):
+                for v in value:
+                    refresh(v)
+
+        refresh(self)
+
+    def cache_info(self):
+        """ return number of items and bytes in the cache (and its budget) """
+        cache = self._lazy_handle.cache
+        return dict(items=len(cache), nbytes=cache.nbytes, max_bytes=cache.max_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _load_proxies(d):
+    """ replace (recursively) the LazyDataset proxies of d by arrays """
+    for key, value in d.items():
+        if isinstance(value, DataStorage):
+            _load_proxies(value)
+        elif isinstance(value, (LazyDataset, list)):
+            d[key] = _loaded(value)
+
+
+def _loaded(value):
+    if isinstance(value, LazyDataset):
+        # copy, the arrays of the cache are read-only
+        return np.array(value)
+    if isinstance(value, list):
+        return [_loaded(v) for v in value]
+    if isinstance(value, dict):
+        return dict((key, _loaded(v)) for key, v in value.items())
+    return value
+
+
+def h5ToLazy(
+    h5,
+    cache_bytes=DEFAULT_LAZY_CACHE_BYTES,
+    add_attrs=False,
+    keys=None,
+    locking=False,
+    swmr=False,
+):
+    """ Open a hdf5 file as LazyDataStorage (datasets are read on access)
+        keys: include only these keys (see datastorage.read)
+        locking, swmr: see datastorage.openH5 """
+    handle = _LazyH5File(h5, cache_bytes=cache_bytes, locking=locking, swmr=swmr)
+    try:
+        if keys is None:
+            d = _lazy_node(handle.file["/"], handle, add_attrs=add_attrs)
+        else:
+
+            def node_value(node):
+                return _lazy_node(node, handle, add_attrs)
+
+            d = _select_h5(
+                handle.file["/"],
+                _as_key_patterns(keys),
+                node_value,
+                add_attrs=add_attrs,
+            )
+    except Exception:
+        handle.close()
+        raise
+    ret = LazyDataStorage(d)
+    ret._lazy_handle = handle
+    return ret
+
+
+def npzToLazy(npzFile, cache_bytes=DEFAULT_LAZY_CACHE_BYTES, keys=None):
+    """ Open a npz file (flat layout) as LazyDataStorage, the members are
+        decompressed on access
+        keys: include only these keys (see datastorage.read) """
+    handle = _LazyNpzFile(npzFile, cache_bytes=cache_bytes)
+    try:
+        manifest = _npz_manifest(handle.file)
+        if manifest is None:
+            raise ValueError(
+                "lazy reading of %s needs the flat npz layout" % npzFile
+            )
+        if manifest["allow_pickle"]:
+            handle.file.allow_pickle = True
+        entry = manifest["data"]
+        if keys is not None:
+            entry = _select_manifest(entry, _as_key_patterns(keys))
+
+        def load(entry):
+            shape, dtype = handle.header(entry["file"])
+            return LazyDataset(handle, entry["file"], shape, dtype)
+
+        d = _from_manifest(entry, load)
+    except Exception:
+        handle.close()
+        raise
+    ret = LazyDataStorage(d)
+    ret._lazy_handle = handle
+    return ret
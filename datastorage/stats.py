@@ -0,0 +1,159 @@
+""" per-key instrumentation of save and read
+
+    with datastorage.collect_stats() as stats:
+        datastorage.save("run.h5", data)
+        datastorage.read("run.h5")
+    print(stats.report(10))  # 10 slowest keys
+
+    (or pass a callback: collect_stats(callback=print))
+
+    hdf5 files are instrumented per key (time, bytes, dtype, shape, encoding
+    and the exceptions that made the saving fall back to a conversion);
+    for the other formats only the whole save/read is recorded.
+    The collector is stored in a context variable: it sees the saves and
+    reads of the current thread (and of save_async calls made from it)
+"""
+import contextlib
+import contextvars
+import threading
+import numpy as np
+
+_current_stats = contextvars.ContextVar("datastorage_stats", default=None)
+
+# encodings of groups, lists and whole files (their time includes their
+# content)
+CONTAINER_ENCODINGS = (
+    "file",
+    "cache",
+    "lazy",
+    "group",
+    "IS_LIST",
+    "record_list",
+)
+
+
+def current_stats():
+    """ IOStats collecting the current saves/reads (None if not collecting) """
+    return _current_stats.get()
+
+
+def _describe(value):
+    """ nbytes, dtype and shape of value (None if not known) """
+    if isinstance(value, np.ndarray):
+        return value.nbytes, str(value.dtype), value.shape
+    if isinstance(value, (str, bytes)):
+        return len(value), type(value).__name__, None
+    if isinstance(value, (list, tuple)) and all(
+        isinstance(v, np.ndarray) for v in value
+    ):
+        return sum(v.nbytes for v in value), None, (len(value),)
+    if isinstance(value, (int, float, complex, np.generic)):
+        return np.asarray(value).nbytes, type(value).__name__, ()
+    return None, type(value).__name__, None
+
+
+class IOStats(object):
+    """ collector of per-key save/read records
+
+        every record is a dict with op ("save" or "read"), path, seconds,
+        nbytes, dtype, shape, encoding ("native", "link", "stacked_list",
+        "ragged_list", "record_list", "unicode", "vlen_unicode", "IS_LIST",
+        "None", "packed" (the scalars of a group saved with
+        scalar_encoding="packed"), "group" and for whole files "file",
+        "cache" or "lazy")
+        and fallback (the error that made h5py refuse the value, if any)
+
+        callback: function called with each record (as soon as recorded)
+    """
+
+    def __init__(self, callback=None):
+        self.records = []
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def record(self, op, path, seconds, value=None, encoding=None, fallback=None):
+        nbytes, dtype, shape = _describe(value)
+        if encoding == "link":
+            # linked arrays are not written again
+            nbytes = 0
+        rec = dict(
+            op=op,
+            path=path,
+            seconds=seconds,
+            nbytes=nbytes,
+            dtype=dtype,
+            shape=shape,
+            encoding=encoding,
+            fallback=fallback,
+        )
+        with self._lock:
+            self.records.append(rec)
+        if self.callback is not None:
+            self.callback(rec)
+
+    def top(self, n=10, op=None, containers=False):
+        """ the n slowest records (of op, "save" or "read", if given);
+            groups, lists and files are included only if containers """
+        records = [
+            r
+            for r in self.records
+            if (op is None or r["op"] == op)
+            and (containers or r["encoding"] not in CONTAINER_ENCODINGS)
+        ]
+        records.sort(key=lambda r: r["seconds"], reverse=True)
+        return records[:n]
+
+    def summary(self):
+        """ total time, bytes and number of keys per (op, encoding) """
+        summary = dict()
+        for r in self.records:
+            s = summary.setdefault(
+                (r["op"], r["encoding"]), dict(count=0, seconds=0.0, nbytes=0)
+            )
+            s["count"] += 1
+            s["seconds"] += r["seconds"]
+            s["nbytes"] += r["nbytes"] or 0
+        return summary
+
+    def report(self, n=10, op=None):
+        """ text report with the totals per encoding and the n slowest keys """
+        lines = [
+            "%-6s %-14s %8s %10s %12s" % ("op", "encoding", "count", "time (s)", "MB")
+        ]
+        for (rop, encoding), s in sorted(self.summary().items(), key=str):
+            lines.append(
+                "%-6s %-14s %8d %10.4f %12.3f"
+                % (rop, encoding, s["count"], s["seconds"], s["nbytes"] / 1e6)
+            )
+        lines.append("")
+        lines.append("%d slowest keys" % n)
+        for r in self.top(n, op=op):
+            line = "%-6s %-40s %9.4f s %-12s %-10s %s" % (
+                r["op"],
+                r["path"],
+                r["seconds"],
+                r["encoding"],
+                r["dtype"],
+                r["shape"],
+            )
+            if r["fallback"] is not None:
+                line += " (fallback: %s)" % r["fallback"]
+            lines.append(line)
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+
+@contextlib.contextmanager
+def collect_stats(stats=None, callback=None):
+    """ collect the stats of the saves/reads done in the with block
+        (stats: IOStats to add the records to, default: new one) """
+    if stats is None:
+        stats = IOStats(callback=callback)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
@@ -0,0 +1,315 @@
+""" summary index of stored files: keys, shapes, dtypes and sizes
+
+    save writes a compact index of the saved keys (in the hdf5 root
+    attributes, in the manifest of dsdir folders and flat npz files) so
+    that the content of a file can be listed without reading any dataset:
+
+    info = datastorage.inspect("run.h5")
+    info["images"]  # {"type": "array", "shape": [100, 512, 512], ...}
+    print(datastorage.summary.format_index(info))
+
+    or from the command line: python -m datastorage info run.h5
+
+    save(..., index_stats=True) also stores min/max/mean of numeric arrays.
+    Files saved without index (older versions) are described from the hdf5
+    metadata (or, for the other formats, by reading them lazily).
+"""
+import json
+import logging
+import pathlib
+import zlib
+import numpy as np
+
+from .datastorage import (
+    DSDIR_MANIFEST,
+    H5_PACKED_SCALARS_BYTES,
+    get_backend,
+    h5py,
+    openH5,
+    read,
+    _H5Loader,
+    _as_key_patterns,
+    _match_key_patterns,
+    _npz_manifest,
+    _read_h5_packed,
+)
+
+log = logging.getLogger(__name__)
+
+INDEX_FORMAT = "datastorage-index"
+# hdf5 root attributes holding the (compressed json) index, the index is
+# split in several attributes if needed (attributes are limited to 64 kB)
+H5_INDEX_ATTR = "DATASTORAGE_INDEX"
+H5_INDEX_ATTR_BYTES = 60000
+# strings shorter than this are stored in the index
+MAX_VALUE_LENGTH = 80
+
+
+def _array_info(value, stats=False):
+    info = dict(
+        type="array",
+        shape=list(value.shape),
+        dtype=str(value.dtype),
+        nbytes=int(np.prod(value.shape, dtype=np.int64)) * value.dtype.itemsize,
+    )
+    if (
+        stats
+        and isinstance(value, np.ndarray)
+        and value.size > 0
+        and value.dtype.kind in "biuf"
+    ):
+        info["min"] = float(np.nanmin(value))
+        info["max"] = float(np.nanmax(value))
+        info["mean"] = float(np.nanmean(value))
+    return info
+
+
+def _value_info(value, stats=False):
+    """ summary of a (non dict) value """
+    if isinstance(value, (str, bytes)):
+        info = dict(type="str", length=len(value))
+        if len(value) <= MAX_VALUE_LENGTH:
+            if isinstance(value, bytes):
+                value = value.decode("utf8", "replace")
+            info["value"] = value
+        return info
+    if value is None:
+        return dict(type="None")
+    if isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating)):
+        dtype = type(value).__name__
+        if isinstance(value, np.generic):
+            value = value.item()
+        return dict(type="scalar", dtype=dtype, value=value)
+    if isinstance(value, (complex, np.complexfloating)):
+        # complex numbers are not json values
+        return dict(type="scalar", dtype=type(value).__name__, value=str(value))
+    if hasattr(value, "shape") and hasattr(value, "dtype"):
+        # numpy arrays, memmaps, lazy proxies, h5py datasets
+        return _array_info(value, stats=stats)
+    if isinstance(value, (list, tuple)):
+        info = dict(type="list", length=len(value))
+        if len(value) > 0 and all(isinstance(v, np.ndarray) for v in value):
+            info["nbytes"] = sum(v.nbytes for v in value)
+        return info
+    return dict(type=type(value).__name__)
+
+
+def _add_entries(entries, d, stats, path=""):
+    for key, value in d.items():
+        key_path = "%s/%s" % (path, key) if path else str(key)
+        if isinstance(value, dict):
+            entries[key_path] = dict(type="group", nkeys=len(value.keys()))
+            _add_entries(entries, value, stats, key_path)
+        else:
+            entries[key_path] = _value_info(value, stats)
+
+
+def summary_index(d, stats=False):
+    """ index of (nested) dict d: {"keys": {path: info}} where info has the
+        type ("group", "array", "list", "str", "scalar", "None") and, for
+        arrays, shape, dtype, nbytes (and min/max/mean if stats) """
+    entries = dict()
+    _add_entries(entries, d, stats)
+    return dict(format=INDEX_FORMAT, version=1, keys=entries)
+
+
+def write_h5_index(h5, index):
+    """ store index in the root attributes of the open hdf5 file h5 """
+    attrs = h5["/"].attrs
+    for name in [n for n in attrs if n.startswith(H5_INDEX_ATTR)]:
+        del attrs[name]
+    data = zlib.compress(json.dumps(index).encode("utf8"))
+    parts = range(0, len(data), H5_INDEX_ATTR_BYTES)
+    for i, start in enumerate(parts):
+        chunk = data[start : start + H5_INDEX_ATTR_BYTES]
+        attrs["%s_%d" % (H5_INDEX_ATTR, i)] = np.void(chunk)
+
+
+def _read_h5_index(h5):
+    attrs = h5["/"].attrs
+    parts = []
+    while "%s_%d" % (H5_INDEX_ATTR, len(parts)) in attrs:
+        parts.append(attrs["%s_%d" % (H5_INDEX_ATTR, len(parts))].tobytes())
+    if not parts:
+        return None
+    return json.loads(zlib.decompress(b"".join(parts)).decode("utf8"))
+
+
+def _h5_node_info(oid):
+    """ summary of a hdf5 node (low level id) from its metadata only """
+    kind = _H5Loader._kind(oid)
+    if kind == "dataset" or kind == "IS_STACKED_LIST":
+        shape = oid.shape
+        dtype = oid.dtype
+        if kind == "IS_STACKED_LIST":
+            return dict(type="list", length=shape[0], nbytes=_nbytes(shape, dtype))
+        if h5py.check_string_dtype(dtype) is not None:
+            if shape == ():
+                return dict(type="str")
+            return dict(type="array", shape=list(shape), dtype="str")
+        if shape == () or shape is None:
+            return dict(type="scalar", dtype=str(dtype))
+        return dict(
+            type="array",
+            shape=list(shape),
+            dtype=str(dtype),
+            nbytes=_nbytes(shape, dtype),
+        )
+    if kind == "IS_RAGGED_LIST":
+        return dict(type="list", length=h5py.h5o.open(oid, b"offsets").shape[0] - 1)
+    if kind == "IS_RECORD_LIST":
+        first = _first_dataset(oid)
+        return dict(type="list", length=0 if first is None else first.shape[0])
+    if kind in ("IS_LIST", "IS_LIST_OF_ARRAYS"):
+        return dict(type="list", length=len(oid))
+    return dict(type="group", nkeys=len(oid))
+
+
+def _nbytes(shape, dtype):
+    return int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+
+
+def _first_dataset(gid):
+    for name in gid:
+        oid = h5py.h5o.open(gid, name)
+        if isinstance(oid, h5py.h5d.DatasetID):
+            return oid
+        first = _first_dataset(oid)
+        if first is not None:
+            return first
+    return None
+
+
+def _h5_metadata_index(h5):
+    """ index of a hdf5 file saved without index, from the shapes and dtypes
+        of its datasets (nothing is read) """
+    entries = dict()
+
+    def add(gid, path):
+        """ add the entries of group gid, return its number of keys """
+        nkeys = 0
+        for name in gid:
+            oid = h5py.h5o.open(gid, name)
+            if name == H5_PACKED_SCALARS_BYTES:
+                # small json record, the only dataset read
+                items = _read_h5_packed(oid).items()
+            else:
+                items = [(name.decode("utf8"), oid)]
+            for key, node in items:
+                if not path and key == "filename":
+                    continue
+                key_path = "%s/%s" % (path, key) if path else key
+                if node is oid:
+                    info = _h5_node_info(oid)
+                else:
+                    info = _value_info(node)
+                entries[key_path] = info
+                nkeys += 1
+                if info["type"] == "group":
+                    info["nkeys"] = add(oid, key_path)
+        return nkeys
+
+    add(h5["/"].id, "")
+    return dict(format=INDEX_FORMAT, version=1, keys=entries)
+
+
+def inspect_h5(fname):
+    """ index of a hdf5 file (stored one or from the metadata) """
+    h5 = openH5(fname, "r", locking=False)
+    try:
+        index = _read_h5_index(h5)
+        if index is None:
+            index = _h5_metadata_index(h5)
+        return index
+    finally:
+        h5.close()
+
+
+def inspect_npz(fname):
+    """ stored index of a npz file (None if there is none) """
+    with np.load(str(fname)) as npz:
+        manifest = _npz_manifest(npz)
+    return None if manifest is None else manifest.get("index")
+
+
+def inspect_dsdir(fname):
+    """ stored index of a dsdir folder (None if there is none) """
+    with open(str(pathlib.Path(fname) / DSDIR_MANIFEST), "r") as f:
+        return json.load(f).get("index")
+
+
+def _read_index(fname):
+    """ index of a file without one, by reading it (lazily when possible) """
+    log.info("%s has no summary index, reading it" % fname)
+    try:
+        with read(fname, lazy=True, raiseError=True) as data:
+            return summary_index(data)
+    except ValueError:
+        # format (or layout) that can not be read lazily
+        return summary_index(read(fname, raiseError=True))
+
+
+def inspect(fname, keys=None):
+    """ summary of the keys of a stored file, from its summary index (or
+        metadata); datasets are not read
+
+        keys: only these keys (and their content), see datastorage.read
+        return a dict {path: info}, info has the type ("group", "array",
+        "list", "str", "scalar", "None"), and for arrays shape, dtype,
+        nbytes (and min, max, mean if saved with index_stats=True)
+    """
+    backend = get_backend(fname)
+    if backend is None or not backend.exists(fname):
+        raise ValueError("File %s does not exist" % fname)
+    index = None
+    if backend.inspect is not None:
+        index = backend.inspect(fname)
+    if index is None:
+        index = _read_index(fname)
+    entries = index["keys"]
+    if keys is not None:
+        patterns = _as_key_patterns(keys)
+        entries = dict(
+            (path, info)
+            for path, info in entries.items()
+            if _match_key_patterns(tuple(path.split("/")), patterns) == 2
+        )
+    return entries
+
+
+def _format_size(nbytes):
+    for unit in ("B", "kB", "MB", "GB"):
+        if nbytes < 1000:
+            return "%.1f %s" % (nbytes, unit) if unit != "B" else "%d B" % nbytes
+        nbytes /= 1000
+    return "%.1f TB" % nbytes
+
+
+def format_index(entries):
+    """ text table of the entries returned by inspect """
+    lines = []
+    total = 0
+    for path, info in entries.items():
+        kind = info["type"]
+        if kind == "group":
+            desc = "%d keys" % info["nkeys"]
+        elif kind == "array":
+            desc = "%-18s %-10s" % (tuple(info["shape"]), info["dtype"])
+            if "nbytes" in info:
+                desc += " %10s" % _format_size(info["nbytes"])
+            if "min" in info:
+                desc += "  min %.4g max %.4g mean %.4g" % (
+                    info["min"],
+                    info["max"],
+                    info["mean"],
+                )
+        elif kind == "list":
+            desc = "%d items" % info["length"]
+        elif "value" in info:
+            desc = repr(info["value"])
+        else:
+            desc = info.get("dtype", "")
+        total += info.get("nbytes", 0) if kind != "group" else 0
+        lines.append("%-40s %-7s %s" % (path, kind, desc))
+    lines.append("%d keys, %s of arrays" % (len(entries), _format_size(total)))
+    return "\n".join(lines)
@@ -1,11 +1,21 @@
+""" quick save/read round trip of a few dicts in all formats
+
+    for reproducible timings (sweeps, json results, comparison of two runs)
+    use benchmarks/suite.py
+"""
 from __future__ import print_function
+import copy
+import os
+import pickle
+import shutil
+import tempfile
 import numpy as np
 from collections import OrderedDict
 import datastorage
 import time
 import sys
 
-def saveAndRead(obj,fname="/tmp/test.h5",link_copy=False):
+def saveAndRead(obj,fname,link_copy=False):
   obj = datastorage.DataStorage(obj)
   t0 = time.time()
   obj.save(fname,link_copy=link_copy,raiseError=True)
@@ -16,103 +26,1043 @@ def saveAndRead(obj,fname="/tmp/test.h5",link_copy=False):
   t2 = time.time()
   return t2-t1,t1-t0
 
-data = OrderedDict()
-
-data[1] = dict(
-  key1 = "this is a string",
-  key2 = dict( key2_1 = "test", key2_2 = np.arange(1000) ),
-  info = "saving dict ..."
-)
-
-# list 
-data[2] = dict(
-  key1 = "this is a string",
-  key2 = [1,2,3],
-  info = "saving list ..."
-) 
-
-# list 
-data[3] = dict(
-  info = "saving list of arrays (same shape)",
-  key1 = "this is a string",
-  key2 = [np.arange(10),np.arange(10)*2,np.arange(10)*3]
-) 
-
-# list 
-data[4] = dict(
-  info = "saving list of arrays (different shape)",
-  key1 = "this is a string",
-  key2 = [np.arange(10),np.arange(20)*2,np.arange(30)*3]
-) 
-
-data[5] = dict(
-  info = "saving list of stuff",
-  key1 = "this is a string",
-  key2 = [np.arange(10),dict(key2_1=3,key2_2=np.arange(20)*2)]
-) 
-
-data[6] = dict(
-  a= np.arange(100000),
-  info = "this should take very little time ...(saving long array)"
-)
-
-data[7] = dict(
-  a = [u'ciao',u'ciao1'],
-  info = "list of unicode"
-)
-
-data[8] = dict(
-  a = np.asarray([u'ciao',u'ciao1']),
-  info = "array of unicode"
-)
-
-data[9] = dict(
-  a = list(range(10000)),
-  info = "long list 100000 elements"
-)
-
-data[10] = dict(
-  a = list(range(10000)),
-  b = None,
-  info = "saving python None object"
-)
-
-  #d1 = dict( d2 = 3, d4=np.arange(10), d6=[1,2,3], d8 = [1,2,np.arange(10)] ),
-data[11] = dict(
-  d1 = dict( v1 = 3, v2=dict(vv1=np.arange(10)) ),
-  info = 'nested dict'
-)
-
-
-data[12] = dict(
-  d1 = dict( a = [1,2,3,np.arange(10)] ),
-  info = 'complex list'
-)
-
-def _doTest(ext="h5"):
+def _makeData():
+  data = OrderedDict()
+
+  data[1] = dict(
+    key1 = "this is a string",
+    key2 = dict( key2_1 = "test", key2_2 = np.arange(1000) ),
+    info = "saving dict ..."
+  )
+
+  # list 
+  data[2] = dict(
+    key1 = "this is a string",
+    key2 = [1,2,3],
+    info = "saving list ..."
+  ) 
+
+  # list 
+  data[3] = dict(
+    info = "saving list of arrays (same shape)",
+    key1 = "this is a string",
+    key2 = [np.arange(10),np.arange(10)*2,np.arange(10)*3]
+  ) 
+
+  # list 
+  data[4] = dict(
+    info = "saving list of arrays (different shape)",
+    key1 = "this is a string",
+    key2 = [np.arange(10),np.arange(20)*2,np.arange(30)*3]
+  ) 
+
+  data[5] = dict(
+    info = "saving list of stuff",
+    key1 = "this is a string",
+    key2 = [np.arange(10),dict(key2_1=3,key2_2=np.arange(20)*2)]
+  ) 
+
+  data[6] = dict(
+    a= np.arange(100000),
+    info = "this should take very little time ...(saving long array)"
+  )
+
+  data[7] = dict(
+    a = [u'ciao',u'ciao1'],
+    info = "list of unicode"
+  )
+
+  data[8] = dict(
+    a = np.asarray([u'ciao',u'ciao1']),
+    info = "array of unicode"
+  )
+
+  data[9] = dict(
+    a = list(range(10000)),
+    info = "long list 100000 elements"
+  )
+
+  data[10] = dict(
+    a = list(range(10000)),
+    b = None,
+    info = "saving python None object"
+  )
+
+    #d1 = dict( d2 = 3, d4=np.arange(10), d6=[1,2,3], d8 = [1,2,np.arange(10)] ),
+  data[11] = dict(
+    d1 = dict( v1 = 3, v2=dict(vv1=np.arange(10)) ),
+    info = 'nested dict'
+  )
+
+
+  data[12] = dict(
+    d1 = dict( a = [1,2,3,np.arange(10)] ),
+    info = 'complex list'
+  )
+  return data
+
+def _doTest(ext="h5",folder=None):
+  data = _makeData()
   keys = list(data.keys())
   keys.sort()
   for k in keys:
     v = data[k]
-    tr,tw=saveAndRead(v,fname="/tmp/test_%02d.%s"%(k,ext))
+    tr,tw=saveAndRead(v,fname=os.path.join(folder,"test_%02d.%s"%(k,ext)))
     print("%2d read/write time %.4f,%.4f "%(k,tr,tw),end="")
     print(v["info"])
   a = np.random.random( (1000,1000) )
   tosave = dict( [ ("v%d"%i,a) for i in range(10)])
-  tr,tw=saveAndRead( tosave,fname="/tmp/test_imgs_nolink.%s"%ext )
+  tr,tw=saveAndRead( tosave,fname=os.path.join(folder,"test_imgs_nolink.%s"%ext) )
   print("   read/write time %.4f,%.4f Saving without links"%(tr,tw))
-  tr,tw=saveAndRead( tosave,fname="/tmp/test_imgs_link.%s"%ext,link_copy=True )
+  tr,tw=saveAndRead( tosave,fname=os.path.join(folder,"test_imgs_link.%s"%ext),link_copy=True )
   print("   read/write time %.4f,%.4f Saving with links"%(tr,tw))
 
-def doTest( exts = ["h5","npy","npz"] ):
+def doTest( exts = ["h5","npy","npz"], folder=None ):
+  """ folder: where to write the files (default: temporary folder, removed
+      at the end) """
   print(datastorage)
   t0 = time.time()
-  for ext in exts: 
-    print("\n\nSaving in %s\n"%ext)
-    _doTest(ext=ext)
+  tmp = folder is None
+  if tmp: folder = tempfile.mkdtemp(prefix="datastorage_test_")
+  try:
+    for ext in exts: 
+      print("\n\nSaving in %s\n"%ext)
+      _doTest(ext=ext,folder=folder)
+  finally:
+    if tmp: shutil.rmtree(folder,ignore_errors=True)
   print("\n\n")
   print("Python version: %s"%sys.version)
   print("Time to complete all tests: %.1f"%(time.time()-t0))
 
 if __name__ == "__main__": 
   doTest()
+
+
+# pytest tests: python -m pytest datastorage/test.py
+
+def _h5_address(fname, path):
+  import h5py
+  with h5py.File(fname, "r") as h5:
+    return h5py.h5o.get_info(h5[path].id).addr
+
+def test_link_copy(tmp_path):
+  """ identical arrays are saved once (as hard links), others are not """
+  a = np.random.random((20,30))
+  d = dict(
+    a = a,
+    same = a.copy(),
+    nested = dict( same = a.copy() ),
+    other = a + 1,
+    as_f4 = a.astype("f4"),
+    reshaped = a.reshape(30,20),
+  )
+  fname = str(tmp_path / "link.h5")
+  datastorage.save(fname, d, link_copy=True, raiseError=True)
+  address = _h5_address(fname, "a")
+  assert _h5_address(fname, "same") == address
+  assert _h5_address(fname, "nested/same") == address
+  for name in ("other", "as_f4", "reshaped"):
+    assert _h5_address(fname, name) != address
+  r = datastorage.read(fname)
+  assert np.array_equal(r.nested.same, a)
+  assert r.as_f4.dtype == np.float32
+
+def test_no_link_copy(tmp_path):
+  """ with link_copy=False every array is saved as a separate dataset """
+  a = np.arange(100)
+  fname = str(tmp_path / "nolink.h5")
+  datastorage.save(fname, dict(a=a, b=a.copy()), link_copy=False, raiseError=True)
+  assert _h5_address(fname, "a") != _h5_address(fname, "b")
+
+def _assert_same(expected, value):
+  """ assert that value (as read back) is equal to expected """
+  if isinstance(expected, dict):
+    for key in expected:
+      _assert_same(expected[key], value[key])
+    extra = set(value.keys()) - set(expected.keys()) - set(["filename"])
+    assert len(extra) == 0, "unexpected keys %s" % extra
+  elif isinstance(expected, np.ndarray):
+    value = np.asarray(value)
+    assert value.dtype == expected.dtype, (value.dtype, expected.dtype)
+    assert np.array_equal(value, expected)
+  elif isinstance(expected, (list, tuple)):
+    assert len(value) == len(expected)
+    for e, v in zip(expected, value):
+      _assert_same(e, v)
+  else:
+    assert value == expected, (value, expected)
+
+def _arrays_data():
+  return dict(
+    a = np.arange(10.),
+    b = dict( c = np.ones((3,4), dtype="f4"), s = "text", n = 3 ),
+    i = np.arange(5, dtype=np.int16),
+  )
+
+def test_lazy_read(tmp_path):
+  """ lazy reads return the same values, arrays are read when accessed """
+  data = _arrays_data()
+  fname = str(tmp_path / "lazy.h5")
+  datastorage.save(fname, data, raiseError=True)
+  with datastorage.read(fname, lazy=True) as lazy:
+    assert isinstance(lazy["a"], datastorage.LazyDataset)
+    assert lazy["a"].shape == data["a"].shape
+    _assert_same(data["a"][2:5], lazy["a"][2:5])
+    assert not lazy["a"].is_cached
+    _assert_same(data["a"], lazy["a"][...])
+    _assert_same(data["b"]["s"], lazy["b"]["s"])
+    assert lazy["b"]["c"].mean() == 1
+    assert lazy["b"]["c"].is_cached
+    _assert_same(data["i"] * 2, lazy["i"] * 2)
+
+def test_lazy_attributes_do_not_read(tmp_path):
+  """ only the forwarded ndarray methods read the dataset """
+  fname = str(tmp_path / "lazy.h5")
+  datastorage.save(fname, _arrays_data(), raiseError=True)
+  with datastorage.read(fname, lazy=True) as lazy:
+    a = lazy["a"]
+    assert not hasattr(a, "items")
+    assert not hasattr(a, "keys")
+    assert not a.is_cached
+    assert a.T.shape == (10,)
+    assert a.is_cached
+
+def test_lazy_cache_and_close(tmp_path):
+  """ full reads are cached within the budget, close releases the file """
+  fname = str(tmp_path / "lazy.h5")
+  data = dict( ("a%d" % i, np.full(100, i)) for i in range(5) )
+  datastorage.save(fname, data, raiseError=True)
+  budget = 2 * data["a0"].nbytes
+  with datastorage.read(fname, lazy=True, cache_bytes=budget) as lazy:
+    for i in range(5):
+      lazy["a%d" % i].read()
+    info = lazy.cache_info()
+    assert info["items"] == 2 and info["nbytes"] <= budget
+    assert lazy["a4"].is_cached and not lazy["a0"].is_cached
+  try:
+    lazy["a0"].read()
+    raise AssertionError("reading a closed file should fail")
+  except ValueError:
+    pass
+
+def _save_formats():
+  """ (file extension, save options) of every format """
+  return (
+    ("h5", dict()),
+    ("npz", dict(npz_layout="flat")),
+    ("npz", dict(npz_layout="nested")),
+    ("npy", dict()),
+    ("dsdir", dict()),
+  )
+
+def test_round_trip(tmp_path):
+  """ the dicts of doTest are read back unchanged from every format """
+  data = _makeData()
+  for ext, options in _save_formats():
+    for k, v in data.items():
+      # numpy can not save ragged lists in the (legacy) nested npz layout
+      if options.get("npz_layout") == "nested" and k in (4, 5):
+        continue
+      name = "test_%02d_%s.%s" % (k, options.get("npz_layout", ""), ext)
+      fname = str(tmp_path / name)
+      datastorage.save(fname, v, raiseError=True, **options)
+      _assert_same(v, datastorage.read(fname))
+
+def test_save_from_lazy(tmp_path):
+  """ trees read with lazy=True can be saved in every format """
+  data = _arrays_data()
+  for src, src_options in (("h5", dict()), ("npz", dict(npz_layout="flat"))):
+    fsrc = str(tmp_path / ("source.%s" % src))
+    datastorage.save(fsrc, data, raiseError=True, **src_options)
+    for ext, options in _save_formats():
+      name = "from_%s_%s.%s" % (src, options.get("npz_layout", ""), ext)
+      fname = str(tmp_path / name)
+      with datastorage.read(fsrc, lazy=True) as lazy:
+        lazy.save(fname, raiseError=True, **options)
+      _assert_same(data, datastorage.read(fname))
+
+def test_h5_loader(tmp_path):
+  """ the single pass loader reads hard linked (link_copy) datasets, empty
+      datasets and lists; readH5pyDataset/add_attrs are kept """
+  import h5py
+  from datastorage.datastorage import h5ToDict
+  a = np.arange(6.).reshape(2,3)
+  data = dict(
+    a = a,
+    g = dict(b=a, empty=np.zeros((0,3)), s="text", l=[1, "x"]),
+  )
+  fname = str(tmp_path / "loader.h5")
+  datastorage.save(fname, data, link_copy=True, raiseError=True)
+  ret = h5ToDict(fname)
+  _assert_same(data, ret)
+  assert ret["g"]["empty"].shape == (0,3)
+  ret = h5ToDict(fname, add_attrs=True)
+  assert "IS_LIST" in ret["g"]["l_attrs"]
+  ret = h5ToDict(fname, readH5pyDataset=False)
+  try:
+    assert isinstance(ret["g"]["b"], h5py.Dataset)
+    _assert_same(a, ret["g"]["b"][()])
+  finally:
+    ret["a"].file.close()
+
+def _h5_attrs(fname, path):
+  import h5py
+  with h5py.File(fname, "r") as h5:
+    return set(h5[path].attrs.keys())
+
+def test_compact_lists(tmp_path):
+  """ lists of arrays are saved stacked (same shape) or ragged """
+  same = [np.arange(3), np.arange(3)*2]
+  ragged = [np.arange(2), np.arange(5), np.arange(4)]
+  mixed = [np.arange(2), np.arange(3.)]
+  fname = str(tmp_path / "compact.h5")
+  datastorage.save(fname, dict(same=same, ragged=ragged, mixed=mixed),
+      list_encoding="compact", raiseError=True)
+  assert "IS_STACKED_LIST" in _h5_attrs(fname, "same")
+  assert "IS_RAGGED_LIST" in _h5_attrs(fname, "ragged")
+  # different dtypes are saved as one dataset per element
+  assert "IS_LIST" in _h5_attrs(fname, "mixed")
+  r = datastorage.read(fname)
+  _assert_same(same, r.same)
+  _assert_same(ragged, r.ragged)
+  _assert_same(mixed, r.mixed)
+  with datastorage.read(fname, lazy=True) as lazy:
+    _assert_same(ragged, lazy.ragged)
+
+def test_stack_lists(tmp_path):
+  """ read(stack_lists=True) returns the stacked array """
+  same = [np.arange(3), np.arange(3)*2]
+  fname = str(tmp_path / "stacked.h5")
+  datastorage.save(fname, dict(same=same), list_encoding="compact", raiseError=True)
+  _assert_same(np.asarray(same), datastorage.read(fname, stack_lists=True).same)
+
+def test_group_lists_default(tmp_path):
+  """ by default lists are saved as groups (readable by older versions) """
+  ragged = [np.arange(2), np.arange(5)]
+  fname = str(tmp_path / "group.h5")
+  datastorage.save(fname, dict(ragged=ragged), raiseError=True)
+  assert "IS_LIST" in _h5_attrs(fname, "ragged")
+  _assert_same(ragged, datastorage.read(fname).ragged)
+
+def _h5_dataset_info(fname, path):
+  import h5py
+  with h5py.File(fname, "r") as h5:
+    dataset = h5[path]
+    return dataset.compression, dataset.compression_opts, dataset.chunks
+
+def test_storage_policy(tmp_path):
+  """ compression and chunking follow the policy and its overrides """
+  images = np.zeros((20, 64, 64))
+  data = dict(
+    images = images,
+    run = dict( i0 = np.arange(1000.), i1 = np.arange(1000.)*2 ),
+    small = np.arange(10.),
+  )
+  policy = datastorage.StoragePolicy(
+    compression = "lzf",
+    overrides = { "images": dict(compression="gzip", compression_opts=6),
+                  "run/i0": None },
+  )
+  fname = str(tmp_path / "policy.h5")
+  datastorage.save(fname, data, storage_policy=policy, raiseError=True)
+  compression, opts, chunks = _h5_dataset_info(fname, "images")
+  assert (compression, opts) == ("gzip", 6)
+  assert chunks is not None and chunks[1:] == (64, 64)
+  assert _h5_dataset_info(fname, "run/i0")[0] is None
+  assert _h5_dataset_info(fname, "run/i1")[0] == "lzf"
+  # small arrays are saved contiguous
+  assert _h5_dataset_info(fname, "small") == (None, None, None)
+  _assert_same(data, datastorage.read(fname))
+
+def test_storage_policy_chunks(tmp_path):
+  """ explicit chunks are limited to the array shape, shortcuts work """
+  data = dict( a = np.arange(10000.).reshape(100, 100) )
+  fname = str(tmp_path / "chunks.h5")
+  policy = dict(chunks=(10, 500))
+  datastorage.save(fname, data, storage_policy=policy, raiseError=True)
+  assert _h5_dataset_info(fname, "a") == ("gzip", 4, (10, 100))
+  datastorage.save(fname, data, storage_policy="lzf", raiseError=True)
+  compression, _, chunks = _h5_dataset_info(fname, "a")
+  assert compression == "lzf" and chunks is not None
+  datastorage.save(fname, data, raiseError=True)
+  assert _h5_dataset_info(fname, "a") == (None, None, None)
+  _assert_same(data, datastorage.read(fname))
+
+def test_read_keys(tmp_path):
+  """ keys= reads only the selected keys (paths and glob patterns) """
+  data = dict(
+    run = dict( i0 = np.arange(3), i1 = np.arange(4), data = np.ones((2,2)) ),
+    other = dict( i0 = np.arange(5) ),
+    info = "text",
+  )
+  for ext, options in _save_formats():
+    fname = str(tmp_path / ("keys_%s.%s" % (options.get("npz_layout", ""), ext)))
+    datastorage.save(fname, data, raiseError=True, **options)
+    ret = datastorage.read(fname, keys=["run/i*"])
+    _assert_same(dict(run=dict(i0=data["run"]["i0"], i1=data["run"]["i1"])), ret)
+    ret = datastorage.read(fname, keys=["*/i0", "info"])
+    expected = dict(
+      run = dict(i0=data["run"]["i0"]), other = data["other"], info = "text"
+    )
+    _assert_same(expected, ret)
+  with datastorage.read(str(tmp_path / "keys_.h5"), keys=["run/data"], lazy=True) as lazy:
+    assert list(lazy.keys()) == ["run"] and list(lazy.run.keys()) == ["data"]
+    _assert_same(data["run"]["data"], lazy.run.data[...])
+
+def test_incremental_save(tmp_path):
+  """ incremental saves rewrite only the modified keys """
+  import h5py
+  fname = str(tmp_path / "incremental.h5")
+  datastorage.save(fname, _arrays_data(), raiseError=True)
+  d = datastorage.read(fname)
+  assert d.dirty_keys() == set()
+  address = _h5_address(fname, "i")
+  d.a = np.arange(3.)
+  d.b.s = "new text"
+  del d.b.n
+  assert d.dirty_keys() == set(["a", "b/s", "b/n"])
+  d.save(incremental=True, raiseError=True)
+  assert d.dirty_keys() == set()
+  expected = _arrays_data()
+  expected["a"] = np.arange(3.)
+  expected["b"]["s"] = "new text"
+  del expected["b"]["n"]
+  _assert_same(expected, datastorage.read(fname))
+  assert _h5_address(fname, "i") == address
+
+def test_dirty_dict_methods(tmp_path):
+  """ pop, popitem, setdefault and clear are tracked """
+  fname = str(tmp_path / "dirty.h5")
+  datastorage.save(fname, _arrays_data(), raiseError=True)
+  d = datastorage.read(fname)
+  assert np.array_equal(d.pop("a"), np.arange(10.))
+  assert not hasattr(d, "a") and d.pop("a", None) is None
+  assert d.setdefault("x", 1) == 1 and d.x == 1
+  assert d.setdefault("x", 2) == 1
+  key, value = d.b.popitem()
+  assert not hasattr(d.b, key)
+  assert d.dirty_keys() == set(["a", "x", "b/" + key])
+  d.b.clear()
+  assert len(d.b.keys()) == 0 and d.dirty_keys() >= set(["b/c", "b/s", "b/n"])
+  d.save(incremental=True, raiseError=True)
+  r = datastorage.read(fname)
+  assert sorted(r.keys()) == ["b", "i", "x"] and len(r.b.keys()) == 0
+  # clear keeps the filename (and the file r is in sync with)
+  r.clear()
+  assert r.filename == fname and r.dirty_keys() == set(["b", "i", "x"])
+  r.save(incremental=True, raiseError=True)
+  assert len(datastorage.read(fname).keys()) == 0
+
+def test_incremental_save_after_lazy_read(tmp_path):
+  """ lazy reads are not used as reference for incremental saves """
+  fname = str(tmp_path / "lazy_incremental.h5")
+  datastorage.save(fname, _arrays_data(), raiseError=True)
+  with datastorage.read(fname, lazy=True) as lazy:
+    lazy.a = np.arange(2.)
+    # saving into the file held open by the lazy read loads it in memory
+    lazy.save(fname, incremental=True, raiseError=True)
+    assert isinstance(lazy.i, np.ndarray)
+    lazy.b.c[0] = 2  # in place changes are not tracked (nor saved)
+    lazy.save(fname, incremental=True, raiseError=True)
+  expected = _arrays_data()
+  expected["a"] = np.arange(2.)
+  _assert_same(expected, datastorage.read(fname))
+
+def test_writer_same_as_unwrap(tmp_path):
+  """ DataStorageWriter files read back as unwrap of the records """
+  records = [
+    datastorage.DataStorage( x = float(i), img = np.full((2,3), i), name = "r%d" % i )
+    for i in range(7)
+  ]
+  fname = str(tmp_path / "writer.h5")
+  with datastorage.DataStorageWriter(fname, buffer_size=3) as writer:
+    for record in records:
+      writer.append(record)
+    assert len(writer) == 7
+  ret = datastorage.read(fname)
+  expected = datastorage.unwrap(records)
+  for key in ("x", "img"):
+    _assert_same(expected[key], ret[key])
+  assert list(ret["name"]) == list(expected["name"])
+  # continue appending to the same file
+  with datastorage.DataStorageWriter(fname, mode="a") as writer:
+    writer.append(records[0])
+    assert len(writer) == 8
+  assert datastorage.read(fname).img.shape == (8,2,3)
+
+def test_writer_strings_and_none(tmp_path):
+  """ unicode arrays are saved as utf8 strings, None is refused """
+  fname = str(tmp_path / "writer_strings.h5")
+  with datastorage.DataStorageWriter(fname) as writer:
+    for i in range(3):
+      writer.append(dict(labels=np.asarray(["a%d" % i, "bé"]), name="r%d" % i))
+    try:
+      writer.append(dict(labels=np.asarray(["a", "b"]), name=None))
+      raise AssertionError("None should not be accepted")
+    except ValueError as e:
+      assert "name" in str(e)
+  ret = datastorage.read(fname)
+  assert ret.labels.shape == (3,2)
+  assert list(ret.labels[2]) == ["a2", "bé"]
+  assert list(ret.name) == ["r0", "r1", "r2"]
+
+def test_writer_dtypes(tmp_path):
+  """ values are not silently cast, dtypes can be declared """
+  fname = str(tmp_path / "writer_dtypes.h5")
+  with datastorage.DataStorageWriter(fname) as writer:
+    writer.append(dict(n=1, x=1.5))
+    # int -> float is fine
+    writer.append(dict(n=2, x=2))
+    for bad in (dict(n=2.5, x=1.), dict(n="3", x=1.)):
+      try:
+        writer.append(bad)
+        raise AssertionError("%s should not be accepted" % bad)
+      except ValueError:
+        pass
+  ret = datastorage.read(fname)
+  _assert_same(np.asarray([1, 2]), ret.n)
+  with datastorage.DataStorageWriter(fname, dtypes=dict(n="f8")) as writer:
+    writer.append(dict(n=1, x=1.))
+    writer.append(dict(n=2.5, x=1.))
+  _assert_same(np.asarray([1., 2.5]), datastorage.read(fname).n)
+
+def test_read_many(tmp_path):
+  """ results are in the input order, errors follow raiseError """
+  files = []
+  for i in range(5):
+    fname = str(tmp_path / ("many_%d.h5" % i))
+    datastorage.save(fname, dict(i=i, a=np.arange(3)*i), raiseError=True)
+    files.append(fname)
+  # reversed, so that the order is not the one of the file names
+  files = files[::-1]
+  for executor in ("thread", "process"):
+    ret = datastorage.read_many(files, workers=2, executor=executor)
+    assert [r.i for r in ret] == [4, 3, 2, 1, 0]
+  ret = datastorage.read_many(files, keys=["a"], workers=1, combine=True)
+  _assert_same(np.asarray([np.arange(3)*i for i in range(4, -1, -1)]), ret.a)
+  assert "i" not in ret.keys()
+  bad = files[:2] + [str(tmp_path / "missing.h5")] + files[2:]
+  try:
+    datastorage.read_many(bad, workers=2, executor="thread")
+    raise AssertionError("missing files should raise by default")
+  except ValueError:
+    pass
+  ret = datastorage.read_many(bad, workers=2, executor="thread", raiseError=False)
+  assert ret[2] is None and [r.i for r in ret if r is not None] == [4, 3, 2, 1, 0]
+  ret = datastorage.read_many(bad, workers=2, executor="thread", raiseError=False,
+      combine=True)
+  _assert_same(np.asarray([4, 3, 2, 1, 0]), ret.i)
+
+def test_dsdir(tmp_path):
+  """ dsdir folders keep the structure, arrays are memory mapped """
+  data = _arrays_data()
+  data["l"] = [np.arange(2), "text", None]
+  data["key/with spaces"] = 1.5
+  fname = str(tmp_path / "data.dsdir")
+  datastorage.save(fname, data, raiseError=True)
+  ret = datastorage.read(fname)
+  _assert_same(data, ret)
+  assert isinstance(ret.a, np.memmap) and not ret.a.flags.writeable
+  ret = datastorage.read(fname, mmap_mode=None)
+  assert not isinstance(ret.a, np.memmap)
+  # folders that are not datastorage folders are not replaced
+  other = tmp_path / "other.dsdir"
+  other.mkdir()
+  try:
+    datastorage.save(str(other), data, raiseError=True)
+    raise AssertionError("an existing folder should not be replaced")
+  except ValueError:
+    pass
+
+def test_npz_layouts(tmp_path):
+  """ the default npz layout is the np.savez one, flat has one member per
+      array and can be read lazily """
+  data = _arrays_data()
+  fname = str(tmp_path / "nested.npz")
+  datastorage.save(fname, data, raiseError=True)
+  with np.load(fname, allow_pickle=True) as npz:
+    assert sorted(npz.files) == ["a", "b", "filename", "i"]
+  fname = str(tmp_path / "flat.npz")
+  datastorage.save(fname, data, npz_layout="flat", storage_policy="gzip",
+      raiseError=True)
+  with np.load(fname) as npz:
+    assert "b/c" in npz.files
+  with datastorage.read(fname, lazy=True) as lazy:
+    assert isinstance(lazy.b.c, datastorage.LazyDataset)
+    _assert_same(data["b"]["c"][1:], lazy.b.c[1:])
+  _assert_same(data, datastorage.read(fname))
+  # np.savez can not save lists of arrays with different shapes
+  ragged = dict(l=[np.arange(2), np.arange(3)])
+  datastorage.save(fname, ragged, npz_layout="flat", raiseError=True)
+  _assert_same(ragged, datastorage.read(fname))
+
+def test_npz_flat_lists(tmp_path):
+  """ lists of numbers (or strings) are saved as one array member, other
+      lists element by element; the manifest is stored as utf8 bytes """
+  fname = str(tmp_path / "lists.npz")
+  data = dict(
+    numbers = list(range(1000)),
+    floats = [1, 2.5],
+    names = ["a", "bc"],
+    mixed = [1, "a", None, np.arange(3)],
+    big = [2**70],
+  )
+  datastorage.save(fname, data, npz_layout="flat", raiseError=True)
+  ret = datastorage.read(fname)
+  assert isinstance(ret["numbers"], np.ndarray) and ret["numbers"].dtype.kind == "i"
+  _assert_same(np.arange(1000), ret["numbers"])
+  _assert_same(np.asarray([1, 2.5]), ret["floats"])
+  _assert_same(np.asarray(["a", "bc"]), ret["names"])
+  _assert_same(data["mixed"], ret["mixed"])
+  assert ret["big"] == [2**70]
+  with np.load(fname) as npz:
+    assert npz["__datastorage_manifest__"].dtype == np.uint8
+    assert len(npz.files) == 5
+
+def test_datastorage_dict_interface():
+  """ keys()/values()/items() are lists of the keys only, filename (and
+      the other hidden keys) are attributes still reachable as items """
+  d = datastorage.DataStorage(b=1, a=dict(c=2))
+  keys = d.keys()
+  assert keys == ["b", "a"] and d.values()[0] == 1 and d.items()[1][0] == "a"
+  assert list(d) == ["b", "a"] and isinstance(d.a, datastorage.DataStorage)
+  assert "filename" in d and d.get("filename") == d["filename"] == d.filename
+  assert "missing" not in d and d.get("missing", 3) == 3
+  # filename and _recursive are counted, as in previous versions
+  assert len(d) == 4
+  assert not hasattr(d, "missing")
+  assert "b" in dir(d)
+  d.b = 5
+  assert d["b"] == 5
+  del d.b
+  assert "b" not in d and not hasattr(d, "b")
+
+def test_datastorage_copy_and_pickle():
+  """ copies and pickles keep the hidden keys and track their own changes """
+  d = datastorage.DataStorage(b=1, a=dict(c=2), filename="store.h5")
+  d._mark_clean()
+  for c in (pickle.loads(pickle.dumps(d)), copy.copy(d), copy.deepcopy(d)):
+    assert c.filename == "store.h5" and c.keys() == d.keys() and c.a.c == 2
+    assert isinstance(c.a, datastorage.DataStorage)
+    c.new = 1
+    assert "new" not in d and "new" not in d.dirty_keys()
+
+def test_clear_keeps_filename(tmp_path):
+  """ clear and popitem remove keys only, the object can still be saved """
+  fname = str(tmp_path / "clear.h5")
+  d = datastorage.DataStorage(a=1, b=2, filename=fname)
+  assert d.popitem() == ("b", 2)
+  d.clear()
+  assert d.keys() == [] and d.filename == fname and "filename" in d
+  d.c = 3
+  d.save()
+  assert datastorage.read(fname).keys() == ["c"]
+
+def test_save_async(tmp_path):
+  """ save_async writes in background, errors are raised by wait/result """
+  data = datastorage.DataStorage(images=np.zeros((3,4)))
+  fname = str(tmp_path / "async.h5")
+  with datastorage.AsyncWriter() as writer:
+    for i in range(3):
+      data.images[i] = i
+      future = datastorage.save_async(fname, data, writer=writer)
+    writer.wait()
+    assert future.done() and future.exception() is None
+    _assert_same(data.images, datastorage.read(fname).images)
+    # the parent folder is a file: the save fails
+    (tmp_path / "not_a_folder").write_text("")
+    bad = str(tmp_path / "not_a_folder" / "async.h5")
+    future = datastorage.save_async(bad, data, writer=writer)
+    error = None
+    try:
+      writer.wait()
+    except Exception as e:
+      error = e
+    assert error is not None and future.exception() is error
+    # each error is raised once
+    writer.wait()
+
+def test_save_async_snapshots(tmp_path):
+  """ frozen arrays are read-only until written, copies are not """
+  data = datastorage.DataStorage(a=np.zeros(3))
+  with datastorage.AsyncWriter() as writer:
+    datastorage.save_async(str(tmp_path / "copy.h5"), data, writer=writer)
+    data.a[0] = 1
+    future = datastorage.save_async(
+      str(tmp_path / "freeze.h5"), data, writer=writer, snapshot="freeze"
+    )
+    assert future.done() or not data.a.flags.writeable
+    writer.wait()
+  assert data.a.flags.writeable
+  assert datastorage.read(str(tmp_path / "freeze.h5")).a[0] == 1
+
+def test_save_options(tmp_path):
+  """ save options are passed through DataStorage.save and save_async """
+  import h5py
+  data = datastorage.DataStorage(l=[np.arange(3), np.arange(3)])
+  fname = str(tmp_path / "options.h5")
+  data.save(fname, list_encoding="compact")
+  with h5py.File(fname, "r") as h5:
+    assert isinstance(h5["l"], h5py.Dataset)
+  fname = str(tmp_path / "options.npz")
+  datastorage.save_async(fname, data, npz_layout="flat").result()
+  with np.load(fname) as npz:
+    assert "l/000000" in npz.files
+  _assert_same(data.l, datastorage.read(fname).l)
+
+def test_locking(tmp_path):
+  """ locking is set per file, HDF5_USE_FILE_LOCKING is left untouched """
+  environ = os.environ.get("HDF5_USE_FILE_LOCKING")
+  data = _arrays_data()
+  fname = str(tmp_path / "locking.h5")
+  datastorage.save(fname, data, locking=False, raiseError=True)
+  _assert_same(data, datastorage.read(fname, locking=False))
+  with datastorage.read(fname, lazy=True, locking=False) as lazy:
+    _assert_same(data["a"], lazy.a[...])
+  with datastorage.DataStorageWriter(str(tmp_path / "w.h5"), locking=False) as w:
+    w.append(dict(x=1.))
+  assert os.environ.get("HDF5_USE_FILE_LOCKING") == environ
+
+def test_swmr(tmp_path):
+  """ records flushed by a swmr writer can be read while it is open """
+  fname = str(tmp_path / "swmr.h5")
+  # in the same process hdf5 needs the same locking for writer and readers
+  writer = datastorage.DataStorageWriter(fname, swmr=True, locking=False)
+  with writer:
+    for i in range(3):
+      writer.append(dict(x=float(i), img=np.full((2,2), i)))
+    writer.flush()
+    assert datastorage.read(fname, swmr=True).x.tolist() == [0, 1, 2]
+    lazy = datastorage.read(fname, lazy=True, swmr=True)
+    assert lazy.img.shape == (3,2,2)
+    writer.append(dict(x=3., img=np.full((2,2), 3)))
+    writer.flush()
+    lazy.refresh()
+    assert lazy.img.shape == (4,2,2) and lazy.img[3].max() == 3
+    lazy.close()
+
+def test_reduce(tmp_path):
+  """ block reductions give the same results as numpy on the full array """
+  images = np.random.default_rng(0).random((50,4,3))
+  fname = str(tmp_path / "reduce.h5")
+  datastorage.save(fname, dict(run=dict(images=images)), raiseError=True,
+      storage_policy=dict(compression="gzip", chunks=(7,4,3), min_bytes=0))
+  dsdir = str(tmp_path / "reduce.dsdir")
+  datastorage.save(dsdir, dict(run=dict(images=images)), raiseError=True)
+  for source, key in ((fname, "run/images"), (dsdir, "run/images"),
+      (images, None)):
+    kw = dict(block=5, workers=2)
+    assert np.allclose(datastorage.reduce(source, key, "mean", **kw),
+        images.mean(axis=0))
+    assert np.isclose(datastorage.reduce(source, key, "sum", axis=None, **kw),
+        images.sum())
+    _assert_same(images.max(axis=(1,2)),
+        datastorage.reduce(source, key, "max", axis=(1,2), **kw))
+    counts, edges = datastorage.reduce(source, key, "histogram", bins=5, **kw)
+    _assert_same(np.histogram(images, bins=5)[0], counts)
+    nhot = datastorage.reduce(source, key, lambda b: (b > 0.5).sum(axis=(1,2)),
+        **kw)
+    _assert_same((images > 0.5).sum(axis=(1,2)), nhot)
+
+def test_reduce_lazy(tmp_path):
+  """ lazy datasets are reduced by blocks aligned with the hdf5 chunks,
+      without reading (caching) the whole dataset """
+  from datastorage.chunked import _block_rows
+  images = np.arange(60.).reshape(20,3)
+  fname = str(tmp_path / "reduce_lazy.h5")
+  datastorage.save(fname, dict(images=images), raiseError=True,
+      storage_policy=dict(compression="gzip", chunks=(4,3), min_bytes=0))
+  with datastorage.read(fname, lazy=True) as lazy:
+    assert lazy.images.chunks == (4,3)
+    assert _block_rows(lazy.images.shape, 8, lazy.images.chunks, block=5) == 8
+    _assert_same(images.mean(axis=0),
+        datastorage.reduce(lazy.images, func="mean", block=5))
+    assert not lazy.images.is_cached
+
+def test_read_cache_read_only(tmp_path):
+  """ cached reads return read-only arrays in a new DataStorage """
+  fname = str(tmp_path / "cached.h5")
+  datastorage.save(fname, _arrays_data(), raiseError=True)
+  datastorage.enable_read_cache()
+  try:
+    first = datastorage.read(fname)
+    second = datastorage.read(fname)
+    assert datastorage.read_cache_info()["hits"] >= 1
+    assert not second.a.flags.writeable
+    error = None
+    try:
+      second.a[0] = 1
+    except ValueError as e:
+      error = e
+    assert error is not None, "cached arrays should be read-only"
+    second.a = np.zeros(2)
+    assert first is not second
+    _assert_same(_arrays_data(), datastorage.read(fname))
+  finally:
+    datastorage.disable_read_cache()
+
+def test_read_cache_invalidated_by_writes(tmp_path):
+  """ save, updateH5 and DataStorageWriter drop the cached results """
+  fname = str(tmp_path / "cached.h5")
+  datastorage.save(fname, dict(a=np.zeros(3)), raiseError=True)
+  datastorage.enable_read_cache()
+  try:
+    writes = (
+      lambda: datastorage.save(fname, dict(a=np.ones(3)), raiseError=True),
+      lambda: datastorage.datastorage.updateH5(fname, dict(a=np.ones(3)), ["a"]),
+      lambda: datastorage.DataStorageWriter(fname).close(),
+    )
+    for write in writes:
+      datastorage.read(fname)
+      assert datastorage.read_cache_info()["items"] == 1
+      write()
+      assert datastorage.read_cache_info()["items"] == 0
+  finally:
+    datastorage.disable_read_cache()
+
+def test_collect_stats(tmp_path):
+  """ hdf5 saves/reads are recorded per key, other formats per file """
+  data = dict(a=np.arange(10.), b=np.arange(10.), s="text", n=None,
+      g=dict(i=np.arange(3)))
+  fname = str(tmp_path / "stats.h5")
+  with datastorage.collect_stats() as stats:
+    datastorage.save(fname, data, link_copy=True, raiseError=True)
+    datastorage.read(fname)
+  saved = dict((r["path"], r) for r in stats.records if r["op"] == "save")
+  assert saved[fname]["encoding"] == "file"
+  assert saved["/a"]["nbytes"] == 80 and saved["/a"]["shape"] == (10,)
+  # b has the content of a, it is saved as a link
+  assert saved["/b"]["encoding"] == "link" and saved["/b"]["nbytes"] == 0
+  assert saved["/g"]["encoding"] == "group" and "/g/i" in saved
+  assert saved["/n"]["encoding"] == "None" and saved["/n"]["fallback"]
+  read = [r["path"] for r in stats.records if r["op"] == "read"]
+  assert "/a" in read and fname in read
+  assert all(r["encoding"] != "group" for r in stats.top(100))
+  assert stats.summary()[("save", "link")]["count"] == 1
+  assert "slowest keys" in stats.report(3)
+  # nothing is recorded outside the with block
+  datastorage.read(fname)
+  assert len(stats.records) == len(saved) + len(read)
+
+def test_collect_stats_async_and_callback(tmp_path):
+  """ save_async is recorded in the context of the caller, records can be
+      streamed to a callback """
+  records = []
+  fname = str(tmp_path / "stats.npz")
+  with datastorage.collect_stats(callback=records.append):
+    datastorage.save_async(fname, dict(a=np.arange(3))).result()
+  assert [(r["op"], r["path"], r["encoding"]) for r in records] == [
+    ("save", fname, "file")
+  ]
+
+def test_unwrap(tmp_path):
+  """ unwrap takes generators, unwraps nested records and promotes dtypes """
+  records = (dict(x=i, y=np.full(2, i), fit=dict(c=i * 0.5, ok=True))
+      for i in range(10))
+  res = datastorage.unwrap(records)
+  _assert_same(np.arange(10), res.x)
+  assert res.y.shape == (10,2)
+  _assert_same(np.arange(10) * 0.5, res.fit.c)
+  assert res.fit.ok.dtype == bool
+  # later records needing a bigger dtype (int -> float, longer strings)
+  records = [dict(x=1, s="a")] * 5000 + [dict(x=1.5, s="longer")]
+  res = datastorage.unwrap(records)
+  assert res.x.dtype == np.float64 and res.x[-1] == 1.5
+  assert res.s[-1] == "longer"
+  assert datastorage.unwrap([]).keys() == []
+  # records written by DataStorageWriter read back as unwrap
+  fname = str(tmp_path / "nested.h5")
+  records = [dict(x=float(i), fit=dict(c=i * 0.5, w=1.)) for i in range(5)]
+  with datastorage.DataStorageWriter(fname) as writer:
+    for record in records:
+      writer.append(record)
+  _assert_same(datastorage.unwrap(records), datastorage.read(fname))
+
+def test_unwrap_ragged():
+  """ keys whose values have different shapes follow the ragged policy """
+  records = [dict(a=np.arange(2)), dict(a=np.arange(3))]
+  res = datastorage.unwrap(records)
+  assert res.a.dtype == object and res.a[1].shape == (3,)
+  res = datastorage.unwrap(records, ragged="list")
+  assert isinstance(res.a, list) and len(res.a) == 2
+  error = None
+  try:
+    datastorage.unwrap(records, ragged="raise")
+  except ValueError as e:
+    error = e
+  assert error is not None
+
+def test_unicode_strings(tmp_path):
+  """ non-ascii and N-d unicode arrays are saved as utf8 hdf5 strings """
+  import h5py
+  data = dict(
+    ascii = np.asarray(["a", "bc", ""]),
+    utf8 = np.asarray(["échantillon", "ß", "日本"]),
+    grid = np.asarray([["a", "é"], ["bb", "c"]]),
+    skewed = np.asarray(["x" * 200] + ["y"] * 20),
+    scalar = np.str_("été"),
+  )
+  fname = str(tmp_path / "strings.h5")
+  datastorage.save(fname, data, raiseError=True)
+  ret = datastorage.read(fname)
+  for key in ("ascii", "utf8", "grid", "skewed"):
+    _assert_same(data[key], ret[key])
+  assert ret.scalar == "été"
+  with h5py.File(fname, "r") as h5:
+    assert h5["utf8"].dtype.kind == "S"
+    assert h5py.check_string_dtype(h5["utf8"].dtype).encoding == "utf-8"
+    # a few long strings: variable length instead of padding
+    assert h5["skewed"].dtype.kind == "O"
+
+def test_record_lists(tmp_path):
+  """ compact lists of records are saved as columns, read back as records
+      (or as columns with stack_lists) """
+  import h5py
+  records = [
+    dict(x=float(i), name="p%d" % i, profile=np.arange(3) + i, fit=dict(n=i))
+    for i in range(4)
+  ]
+  data = dict(peaks=records)
+  fname = str(tmp_path / "records.h5")
+  datastorage.save(fname, data, list_encoding="compact", raiseError=True)
+  with h5py.File(fname, "r") as h5:
+    assert "IS_RECORD_LIST" in h5["peaks"].attrs
+    assert h5["peaks/profile"].shape == (4,3)
+  _assert_same(records, datastorage.read(fname).peaks)
+  columns = datastorage.read(fname, stack_lists=True).peaks
+  _assert_same(datastorage.unwrap(records), columns)
+  with datastorage.read(fname, lazy=True) as lazy:
+    assert isinstance(lazy.peaks.profile, datastorage.LazyDataset)
+  # lists that can not be columns are saved one group per record
+  ragged = [dict(a=np.arange(2)), dict(a=np.arange(3))]
+  datastorage.save(fname, dict(l=ragged), list_encoding="compact",
+      raiseError=True)
+  _assert_same(ragged, datastorage.read(fname).l)
+  # default encoding: one group per record (readable by older versions)
+  datastorage.save(fname, data, raiseError=True)
+  with h5py.File(fname, "r") as h5:
+    assert "IS_LIST" in h5["peaks"].attrs
+
+def test_h5py_imported_lazily():
+  """ importing datastorage does not import h5py """
+  import subprocess
+  code = "import sys, datastorage; print('h5py' in sys.modules)"
+  out = subprocess.check_output([sys.executable, "-c", code])
+  assert out.decode().strip() == "False"
+
+def test_register_backend(tmp_path):
+  """ other formats can be read and saved by extension """
+  import json
+  from datastorage.backends import _backends
+  def read_json(fname, keys=None, **options):
+    with open(fname) as f:
+      return json.load(f)
+  def save_json(fname, d, **options):
+    with open(fname, "w") as f:
+      json.dump(d, f)
+  datastorage.register_backend(
+    datastorage.Backend("json", read_json, save_json), ".json"
+  )
+  try:
+    fname = str(tmp_path / "data.json")
+    datastorage.save(fname, dict(a=1, b=dict(c="x")), raiseError=True)
+    ret = datastorage.read(fname)
+    assert ret.a == 1 and ret.b.c == "x"
+    error = None
+    try:
+      datastorage.read(fname, lazy=True)
+    except ValueError as e:
+      error = e
+    assert error is not None
+  finally:
+    del _backends[".json"]
+
+def test_parallel_compression(tmp_path):
+  """ chunks compressed by the thread pool are the ones of h5py """
+  import h5py
+  rng = np.random.default_rng(0)
+  data = dict(
+    f = rng.random((37,20)),
+    i = rng.integers(0, 100, (37,20)).astype(np.uint16),
+    b = rng.random((37,20)) > 0.5,
+  )
+  fnames = []
+  for workers in (1, 3):
+    policy = datastorage.StoragePolicy(compression="gzip", chunks=(8,8),
+        min_bytes=0, workers=workers)
+    fname = str(tmp_path / ("workers%d.h5" % workers))
+    datastorage.save(fname, data, link_copy=False, storage_policy=policy,
+        raiseError=True)
+    _assert_same(data, datastorage.read(fname))
+    fnames.append(fname)
+  with h5py.File(fnames[0], "r") as serial, h5py.File(fnames[1], "r") as parallel:
+    for key in data:
+      assert serial[key].compression == parallel[key].compression == "gzip"
+      for offset in ((0,0), (32,16)):
+        assert serial[key].id.read_direct_chunk(offset) == \
+          parallel[key].id.read_direct_chunk(offset)
+
+def test_inspect(tmp_path):
+  """ inspect reads the summary index (or the hdf5 metadata) only """
+  from datastorage.datastorage import dictToH5
+  data = datastorage.DataStorage(x=np.arange(10.), n=3,
+      run=datastorage.DataStorage(name="a", y=np.ones((2,3), dtype=np.float32)))
+  for ext in ("h5", "npz"):
+    fname = str(tmp_path / ("data.%s" % ext))
+    datastorage.save(fname, data, link_copy=False, raiseError=True)
+    info = datastorage.inspect(fname)
+    assert info["x"]["shape"] == [10] and info["x"]["dtype"] == "float64"
+    assert info["run/y"]["shape"] == [2,3]
+    assert info["run"]["type"] == "group" and info["run"]["nkeys"] == 2
+    assert list(datastorage.inspect(fname, keys=["run"])) == \
+      ["run", "run/name", "run/y"]
+  fname = str(tmp_path / "stats.h5")
+  datastorage.save(fname, data, link_copy=False, index_stats=True,
+      raiseError=True)
+  x = datastorage.inspect(fname)["x"]
+  assert x["min"] == 0 and x["max"] == 9 and x["mean"] == 4.5
+  # files without index are described from their metadata
+  old = str(tmp_path / "old.h5")
+  dictToH5(old, data)
+  info = datastorage.inspect(old)
+  assert info["x"]["shape"] == [10] and info["run/y"]["dtype"] == "float32"
+
+def test_info_command(tmp_path, capsys):
+  """ python -m datastorage info prints the index as json """
+  import json
+  from datastorage.__main__ import main
+  fname = str(tmp_path / "data.h5")
+  datastorage.save(fname, dict(x=np.arange(4)), link_copy=False,
+      raiseError=True)
+  main(["info", "--json", fname])
+  info = json.loads(capsys.readouterr().out)
+  assert info[fname]["x"]["shape"] == [4]
+
+def test_packed_scalars(tmp_path):
+  """ packed scalars are read back like scalars saved as datasets """
+  data = dict(
+    i = 1, f = 1.5, b = True, s = "text", n = None,
+    f32 = np.float32(0.1), i16 = np.int16(-3), u = np.uint64(2**64-1),
+    c = 1j, long_text = "x" * 1000, g = dict(h = np.int8(7), a = np.arange(3)),
+  )
+  ret = dict()
+  for encoding in ("dataset", "packed"):
+    fname = str(tmp_path / ("%s.h5" % encoding))
+    datastorage.save(fname, data, scalar_encoding=encoding, raiseError=True)
+    ret[encoding] = datastorage.read(fname)
+  for key in ("i", "f", "b", "f32", "i16", "u", "c"):
+    for encoding in ("dataset", "packed"):
+      value = ret[encoding][key]
+      assert value == data[key]
+      assert value.dtype == np.asarray(data[key]).dtype, (encoding, key)
+  assert ret["packed"].s == "text" and ret["packed"].n is None
+  assert ret["packed"].long_text == data["long_text"]
+  assert ret["packed"].g.h.dtype == np.int8
+  # incremental saves update the packed record
+  fname = str(tmp_path / "packed.h5")
+  d = ret["packed"]
+  d.f32 = np.float16(2)
+  del d.i
+  d.save(incremental=True, scalar_encoding="packed", raiseError=True)
+  d = datastorage.read(fname)
+  assert d.f32.dtype == np.float16 and "i" not in d and d.i16 == -3
@@ -0,0 +1,224 @@
+""" streaming writer of records to hdf5 files
+
+    on-disk alternative to unwrap(), records (DataStorage or dict) are
+    appended one at a time to resizable datasets so that the full list
+    never has to be in memory
+
+    with DataStorageWriter("scan.h5") as writer:
+        for x in positions:
+            writer.append(DataStorage(x=x, img=measure(x)))
+
+    data = datastorage.read("scan.h5")  # same as unwrap(list_of_records)
+"""
+import logging
+import numpy as np
+
+from .datastorage import (
+    h5py,
+    openH5,
+    toDict,
+    _as_storage_policy,
+    _guess_chunks,
+    _invalidate_read_cache,
+)
+
+log = logging.getLogger(__name__)
+
+
+def _flatten(d, path=""):
+    """ return list of (path, value) of the leaves of nested dict d """
+    items = []
+    for key, value in d.items():
+        key_path = path + "/" + key if path else key
+        if isinstance(value, dict):
+            items.extend(_flatten(value, key_path))
+        else:
+            items.append((key_path, value))
+    return items
+
+
+def _as_array(path, value):
+    """ return the leaf value of a record as array """
+    if value is None:
+        raise ValueError(
+            "Can not append None (key %s), use a sentinel value (np.nan, -1, "
+            "...) instead" % path
+        )
+    if isinstance(value, str):
+        return np.asarray(value, dtype=h5py.string_dtype())
+    value = np.asarray(value)
+    if value.dtype.kind == "U":
+        # h5py can not save numpy unicode arrays, use variable length utf8
+        value = value.astype(h5py.string_dtype())
+    return value
+
+
+class DataStorageWriter(object):
+    """ Append records to a hdf5 file, one resizable dataset per key
+
+        The first record defines the keys (nested dict are saved as groups),
+        shapes and dtypes; every leaf of shape S is saved as a dataset of
+        shape (N,)+S where N is the number of records, all the following
+        records must have the same keys and shapes.
+
+        Parameters
+        ----------
+        fname : str
+           hdf5 file
+        buffer_size : int
+           number of records kept in memory before writing them to disk
+        storage_policy : StoragePolicy, str or dict
+           compression of the datasets (see datastorage.StoragePolicy)
+        chunk_bytes : int
+           target size of the chunks (along the records axis)
+        mode : str
+           "w" to create a new file, "a" to continue appending to the
+           datasets of an existing file
+        dtypes : dict
+           {path: dtype} dtype of the datasets (default: the dtype of the
+           first record); values that can not be cast to the dataset dtype
+           (casting="same_kind", like float to int) raise a ValueError
+        locking : bool, str or None
+           file locking (True, False, "best-effort" or None for the HDF5
+           default)
+        swmr : bool
+           single-writer/multiple-reader mode: once the datasets are created
+           (first append) other processes can read the file (with
+           datastorage.read(fname, swmr=True)) while records are appended;
+           every flush makes the new records visible to them
+    """
+
+    def __init__(
+        self,
+        fname,
+        buffer_size=100,
+        storage_policy=None,
+        chunk_bytes=1024 ** 2,
+        mode="w",
+        dtypes=None,
+        locking=None,
+        swmr=False,
+    ):
+        self.filename = str(fname)
+        self.buffer_size = buffer_size
+        self.chunk_bytes = chunk_bytes
+        self.storage_policy = _as_storage_policy(storage_policy)
+        self.dtypes = dict(dtypes) if dtypes is not None else dict()
+        self.swmr = swmr
+        self._file = openH5(fname, mode=mode, locking=locking, swmr=swmr)
+        self._paths = None
+        self._buffer = dict()
+        self._nbuffer = 0
+        self._nrecords = 0
+
+    def __len__(self):
+        """ number of appended records (including the buffered ones) """
+        return self._nrecords
+
+    def _create_dataset(self, path, value):
+        if path in self._file:
+            dataset = self._file[path]
+            if dataset.shape[1:] != value.shape or dataset.maxshape[0] is not None:
+                raise ValueError(
+                    "Can not append %s (shape %s) to existing dataset %s"
+                    % (path, value.shape, dataset)
+                )
+            return dataset
+        dtype = np.dtype(self.dtypes.get(path, value.dtype))
+        opts = dict()
+        if self.storage_policy is not None:
+            settings = self.storage_policy.settings(path)
+            if settings["compression"] is not None:
+                opts["compression"] = settings["compression"]
+                if settings["compression"] == "gzip":
+                    opts["compression_opts"] = settings["compression_opts"]
+            opts["shuffle"] = settings["shuffle"] and dtype.kind != "O"
+        # the records axis is unlimited, chunks of about chunk_bytes
+        chunks = _guess_chunks(
+            (2 ** 31,) + value.shape, dtype.itemsize, self.chunk_bytes
+        )
+        return self._file.create_dataset(
+            path,
+            shape=(0,) + value.shape,
+            maxshape=(None,) + value.shape,
+            dtype=dtype,
+            chunks=chunks,
+            **opts
+        )
+
+    def append(self, record):
+        """ add a record (DataStorage or dict) """
+        items = [
+            (path, _as_array(path, value)) for path, value in _flatten(toDict(record))
+        ]
+        if self._paths is None:
+            self._paths = dict(
+                (path, self._create_dataset(path, value)) for path, value in items
+            )
+            self._buffer = dict((path, []) for path in self._paths)
+            if self._nrecords == 0:
+                self._nrecords = min(d.shape[0] for d in self._paths.values())
+            # no new dataset can be created in swmr mode
+            if self.swmr:
+                self._file.swmr_mode = True
+        if set(path for path, _ in items) != set(self._paths):
+            raise ValueError(
+                "Record keys %s differ from the ones of the first record %s"
+                % (sorted(path for path, _ in items), sorted(self._paths))
+            )
+        for path, value in items:
+            dataset = self._paths[path]
+            if value.shape != dataset.shape[1:]:
+                raise ValueError(
+                    "Shape of %s is %s, the one of the first record was %s"
+                    % (path, value.shape, dataset.shape[1:])
+                )
+            # no silent float -> int (or number <-> string) conversions
+            if (value.dtype.kind == "O") != (dataset.dtype.kind == "O") or (
+                not np.can_cast(value.dtype, dataset.dtype, casting="same_kind")
+            ):
+                raise ValueError(
+                    "Can not append %s of type %s to dataset of type %s"
+                    % (path, value.dtype, dataset.dtype)
+                )
+        for path, value in items:
+            # strings are buffered as str (not as 0d object arrays)
+            if value.dtype.kind == "O":
+                value = value[()]
+            self._buffer[path].append(value)
+        self._nbuffer += 1
+        self._nrecords += 1
+        if self._nbuffer >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ write the buffered records to disk """
+        if self._nbuffer == 0:
+            return
+        for path, values in self._buffer.items():
+            dataset = self._paths[path]
+            n = dataset.shape[0]
+            dataset.resize(n + len(values), axis=0)
+            dataset[n:] = np.asarray(values, dtype=dataset.dtype)
+            values.clear()
+            if self.swmr:
+                dataset.flush()
+        self._nbuffer = 0
+        self._file.flush()
+        _invalidate_read_cache(self.filename)
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+            self._file = None
+            _invalidate_read_cache(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()